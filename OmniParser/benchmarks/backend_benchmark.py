@@ -0,0 +1,115 @@
+'''
+Compares the CPU inference backends against the float32 PyTorch path on real screenshots:
+icon detection latency and box agreement for the ONNX Runtime detector (fp32 and int8), and with
+--caption_model_path, caption latency and agreement of the int8 caption model.
+
+python benchmarks/backend_benchmark.py --frames imgs --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --intra_op_threads 8
+'''
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.utils import crop_icon_batch, generate_icon_captions, get_caption_model_processor, get_yolo_model, predict_yolo
+from util.onnx_backend import configure_cpu_threads
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='CPU inference backend benchmark')
+    parser.add_argument('--frames', type=str, required=True, help='Directory of screenshots')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--backends', type=str, nargs='+', default=['onnx', 'onnx-int8'], help='Detector backends compared with pytorch')
+    parser.add_argument('--caption_model_path', type=str, default=None, help='Also compares the int8 caption model when set')
+    parser.add_argument('--box_threshold', type=float, default=0.05)
+    parser.add_argument('--intra_op_threads', type=int, default=0)
+    parser.add_argument('--inter_op_threads', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--limit', type=int, default=None)
+    return parser.parse_args()
+
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def box_f1(reference: np.ndarray, boxes: np.ndarray, threshold: float = 0.5) -> float:
+    """greedy one to one matching at IoU >= threshold"""
+    if len(reference) == 0 and len(boxes) == 0:
+        return 1.0
+    if len(reference) == 0 or len(boxes) == 0:
+        return 0.0
+    iou = box_iou(reference, boxes)
+    matched = 0
+    while True:
+        i, j = np.unravel_index(iou.argmax(), iou.shape)
+        if iou[i, j] < threshold:
+            break
+        matched += 1
+        iou[i, :] = -1
+        iou[:, j] = -1
+    return 2 * matched / (len(reference) + len(boxes))
+
+
+def time_detection(model, frames, box_threshold, repeat):
+    latencies, results = [], []
+    for frame in frames:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            xyxy, _, _ = predict_yolo(model=model, image=frame, box_threshold=box_threshold, imgsz=None, scale_img=False, iou_threshold=0.1)
+            best = min(best, time.perf_counter() - start)
+        latencies.append(best * 1000)
+        results.append(xyxy.cpu().numpy())
+    return latencies, results
+
+
+def main():
+    args = parse_arguments()
+    configure_cpu_threads(args.intra_op_threads)
+    names = sorted(name for name in os.listdir(args.frames) if name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))[:args.limit]
+    frames = [Image.open(os.path.join(args.frames, name)).convert('RGB') for name in names]
+    print(f'{len(frames)} frames, {torch.get_num_threads()} torch threads')
+
+    reference_model = get_yolo_model(args.som_model_path)
+    reference_model.predict(source=frames[0], verbose=False)  # warmup
+    reference_latency, reference_boxes = time_detection(reference_model, frames, args.box_threshold, args.repeat)
+    print(f"{'detector':<12}{'p50 ms':>9}{'mean ms':>9}{'boxes':>8}{'F1@0.5':>9}")
+    print(f"{'pytorch':<12}{np.median(reference_latency):>9.1f}{np.mean(reference_latency):>9.1f}{np.mean([len(b) for b in reference_boxes]):>8.1f}{1.0:>9.3f}")
+    for backend in args.backends:
+        model = get_yolo_model(args.som_model_path, backend=backend, intra_op_threads=args.intra_op_threads, inter_op_threads=args.inter_op_threads)
+        model.predict(frames[0])  # warmup
+        latency, boxes = time_detection(model, frames, args.box_threshold, args.repeat)
+        f1 = np.mean([box_f1(ref, b) for ref, b in zip(reference_boxes, boxes)])
+        print(f"{backend:<12}{np.median(latency):>9.1f}{np.mean(latency):>9.1f}{np.mean([len(b) for b in boxes]):>8.1f}{f1:>9.3f}")
+
+    if args.caption_model_path:
+        crops = np.concatenate([
+            crop_icon_batch(boxes / np.array([frame.width, frame.height] * 2), np.asarray(frame))
+            for frame, boxes in zip(frames, reference_boxes) if len(boxes)
+        ])
+        print(f'\n{len(crops)} icon crops')
+        captions = {}
+        for name, quantize in [('float32', False), ('int8', True)]:
+            caption_model_processor = get_caption_model_processor('florence2', args.caption_model_path, device='cpu', quantize=quantize)
+            generate_icon_captions(crops[:8], caption_model_processor, '<CAPTION>')  # warmup
+            start = time.perf_counter()
+            captions[name] = generate_icon_captions(crops, caption_model_processor, '<CAPTION>')
+            elapsed = time.perf_counter() - start
+            print(f'{name:<12}{elapsed:>8.2f} s{elapsed / len(crops) * 1000:>9.1f} ms/icon')
+        same = np.mean([a == b for a, b in zip(captions['float32'], captions['int8'])])
+        print(f'identical captions int8 vs float32: {same:.3f}')
+
+
+if __name__ == '__main__':
+    main()
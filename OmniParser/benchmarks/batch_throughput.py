@@ -0,0 +1,154 @@
+'''
+Measures the throughput of batched parsing against N sequential parses of the same screens: parse_screen_batch (one
+batched detector predict, icon crops of all screens in shared caption batches) against N parse_screen calls,
+in-process, or with --url the /parse_batch/ endpoint of a running omniparserserver against N /parse/ requests.
+Reports frames/s and the speedup of the batch for each --batch_sizes.
+
+Runs on synthetic GUI-like screens (see parser_benchmark.py) and/or recorded screenshots (--frames). With
+--ocr_engine synthetic the OCR stage returns the text boxes the synthetic screens were drawn with. Without
+--caption_model_path icons are not captioned.
+
+python benchmarks/batch_throughput.py --som_model_path weights/icon_detect/model.pt --caption_model_path weights/icon_caption_florence --batch_sizes 1 4 8
+python benchmarks/batch_throughput.py --url http://localhost:8000 --frames imgs --batch_sizes 4 8 16
+'''
+
+import argparse
+import base64
+import hashlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.parser_benchmark import load_recorded_frames, synthetic_screen
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='OmniParser batch throughput benchmark')
+    parser.add_argument('--url', type=str, default=None, help='omniparserserver to benchmark over HTTP, in-process when not set')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--detector_backend', type=str, default='pytorch', choices=['pytorch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--caption_model_path', type=str, default=None, help='Florence-2 weights, icons are not captioned when not set')
+    parser.add_argument('--caption_int8', action='store_true')
+    parser.add_argument('--ocr_engine', type=str, default='synthetic', help="'synthetic' (ground truth of the synthetic screens), easyocr or paddleocr")
+    parser.add_argument('--resolution', type=str, default='1920x1080', help='Size of the synthetic screens')
+    parser.add_argument('--density', type=int, default=200, help='Elements per synthetic screen')
+    parser.add_argument('--frames', type=str, default=None, help='Directory of recorded screenshots, used instead of synthetic screens')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each batch size and mode, the fastest one is reported')
+    parser.add_argument('--box_threshold', type=float, default=0.05)
+    parser.add_argument('--intra_op_threads', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    return parser.parse_args()
+
+
+class SyntheticBatchOCREngine:
+    """OCR engine returning the text drawn on a synthetic screen, looked up by the frame's pixels: the frames of a
+    batch are read concurrently, there is no current screen"""
+    name = 'synthetic'
+
+    def __init__(self):
+        self.truths = {}
+
+    @staticmethod
+    def key(image_np):
+        return hashlib.sha1(np.ascontiguousarray(image_np).tobytes()).hexdigest()
+
+    def add(self, image, ocr_truth):
+        self.truths[self.key(np.asarray(image))] = ocr_truth
+
+    def read(self, image_np, easyocr_args=None):
+        return self.truths.get(self.key(image_np), ([], []))
+
+
+def best_of(fn, repeat):
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds)
+
+
+def in_process_runners(args, screens):
+    from util.ocr_engines import register_ocr_engine
+    from util.onnx_backend import configure_cpu_threads
+    from util.utils import get_caption_model_processor, get_yolo_model, parse_screen, parse_screen_batch
+
+    configure_cpu_threads(args.intra_op_threads)
+    if args.ocr_engine == 'synthetic':
+        engine = SyntheticBatchOCREngine()
+        for image, ocr_truth in screens:
+            engine.add(image, ocr_truth)
+        register_ocr_engine('synthetic', lambda: engine)
+    model = get_yolo_model(args.som_model_path, backend=args.detector_backend, intra_op_threads=args.intra_op_threads)
+    caption_model_processor = None
+    if args.caption_model_path:
+        caption_model_processor = get_caption_model_processor('florence2', args.caption_model_path, device='cpu', quantize=args.caption_int8)
+    ocr_kwargs = {'easyocr_args': {'text_threshold': 0.8}, 'ocr_engine': args.ocr_engine}
+    som_kwargs = {'BOX_TRESHOLD': args.box_threshold, 'output_coord_in_ratio': True, 'use_local_semantics': caption_model_processor is not None,
+                  'iou_threshold': 0.7, 'scale_img': False, 'batch_size': 128}
+    frames = [np.asarray(image) for image, _ in screens]
+
+    def sequential(n):
+        for frame in frames[:n]:
+            parse_screen(frame, model, caption_model_processor, ocr_kwargs=ocr_kwargs, **som_kwargs)
+
+    def batch(n):
+        parse_screen_batch(frames[:n], model, caption_model_processor, ocr_kwargs=ocr_kwargs, **som_kwargs)
+
+    return sequential, batch
+
+
+def http_runners(args, screens):
+    import requests
+
+    url = args.url.rstrip('/')
+    session = requests.Session()
+    payloads = []
+    for image, _ in screens:
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        payloads.append(base64.b64encode(buffer.getvalue()).decode('ascii'))
+
+    def sequential(n):
+        for payload in payloads[:n]:
+            session.post(f"{url}/parse/", json={'base64_image': payload}).raise_for_status()
+
+    def batch(n):
+        session.post(f"{url}/parse_batch/", json={'base64_images': payloads[:n]}).raise_for_status()
+
+    return sequential, batch
+
+
+def main():
+    args = parse_arguments()
+    rng = np.random.default_rng(args.seed)
+    n_max = max(args.batch_sizes)
+    if args.frames:
+        recorded = load_recorded_frames(args.frames)
+        if not recorded:
+            sys.exit(f'No screenshots in {args.frames}')
+        # recycles the recorded frames up to the largest batch
+        screens = [(recorded[i % len(recorded)], ([], [])) for i in range(n_max)]
+    else:
+        w, h = (int(v) for v in args.resolution.lower().split('x'))
+        screens = [synthetic_screen(w, h, args.density, rng) for _ in range(n_max)]
+
+    sequential, batch = http_runners(args, screens) if args.url else in_process_runners(args, screens)
+    # warmup: model initialization and first call allocations stay out of the numbers
+    sequential(1)
+    batch(min(2, n_max))
+
+    print(f"{'frames':>8}{'sequential/s':>14}{'batch/s':>10}{'speedup':>10}")
+    for n in args.batch_sizes:
+        sequential_seconds = best_of(lambda: sequential(n), args.repeat)
+        batch_seconds = best_of(lambda: batch(n), args.repeat)
+        print(f"{n:>8}{n / sequential_seconds:>14.2f}{n / batch_seconds:>10.2f}{sequential_seconds / batch_seconds:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
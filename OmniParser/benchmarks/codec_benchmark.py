@@ -0,0 +1,93 @@
+'''
+Compares the image codecs of util/image_codec.py on real frames: encode/decode time, payload size, pixel error and,
+with --ocr_engine, how much of the OCR text read on the original frame is still read on the decoded frame. The OCR
+agreement is the accuracy proxy for what the LLM sees: labels and text it can no longer read on a SOM image.
+
+python benchmarks/codec_benchmark.py --frames labeled_images --codecs png png:1 jpeg:85 jpeg:70 webp:80 webp-lossless --ocr_engine easyocr
+'''
+
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+from collections import Counter
+
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.image_codec import encode_image
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Image codec benchmark')
+    parser.add_argument('--frames', type=str, required=True, help='Directory of screenshots or SOM images (png/jpg/webp)')
+    parser.add_argument('--codecs', type=str, nargs='+', default=['png', 'png:1', 'jpeg:85', 'webp:80', 'webp-lossless'], help='Codec specs to compare')
+    parser.add_argument('--repeat', type=int, default=3, help='Encodes per frame and codec, the fastest one is reported')
+    parser.add_argument('--ocr_engine', type=str, default=None, help='easyocr or paddleocr, also measures OCR agreement with the original frame')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N frames')
+    return parser.parse_args()
+
+
+def load_frames(directory, limit=None):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))
+    return [(name, Image.open(os.path.join(directory, name)).convert('RGB')) for name in names[:limit]]
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def text_agreement(reference, text) -> float:
+    """fraction of the reference OCR words also read on the decoded frame"""
+    reference = Counter(word for line in reference for word in line.split())
+    if not reference:
+        return 1.0
+    found = Counter(word for line in text for word in line.split())
+    return sum((reference & found).values()) / sum(reference.values())
+
+
+def main():
+    args = parse_arguments()
+    frames = load_frames(args.frames, args.limit)
+    if not frames:
+        sys.exit(f'No images in {args.frames}')
+    engine = None
+    if args.ocr_engine:
+        from util.ocr_engines import get_ocr_engine
+        engine = get_ocr_engine(args.ocr_engine)
+    reference_text = {name: engine.read(np.asarray(frame), {'text_threshold': 0.8})[1] for name, frame in frames} if engine else {}
+
+    print(f'{len(frames)} frames, sizes {sorted({frame.size for _, frame in frames})}')
+    header = f"{'codec':<16}{'encode ms':>11}{'decode ms':>11}{'KiB':>10}{'b64 KiB':>10}{'PSNR dB':>10}"
+    if engine:
+        header += f"{'OCR agree':>11}"
+    print(header)
+    for codec in args.codecs:
+        encode_ms, decode_ms, sizes, b64_sizes, psnrs, agreements = [], [], [], [], [], []
+        for name, frame in frames:
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                data = encode_image(frame, codec)
+                best = min(best, time.perf_counter() - start)
+            encode_ms.append(best * 1000)
+            sizes.append(len(data))
+            b64_sizes.append(len(base64.b64encode(data)))
+            start = time.perf_counter()
+            decoded = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+            decode_ms.append((time.perf_counter() - start) * 1000)
+            psnrs.append(psnr(np.asarray(frame), decoded))
+            if engine:
+                agreements.append(text_agreement(reference_text[name], engine.read(decoded, {'text_threshold': 0.8})[1]))
+        row = f'{codec:<16}{np.mean(encode_ms):>11.1f}{np.mean(decode_ms):>11.1f}{np.mean(sizes) / 1024:>10.1f}{np.mean(b64_sizes) / 1024:>10.1f}{np.mean(psnrs):>10.1f}'
+        if engine:
+            row += f'{np.mean(agreements):>11.3f}'
+        print(row)
+
+
+if __name__ == '__main__':
+    main()
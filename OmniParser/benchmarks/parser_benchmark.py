@@ -0,0 +1,289 @@
+'''
+Benchmarks the parser hot path on CPU, without network: check_ocr_box, predict_yolo, remove_overlap_new and its
+vectorized replacement, get_som_labeled_img and parse_screen end to end. Runs on synthetic GUI-like screens
+(--resolutions x --densities, elements per screen) and/or replays a directory of recorded screenshots (--frames).
+Reports throughput, p50/p95 latency and peak RSS per stage and scenario, --output saves the results as JSON and
+--baseline compares the p50s with an earlier run to spot regressions.
+
+With --ocr_engine synthetic the OCR stage returns the text boxes the synthetic screens were drawn with (nothing on
+recorded frames), so the benchmark also runs where no OCR weights are installed. Without --caption_model_path icons
+are not captioned.
+
+python benchmarks/parser_benchmark.py --som_model_path weights/icon_detect/model.pt --ocr_engine easyocr --resolutions 1920x1080 3840x2160 --densities 50 300
+python benchmarks/parser_benchmark.py --frames imgs --caption_model_path weights/icon_caption_florence --output after.json --baseline before.json
+'''
+
+import argparse
+import gc
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from util.ocr_engines import register_ocr_engine
+from util.onnx_backend import configure_cpu_threads
+from util.utils import check_ocr_box, get_caption_model_processor, get_som_labeled_img, get_yolo_model, parse_screen, predict_yolo, remove_overlap_new, remove_overlap_vectorized
+
+STAGES = ['ocr', 'detection', 'overlap_new', 'overlap_vectorized', 'som', 'end_to_end']
+WORDS = ['File', 'Edit', 'View', 'Settings', 'Open', 'Save', 'Cancel', 'OK', 'Search', 'Downloads', 'Documents', 'Share',
+         'Print', 'Help', 'Account', 'Sign in', 'Refresh', 'Delete', 'Rename', 'Properties', 'New folder', 'Upload']
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='OmniParser pipeline benchmark')
+    parser.add_argument('--som_model_path', type=str, default='weights/icon_detect/model.pt')
+    parser.add_argument('--detector_backend', type=str, default='pytorch', choices=['pytorch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--caption_model_path', type=str, default=None, help='Florence-2 weights, icons are not captioned when not set')
+    parser.add_argument('--caption_int8', action='store_true')
+    parser.add_argument('--ocr_engine', type=str, default='synthetic', help="'synthetic' (ground truth of the synthetic screens), easyocr or paddleocr")
+    parser.add_argument('--resolutions', type=str, nargs='*', default=['1280x720', '1920x1080', '2560x1440', '3840x2160'])
+    parser.add_argument('--densities', type=int, nargs='*', default=[50, 200, 500], help='Elements per synthetic screen')
+    parser.add_argument('--screens', type=int, default=3, help='Synthetic screens per resolution and density')
+    parser.add_argument('--frames', type=str, default=None, help='Directory of recorded screenshots to replay')
+    parser.add_argument('--limit', type=int, default=None, help='Only replay the first N recorded frames')
+    parser.add_argument('--stages', type=str, nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs of each stage per screen')
+    parser.add_argument('--box_threshold', type=float, default=0.05)
+    parser.add_argument('--intra_op_threads', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help='Writes the results as JSON')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results of an earlier run, p50 changes are reported')
+    return parser.parse_args()
+
+
+def synthetic_screen(w: int, h: int, n_elements: int, rng: np.random.Generator):
+    """
+    GUI-like screenshot: title bar, side bar and a grid of buttons, text labels and icons.
+    Returns the image and its text boxes as ([4 point polygon], [text]), the format of an OCR engine's read().
+    """
+    image = Image.new('RGB', (w, h), tuple(int(c) for c in rng.integers(225, 256, 3)))
+    draw = ImageDraw.Draw(image)
+    scale = max(w / 1920, 0.5)
+    font = ImageFont.load_default(size=max(int(14 * scale), 8))
+    coords, texts = [], []
+
+    def add_text(x, y, text, fill=(20, 20, 20)):
+        x1, y1, x2, y2 = draw.textbbox((x, y), text, font=font)
+        if x2 < w and y2 < h:
+            draw.text((x, y), text, font=font, fill=fill)
+            coords.append([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+            texts.append(text)
+
+    bar = int(36 * scale)
+    draw.rectangle([0, 0, w, bar], fill=(45, 50, 60))
+    x = int(10 * scale)
+    for word in WORDS[:6]:
+        add_text(x, int(10 * scale), word, fill=(235, 235, 235))
+        x += int(90 * scale)
+    side = int(220 * scale)
+    draw.rectangle([0, bar, side, h], fill=(238, 240, 244))
+
+    # elements on a jittered grid, so dense screens stay readable instead of a pile of overlapping boxes
+    cols = max(int(np.ceil(np.sqrt(n_elements * (w - side) / (h - bar)))), 1)
+    rows = max(int(np.ceil(n_elements / cols)), 1)
+    cell_w, cell_h = (w - side) / cols, (h - bar) / rows
+    for i in range(n_elements):
+        cx = side + (i % cols) * cell_w + rng.uniform(0, cell_w * 0.2)
+        cy = bar + (i // cols) * cell_h + rng.uniform(0, cell_h * 0.2)
+        kind = rng.choice(['button', 'text', 'icon'], p=[0.35, 0.35, 0.3])
+        word = str(rng.choice(WORDS))
+        if kind == 'icon':
+            size = max(min(cell_w, cell_h) * 0.6, 6)
+            color = tuple(int(c) for c in rng.integers(0, 200, 3))
+            box = [cx, cy, cx + size, cy + size]
+            if rng.random() < 0.5:
+                draw.ellipse(box, fill=color)
+            else:
+                draw.rounded_rectangle(box, radius=size / 5, outline=color, width=max(int(2 * scale), 1))
+                draw.line([cx + size * 0.25, cy + size * 0.5, cx + size * 0.75, cy + size * 0.5], fill=color, width=max(int(2 * scale), 1))
+        elif kind == 'button':
+            x1, y1, x2, y2 = draw.textbbox((cx, cy), word, font=font)
+            pad = 6 * scale
+            draw.rounded_rectangle([x1 - pad, y1 - pad, x2 + pad, y2 + pad], radius=4 * scale, fill=(0, 103, 192))
+            add_text(cx, cy, word, fill=(255, 255, 255))
+        else:
+            add_text(cx, cy, word)
+    return image, (coords, texts)
+
+
+def load_recorded_frames(directory, limit=None):
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')))[:limit]
+    return [Image.open(os.path.join(directory, name)).convert('RGB') for name in names]
+
+
+class SyntheticOCREngine:
+    """OCR engine returning the text drawn on the current synthetic screen, no OCR cost"""
+    name = 'synthetic'
+
+    def __init__(self):
+        self.current = ([], [])
+
+    def read(self, image_np, easyocr_args=None):
+        return self.current
+
+
+def current_rss() -> int:
+    """resident set size of this process in bytes"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak of the process lifetime, kilobytes on linux, bytes on macos
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class RssSampler:
+    """polls the RSS in a background thread, peak() is the highest RSS since the last reset()"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._peak = current_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, current_rss())
+
+    def reset(self):
+        self._peak = current_rss()
+
+    def peak(self) -> int:
+        return max(self._peak, current_rss())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def measure(fn, sampler: RssSampler, repeat: int):
+    """latencies in ms of `repeat` runs of fn, peak RSS during them and the result of the last run"""
+    latencies = []
+    gc.collect()
+    sampler.reset()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, sampler.peak(), result
+
+
+def run_screen(image, ocr_truth, args, model, caption_model_processor, synthetic_engine, sampler):
+    """runs the selected stages on one screen, returns {stage: (latencies ms, peak rss bytes)}"""
+    w, h = image.size
+    ocr_kwargs = {'easyocr_args': {'text_threshold': 0.8}, 'ocr_engine': args.ocr_engine}
+    som_kwargs = {'BOX_TRESHOLD': args.box_threshold, 'output_coord_in_ratio': True, 'use_local_semantics': caption_model_processor is not None,
+                  'iou_threshold': 0.7, 'scale_img': False, 'batch_size': 128}
+    if synthetic_engine is not None:
+        synthetic_engine.current = ocr_truth
+    results = {}
+
+    # the later stages take the outputs of the earlier ones as inputs, they always run once
+    latencies, peak, ((text, ocr_bbox), _) = measure(lambda: check_ocr_box(image, display_img=False, output_bb_format='xyxy', **ocr_kwargs), sampler, args.repeat if 'ocr' in args.stages else 1)
+    if 'ocr' in args.stages:
+        results['ocr'] = (latencies, peak)
+    latencies, peak, yolo_result = measure(lambda: predict_yolo(model=model, image=image, box_threshold=args.box_threshold, imgsz=(h, w), scale_img=False, iou_threshold=0.1), sampler, args.repeat if 'detection' in args.stages else 1)
+    if 'detection' in args.stages:
+        results['detection'] = (latencies, peak)
+
+    xyxy = yolo_result[0].cpu().numpy() / np.array([w, h, w, h], dtype=np.float32)
+    icons = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in xyxy.tolist()]
+    texts = [{'type': 'text', 'bbox': [x1 / w, y1 / h, x2 / w, y2 / h], 'interactivity': False, 'content': t} for (x1, y1, x2, y2), t in zip(ocr_bbox, text)]
+    for stage, remove_overlap in [('overlap_new', remove_overlap_new), ('overlap_vectorized', remove_overlap_vectorized)]:
+        if stage in args.stages:
+            latencies, peak, _ = measure(lambda: remove_overlap(boxes=[dict(b) for b in icons], iou_threshold=0.7, ocr_bbox=[dict(t) for t in texts]), sampler, args.repeat)
+            results[stage] = (latencies, peak)
+    if 'som' in args.stages:
+        latencies, peak, _ = measure(lambda: get_som_labeled_img(image, model, ocr_bbox=ocr_bbox, ocr_text=text, caption_model_processor=caption_model_processor, yolo_result=yolo_result, **som_kwargs), sampler, args.repeat)
+        results['som'] = (latencies, peak)
+    if 'end_to_end' in args.stages:
+        latencies, peak, _ = measure(lambda: parse_screen(image, model, caption_model_processor, ocr_kwargs=ocr_kwargs, **som_kwargs), sampler, args.repeat)
+        results['end_to_end'] = (latencies, peak)
+    return results
+
+
+def summarize(latencies, peaks):
+    latencies = np.asarray(latencies)
+    return {
+        'runs': int(len(latencies)),
+        'throughput': float(1000 / latencies.mean()),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'peak_rss_mib': float(max(peaks) / 2 ** 20),
+    }
+
+
+def main():
+    args = parse_arguments()
+    configure_cpu_threads(args.intra_op_threads)
+    rng = np.random.default_rng(args.seed)
+
+    synthetic_engine = None
+    if args.ocr_engine == 'synthetic':
+        synthetic_engine = SyntheticOCREngine()
+        register_ocr_engine('synthetic', lambda: synthetic_engine)
+    model = get_yolo_model(args.som_model_path, backend=args.detector_backend, intra_op_threads=args.intra_op_threads)
+    caption_model_processor = None
+    if args.caption_model_path:
+        caption_model_processor = get_caption_model_processor('florence2', args.caption_model_path, device='cpu', quantize=args.caption_int8)
+
+    # scenario name -> list of (image, ocr ground truth)
+    scenarios = {}
+    for resolution in args.resolutions:
+        w, h = (int(v) for v in resolution.lower().split('x'))
+        for density in args.densities:
+            scenarios[f'{w}x{h}/{density}'] = [synthetic_screen(w, h, density, rng) for _ in range(args.screens)]
+    if args.frames:
+        scenarios['recorded'] = [(frame, ([], [])) for frame in load_recorded_frames(args.frames, args.limit)]
+    if not any(scenarios.values()):
+        sys.exit('Nothing to benchmark, give --resolutions/--densities or --frames')
+
+    sampler = RssSampler()
+    # warmup: model initialization and first call allocations stay out of the numbers
+    image, ocr_truth = next(screens for screens in scenarios.values() if screens)[0]
+    run_screen(image, ocr_truth, argparse.Namespace(**{**vars(args), 'repeat': 1}), model, caption_model_processor, synthetic_engine, sampler)
+
+    results = {}
+    for scenario, screens in scenarios.items():
+        collected = {}
+        for image, ocr_truth in screens:
+            for stage, (latencies, peak) in run_screen(image, ocr_truth, args, model, caption_model_processor, synthetic_engine, sampler).items():
+                collected.setdefault(stage, ([], []))
+                collected[stage][0].extend(latencies)
+                collected[stage][1].append(peak)
+        results[scenario] = {stage: summarize(*collected[stage]) for stage in args.stages if stage in collected}
+    sampler.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+    print(f"{'scenario':<20}{'stage':<20}{'runs':>6}{'frames/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'peak MiB':>10}" + (f"{'p50 vs base':>13}" if baseline else ''))
+    for scenario, stages in results.items():
+        for stage, s in stages.items():
+            row = f"{scenario:<20}{stage:<20}{s['runs']:>6}{s['throughput']:>10.2f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['peak_rss_mib']:>10.0f}"
+            if baseline:
+                base = baseline.get(scenario, {}).get(stage)
+                row += f"{(s['p50_ms'] / base['p50_ms'] - 1) * 100:>+12.1f}%" if base else f"{'-':>13}"
+            print(row)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
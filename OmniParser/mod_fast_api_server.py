@@ -1,15 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 import uvicorn
 from fastapi.responses import JSONResponse
 from loguru import logger
 from pydantic import BaseModel
+from typing import List, Literal, Optional, Union
 import torch
 from PIL import Image
 import base64
 import io
 import os
 import time
-from util.utils import get_som_labeled_img, check_ocr_box, get_caption_model_processor, get_yolo_model
+import numpy as np
+import json
+from util.utils import get_caption_model_processor, get_yolo_model, parse_screen, parse_screen_batch, render_som_image, caption_parsed_elements, to_rgb_frame
+from util.caption_cache import CaptionCache
+from util.caption_policy import CaptionPolicy
+from util.parsed_elements import ParsedElements
+from util.transport import MSGPACK_MIME_TYPE, image_bytes, msgpack_available, pack, read_upload, wants_msgpack
+from util.incremental import IncrementalParser
+from util.ocr_engines import check_line_cache, get_ocr_engine, warmup_ocr_engines
+from util.ocr_pool import get_ocr_pool
+from util.ocr_line_cache import TextLineCache
+from util.caption_batcher import CaptionBatcher
+from util.parse_store import ParseStore, SessionStore
+from util.prefork import PreforkServer
+from util.inference_executor import InferenceExecutor, QueueFullError, DeadlineExceededError
+from util.image_codec import parse_codec, codec_mime_type
+from util.onnx_backend import configure_cpu_threads
+from util.tiling import DetectionModePlanner
+from util.timing import StageTimer
 
 # Create FastAPI app
 app = FastAPI()
@@ -17,88 +36,340 @@ app = FastAPI()
 # Global variables to store models
 som_model = None
 caption_model_processor = None
+caption_cache = None
+caption_batcher = None
 device = 'cpu'
+BOX_TRESHOLD = 0.05
+# OCR engine registered in util.ocr_engines ('paddleocr' or 'easyocr'), only this one is loaded
+OCR_ENGINE = os.environ.get("OCR_ENGINE", "paddleocr")
+# OCR_PROCESSES > 1 reads frames in that many horizontal bands on a pool of OCR worker processes
+OCR_PROCESSES = int(os.environ.get("OCR_PROCESSES", "0"))
+# OCR_LINE_CACHE_SIZE > 0 (paddleocr only): the text detector runs on every frame, the recognizer only on the lines
+# not read on earlier frames, the others reuse the cached text
+OCR_LINE_CACHE_SIZE = int(os.environ.get("OCR_LINE_CACHE_SIZE", "0"))
+ocr_line_cache = TextLineCache(max_entries=OCR_LINE_CACHE_SIZE) if OCR_LINE_CACHE_SIZE > 0 else None
+OCR_ARGS = {'easyocr_args': {'paragraph': False, 'text_threshold': 0.8}, 'ocr_engine': OCR_ENGINE, 'ocr_processes': OCR_PROCESSES, 'line_cache': ocr_line_cache}
 
-class ImageRequest(BaseModel):
+# CPU inference: icon detector on ONNX Runtime ('onnx', 'onnx-int8') and int8 caption model
+DETECTOR_BACKEND = os.environ.get("DETECTOR_BACKEND", "pytorch")
+CAPTION_INT8 = os.environ.get("CAPTION_INT8", "0") == "1"
+# SERVER_WORKERS > 1 forks that many server processes from a master that loaded the models once, they share the
+# weights copy-on-write and split the cores (parse ids and incremental sessions are per worker)
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+INTRA_OP_THREADS = int(os.environ.get("INTRA_OP_THREADS", "0")) or (max(1, (os.cpu_count() or 1) // SERVER_WORKERS) if SERVER_WORKERS > 1 else 0)
+INTER_OP_THREADS = int(os.environ.get("INTER_OP_THREADS", "1"))
+
+# Icon detection on large frames: unset keeps the default pass, 'full', 'tiled', 'downscaled' or 'adaptive'
+# (full/tiled/downscaled picked per frame to stay within LATENCY_BUDGET_MS), see util.tiling
+DETECTION_MODE = os.environ.get("DETECTION_MODE") or None
+LATENCY_BUDGET_MS = float(os.environ["LATENCY_BUDGET_MS"]) if os.environ.get("LATENCY_BUDGET_MS") else None
+detection_planner = DetectionModePlanner(tile_size=int(os.environ.get("TILE_SIZE", "1280")), overlap=int(os.environ.get("TILE_OVERLAP", "128")))
+
+# Icon captions are cached in memory, CAPTION_CACHE_PATH (e.g. cache/caption_cache.sqlite) also persists them across
+# restarts in that sqlite file, shared by the SERVER_WORKERS processes, at most CAPTION_CACHE_DISK_SIZE rows
+CAPTION_CACHE_PATH = os.environ.get("CAPTION_CACHE_PATH", "")
+CAPTION_CACHE_SIZE = int(os.environ.get("CAPTION_CACHE_SIZE", "10000"))
+CAPTION_CACHE_DISK_SIZE = int(os.environ.get("CAPTION_CACHE_DISK_SIZE", "100000"))
+# Icon crops of concurrent requests arriving within this window are captioned in one generate call
+CAPTION_BATCH_WAIT_MS = float(os.environ.get("CAPTION_BATCH_WAIT_MS", "5"))
+
+# Icons smaller than CAPTION_MIN_SIZE px are dropped, identical icons of a frame are captioned once (CAPTION_DEDUPE=0 disables it)
+# and with MAX_CAPTIONS only that many unique icons are captioned per frame, largest and most repeated first
+caption_policy = CaptionPolicy(
+    min_size=int(os.environ.get("CAPTION_MIN_SIZE", "6")),
+    dedupe=os.environ.get("CAPTION_DEDUPE", "1") == "1",
+    max_captions=int(os.environ["MAX_CAPTIONS"]) if os.environ.get("MAX_CAPTIONS") else None,
+)
+
+# Codec of the SOM image when the request doesn't pick one: "png", "png:1", "jpeg:85", "webp:80", "webp-lossless"
+SOM_IMAGE_CODEC = os.environ.get("SOM_IMAGE_CODEC", "png")
+
+# Frames of structured-only parses are kept this long for /render/
+PARSE_STORE_TTL = float(os.environ.get("PARSE_STORE_TTL", "120"))
+parse_store = ParseStore(ttl=PARSE_STORE_TTL)
+
+# Incremental parse sessions (each one holds its last frame and parse) are dropped INCREMENTAL_SESSION_TTL seconds
+# after their last frame, and the least recently used ones beyond MAX_INCREMENTAL_SESSIONS
+INCREMENTAL_SESSION_TTL = float(os.environ.get("INCREMENTAL_SESSION_TTL", "600"))
+MAX_INCREMENTAL_SESSIONS = int(os.environ.get("MAX_INCREMENTAL_SESSIONS", "32"))
+incremental_parsers = SessionStore(ttl=INCREMENTAL_SESSION_TTL, max_sessions=MAX_INCREMENTAL_SESSIONS)
+
+# Parses run on INFERENCE_WORKERS threads off the event loop, INFERENCE_QUEUE_SIZE more wait for one (further
+# requests get a 429) and requests not served within INFERENCE_TIMEOUT_S (or their deadline_ms) get a 503
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_SIZE = int(os.environ.get("INFERENCE_QUEUE_SIZE", "16"))
+INFERENCE_TIMEOUT_S = float(os.environ["INFERENCE_TIMEOUT_S"]) if os.environ.get("INFERENCE_TIMEOUT_S") else None
+# Screenshots accepted by one /label_batch/ request
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "16"))
+
+inference_executor = InferenceExecutor(workers=INFERENCE_WORKERS, max_queue=INFERENCE_QUEUE_SIZE, timeout=INFERENCE_TIMEOUT_S)
+
+class LabelOptions(BaseModel):
+    # re-parse only the regions that changed since the previous frame of the same session
+    incremental: bool = False
+    session_id: str = "default"
+    # False returns only the structured elements and a parse_id, the SOM image can then be fetched from /render/
+    return_image: bool = True
+    # codec spec of the SOM image, SOM_IMAGE_CODEC when not set
+    image_codec: Optional[str] = None
+    # icons are returned uncaptioned (content null) with a parse_id, /caption/ captions the ones the agent needs
+    lazy_captions: bool = False
+    # "columnar" returns the elements struct-of-arrays in "elements" (see util.parsed_elements) instead of "coordinates"
+    elements_format: Literal["dicts", "columnar"] = "dicts"
+    # answered with a 503 when not parsed within this many ms (queueing included), INFERENCE_TIMEOUT_S when not set
+    deadline_ms: Optional[float] = None
+
+class ImageRequest(LabelOptions):
     image_base64: str
 
-@app.on_event("startup")
-async def load_models():
-    """Initialize models when the FastAPI server starts"""
+class BatchImageRequest(LabelOptions):
+    # incremental and session_id don't apply to batches
+    images_base64: List[str]
+
+class RenderRequest(BaseModel):
+    parse_id: str
+    image_codec: Optional[str] = None
+
+class CaptionRequest(BaseModel):
+    parse_id: str
+    # indices in the coordinates list of the /label/ response
+    box_ids: List[int]
+
+def load_shared_models(prefork: bool = False):
+    """Loads the model weights, in the master before the workers are forked when prefork"""
     global som_model, caption_model_processor
     
     logger.info("Loading models...")
     
     # Load SOM model
     model_path = 'weights/icon_detect/model.pt'
-    som_model = get_yolo_model(model_path)
-    som_model.to(device)
-    logger.success("SOM model loaded and moved to GPU")
+    # a PyTorch thread pool started before the fork hangs the workers, the master loads with one thread
+    configure_cpu_threads(1 if prefork else INTRA_OP_THREADS)
+    som_model = get_yolo_model(model_path, backend=DETECTOR_BACKEND, intra_op_threads=INTRA_OP_THREADS, inter_op_threads=INTER_OP_THREADS)
+    if DETECTOR_BACKEND == 'pytorch':
+        som_model.to(device)
+    logger.success(f"SOM model loaded ({DETECTOR_BACKEND})")
     
     # Load caption model
     caption_model_processor = get_caption_model_processor(
         model_name="florence2",
         model_name_or_path="weights/icon_caption_florence",
-        device=device
+        device=device,
+        quantize=CAPTION_INT8
     )
-    logger.success("Caption model loaded")
+    logger.success(f"Caption model loaded{' (int8)' if CAPTION_INT8 else ''}")
 
-async def process_image(encoded_image: str):
-    """Process a single image using the pre-loaded models"""
-    image = Image.open(io.BytesIO(base64.b64decode(encoded_image)))
-    
-    # Create temporary directory for image
-    image_dir = "image_dir"
-    os.makedirs(image_dir, exist_ok=True)
-    image_path = os.path.join(image_dir, "screenshot.png")
-    image.save(image_path)
-    
-    # Configure processing parameters
+    get_ocr_engine(OCR_ENGINE)
+    if ocr_line_cache is not None:
+        # fails at startup instead of on every parse
+        check_line_cache(OCR_ENGINE, OCR_PROCESSES)
+
+def start_worker(index: int = 0):
+    """Per-process runtime on the loaded models: CPU threads, caption batcher, OCR warm-up and worker pool, caption cache"""
+    global caption_cache, caption_batcher
+    configure_cpu_threads(INTRA_OP_THREADS)
+
+    caption_batcher = CaptionBatcher(caption_model_processor, batch_size=128, max_wait_ms=CAPTION_BATCH_WAIT_MS)
+
+    warmup_ocr_engines([OCR_ENGINE])
+    if OCR_PROCESSES > 1:
+        get_ocr_pool(OCR_ENGINE, OCR_PROCESSES).warmup()
+    logger.success(f"OCR engine {OCR_ENGINE} loaded")
+
+    caption_cache = CaptionCache(max_entries=CAPTION_CACHE_SIZE, path=CAPTION_CACHE_PATH or None, max_disk_entries=CAPTION_CACHE_DISK_SIZE)
+    logger.success(f"Caption cache ready ({CAPTION_CACHE_PATH or 'memory only'})")
+
+@app.on_event("startup")
+async def load_models():
+    """Initialize models when the FastAPI server starts, prefork workers start with them loaded"""
+    if som_model is None:
+        load_shared_models()
+    if caption_batcher is None:
+        start_worker()
+
+async def run_inference(fn, *args, deadline_ms: Optional[float] = None, **kwargs):
+    """Runs fn on the inference executor, a full queue is answered with a 429 and a missed deadline with a 503"""
+    try:
+        return await inference_executor.run(fn, *args, timeout=deadline_ms / 1000 if deadline_ms else None, **kwargs)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def get_draw_bbox_config(image):
     box_overlay_ratio = max(image.size) / 3200
-    draw_bbox_config = {
+    return {
         'text_scale': 0.8 * box_overlay_ratio,
         'text_thickness': max(int(2 * box_overlay_ratio), 1),
         'text_padding': max(int(3 * box_overlay_ratio), 1),
         'thickness': max(int(3 * box_overlay_ratio), 1),
     }
-    BOX_TRESHOLD = 0.05
-    
-    # Process OCR
-    ocr_bbox_rslt, _ = check_ocr_box(
-        image_path,
-        display_img=False,
-        output_bb_format='xyxy',
-        goal_filtering=None,
-        easyocr_args={'paragraph': False, 'text_threshold': 0.8},
-        use_paddleocr=True
+
+def log_parse_record(endpoint, latency, timings, elements):
+    """One JSON log line per parse, for dashboards: request latency, per stage seconds and caption cache counters"""
+    logger.info("parse_record " + json.dumps({
+        "endpoint": endpoint,
+        "latency": round(latency, 4),
+        "elements": elements,
+        "timings": timings,
+        "caption_cache": caption_cache.stats(),
+        "caption_policy": caption_policy.stats(),
+        "ocr_line_cache": ocr_line_cache.stats() if ocr_line_cache is not None else None,
+        "inference": inference_executor.stats(),
+    }))
+
+def store_parse(image, elements, draw_bbox_config):
+    """Keeps what /render/ needs to draw the SOM image of a structured-only parse later, image is a PIL image or an RGB frame"""
+    return parse_store.put({
+        'frame': to_rgb_frame(image),
+        'elements': elements,
+        'draw_bbox_config': draw_bbox_config,
+    })
+
+def caption_stored_parse(parse_id: str, box_ids: List[int]):
+    """caption_parsed_elements of a stored parse, None if parse_id is unknown or expired. Requests on the same parse
+    hold its lock in turn, the captions are written into the stored elements"""
+    with parse_store.locked(parse_id) as entry:
+        if entry is None:
+            return None
+        return caption_parsed_elements(entry['frame'], entry['elements'], box_ids, caption_model_processor,
+                                       caption_cache=caption_cache, caption_batcher=caption_batcher)
+
+def new_incremental_parser():
+    """IncrementalParser of a new session, on the loaded models"""
+    return IncrementalParser(
+        som_model,
+        caption_model_processor,
+        ocr_args=OCR_ARGS,
+        som_args={
+            'BOX_TRESHOLD': BOX_TRESHOLD,
+            'output_coord_in_ratio': True,
+            'use_local_semantics': True,
+            'iou_threshold': 0.7,
+            'scale_img': False,
+            'batch_size': 128,
+            'caption_cache': caption_cache,
+            'caption_batcher': caption_batcher,
+            'caption_policy': caption_policy,
+            'detection_mode': DETECTION_MODE,
+            'latency_budget_ms': LATENCY_BUDGET_MS,
+            'planner': detection_planner,
+        },
     )
-    text, ocr_bbox = ocr_bbox_rslt
+
+def process_image_incremental(encoded_image: Union[str, bytes], session_id: str, render_som: bool = True, image_codec: str = SOM_IMAGE_CODEC, lazy_captions: bool = False, base64_image: bool = True):
+    """Process the next frame of a session, only the screen regions that changed are parsed again"""
+    decode_start = time.perf_counter()
+    image = Image.open(io.BytesIO(image_bytes(encoded_image)))
+    decode_seconds = time.perf_counter() - decode_start
+    parser = incremental_parsers.get_or_create(session_id, new_incremental_parser)
+    draw_bbox_config = get_draw_bbox_config(image)
+    dino_labled_img, _, elements = parser.parse(image, draw_bbox_config=draw_bbox_config, render_som=render_som, image_codec=image_codec, lazy_captions=lazy_captions)
+    logger.info(f"Incremental parse: {parser.last_stats}")
+    timings = dict(parser.last_timings)
+    # base64 decoding happened before the parser's own decode stage
+    timings['decode'] = round(timings.get('decode', 0.0) + decode_seconds, 4)
+    timings['total'] = round(timings.get('total', 0.0) + decode_seconds, 4)
+    timings['incremental_mode'] = parser.last_stats.get('mode')
+    # the session keeps reading its last elements, /caption/ updates a copy
+    parse_id = store_parse(image, elements.copy(), draw_bbox_config) if not render_som or lazy_captions else None
+    if not base64_image and dino_labled_img is not None:
+        # the session keeps its last SOM image base64
+        dino_labled_img = base64.b64decode(dino_labled_img)
+    return dino_labled_img, elements, parse_id, timings
+
+def process_image(encoded_image: Union[str, bytes], render_som: bool = True, image_codec: str = SOM_IMAGE_CODEC, lazy_captions: bool = False, base64_image: bool = True):
+    """Process a single image using the pre-loaded models, encoded_image is base64 or the raw bytes of an upload.
+    base64_image=False returns the SOM image as bytes"""
+    start = time.perf_counter()
+    timer = StageTimer()
+    with timer.stage('decode'):
+        # one in-memory RGB frame shared by every stage, read-only, nothing goes through the filesystem
+        image = Image.open(io.BytesIO(image_bytes(encoded_image))).convert('RGB')
+        frame = np.asarray(image)
     
-    # Process image with pre-loaded models
-    dino_labled_img, _, parsed_content_list = get_som_labeled_img(
-        image_path,
+    # Configure processing parameters
+    draw_bbox_config = get_draw_bbox_config(image)
+    
+    # OCR and icon detection run concurrently, then overlap filtering, captioning and annotation
+    dino_labled_img, _, elements, timings = parse_screen(
+        frame,
         som_model,
+        caption_model_processor,
+        ocr_kwargs=OCR_ARGS,
         BOX_TRESHOLD=BOX_TRESHOLD,
         output_coord_in_ratio=True,
-        ocr_bbox=ocr_bbox,
         draw_bbox_config=draw_bbox_config,
-        caption_model_processor=caption_model_processor,
-        ocr_text=text,
-        use_local_semantics=True,
+        use_local_semantics=not lazy_captions,
         iou_threshold=0.7,
         scale_img=False,
-        batch_size=128
+        batch_size=128,
+        caption_cache=caption_cache,
+        caption_batcher=caption_batcher,
+        caption_policy=caption_policy,
+        detection_mode=DETECTION_MODE,
+        latency_budget_ms=LATENCY_BUDGET_MS,
+        planner=detection_planner,
+        render_som=render_som,
+        image_codec=image_codec,
+        timer=timer,
+        base64_image=base64_image
     )
+    parse_id = store_parse(frame, elements, draw_bbox_config) if not render_som or lazy_captions else None
     
-    # Cleanup
-    if os.path.exists(image_path):
-        os.remove(image_path)
-    
-    return dino_labled_img, parsed_content_list
+    # parse_screen's total only covers its own stages
+    timings['total'] = round(time.perf_counter() - start, 4)
+    return dino_labled_img, elements, parse_id, timings
 
-@app.post("/label/")
-async def generate(request: ImageRequest):
-    """Handle incoming requests using pre-loaded models"""
+def process_images_batch(encoded_images: List[Union[str, bytes]], render_som: bool = True, image_codec: str = SOM_IMAGE_CODEC, lazy_captions: bool = False):
+    """process_image of several screenshots at once: one batched detector predict, icon crops of all of them in shared
+    caption batches. Returns ([(SOM image, elements, parse_id) per screenshot], timings of the batch)"""
+    start = time.perf_counter()
+    timer = StageTimer()
+    with timer.stage('decode'):
+        images = [Image.open(io.BytesIO(image_bytes(encoded_image))).convert('RGB') for encoded_image in encoded_images]
+        frames = [np.asarray(image) for image in images]
+    draw_bbox_configs = [get_draw_bbox_config(image) for image in images]
+    results, timings = parse_screen_batch(
+        frames,
+        som_model,
+        caption_model_processor,
+        ocr_kwargs=OCR_ARGS,
+        draw_bbox_configs=draw_bbox_configs,
+        BOX_TRESHOLD=BOX_TRESHOLD,
+        output_coord_in_ratio=True,
+        use_local_semantics=not lazy_captions,
+        iou_threshold=0.7,
+        scale_img=False,
+        batch_size=128,
+        caption_cache=caption_cache,
+        caption_policy=caption_policy,
+        render_som=render_som,
+        image_codec=image_codec
+    )
+    parsed = []
+    for frame, draw_bbox_config, (dino_labled_img, _, elements) in zip(frames, draw_bbox_configs, results):
+        parse_id = store_parse(frame, elements, draw_bbox_config) if not render_som or lazy_captions else None
+        parsed.append((dino_labled_img, elements, parse_id))
+    timings['decode'] = round(timings.get('decode', 0.0) + timer.as_dict()['decode'], 4)
+    timings['total'] = round(time.perf_counter() - start, 4)
+    return parsed, timings
+
+def label_result(dino_labled_img, elements: ParsedElements, parse_id, request: LabelOptions, image_codec: str, binary: bool = False) -> dict:
+    """The image and elements part of a /label/ response"""
+    response = {"image": dino_labled_img}
+    if request.elements_format == "columnar":
+        response["elements"] = elements.to_wire(raw_bytes=binary)
+    else:
+        response["coordinates"] = elements.to_dicts()
+    if parse_id is not None:
+        response["parse_id"] = parse_id
+    if dino_labled_img is not None:
+        response["image_type"] = codec_mime_type(image_codec)
+    return response
+
+async def label_image(endpoint: str, image_data: Union[str, bytes], request: LabelOptions, binary: bool = False) -> dict:
+    """Response of a /label/ parse, with binary the SOM image and the columnar elements are bytes (msgpack responses)"""
     try:
         if som_model is None or caption_model_processor is None:
             raise HTTPException(
@@ -106,20 +377,107 @@ async def generate(request: ImageRequest):
                 detail="Models are not loaded yet. Please try again in a few moments."
             )
         
+        image_codec = request.image_codec or SOM_IMAGE_CODEC
+        try:
+            parse_codec(image_codec)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         logger.info("Processing request...")
         begin = time.time()
-        dino_labled_img, parsed_content_list = await process_image(request.image_base64)
+        # parse on an inference worker so concurrent requests overlap and share caption batches
+        if request.incremental:
+            dino_labled_img, elements, parse_id, timings = await run_inference(process_image_incremental, image_data, request.session_id, request.return_image, image_codec, request.lazy_captions, not binary, deadline_ms=request.deadline_ms)
+        else:
+            dino_labled_img, elements, parse_id, timings = await run_inference(process_image, image_data, request.return_image, image_codec, request.lazy_captions, not binary, deadline_ms=request.deadline_ms)
         logger.success("Request processed successfully")
         end = time.time()
         logger.success(f"Process completed sent in : {end - begin} seconds.")
+        log_parse_record(endpoint, end - begin, timings, len(elements))
         
-        return JSONResponse({
-            "image": dino_labled_img,
-            "coordinates": parsed_content_list
-        })
+        return {**label_result(dino_labled_img, elements, parse_id, request, image_codec, binary), "timings": timings}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/label/")
+async def generate(request: ImageRequest):
+    """Handle incoming requests using pre-loaded models"""
+    return JSONResponse(await label_image("/label/", request.image_base64, request))
+
+@app.post("/label/upload/")
+async def generate_upload(http_request: Request, request: LabelOptions = Depends()):
+    """/label/ with the screenshot as the raw request body (or the 'image' field of a multipart form) and the options
+    as query parameters. With 'Accept: application/msgpack' the response is msgpack, the SOM image as bytes"""
+    try:
+        image_data = await read_upload(http_request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    binary = wants_msgpack(http_request.headers.get("accept"))
+    if binary and not msgpack_available():
+        raise HTTPException(status_code=406, detail="msgpack responses need the msgpack package on the server, accept application/json")
+    response = await label_image("/label/upload/", image_data, request, binary)
+    if binary:
+        return Response(pack(response), media_type=MSGPACK_MIME_TYPE)
+    return JSONResponse(response)
+
+@app.post("/label_batch/")
+async def generate_batch(request: BatchImageRequest):
+    """/label/ of several screenshots in one call, "results" has one /label/ response (without timings) per screenshot"""
+    if som_model is None or caption_model_processor is None:
+        raise HTTPException(status_code=503, detail="Models are not loaded yet. Please try again in a few moments.")
+    if not request.images_base64:
+        raise HTTPException(status_code=400, detail="images_base64 is empty")
+    if len(request.images_base64) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} screenshots per batch, got {len(request.images_base64)}")
+    image_codec = request.image_codec or SOM_IMAGE_CODEC
+    try:
+        parse_codec(image_codec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    begin = time.time()
+    results, timings = await run_inference(process_images_batch, request.images_base64, request.return_image, image_codec, request.lazy_captions, deadline_ms=request.deadline_ms)
+    log_parse_record("/label_batch/", time.time() - begin, timings, sum(len(elements) for _, elements, _ in results))
+    return JSONResponse({"results": [label_result(*result, request, image_codec) for result in results], "timings": timings})
+
+@app.post("/render/")
+async def render(request: RenderRequest):
+    """Draws the SOM image of an earlier structured-only /label/ call"""
+    image_codec = request.image_codec or SOM_IMAGE_CODEC
+    try:
+        parse_codec(image_codec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    entry = parse_store.get(request.parse_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired parse_id, parse the screenshot again.")
+    boxes = entry['elements'].bbox
+    dino_labled_img, _ = await run_inference(render_som_image, entry['frame'], boxes, draw_bbox_config=entry['draw_bbox_config'], image_codec=image_codec)
+    return JSONResponse({"image": dino_labled_img, "image_type": codec_mime_type(image_codec)})
+
+@app.post("/caption/")
+async def caption(request: CaptionRequest):
+    """Captions icons of an earlier lazy_captions /label/ call, by their index in its coordinates list"""
+    begin = time.time()
+    try:
+        captions = await run_inference(caption_stored_parse, request.parse_id, request.box_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if captions is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired parse_id, parse the screenshot again.")
+    logger.info(f"Captioned {len(request.box_ids)} boxes of {request.parse_id} in {time.time() - begin:.3f} seconds")
+    return JSONResponse({"parse_id": request.parse_id, "captions": {str(box_id): text for box_id, text in captions.items()}})
+
+@app.get("/health/")
+async def health():
+    """Answered by the event loop while parses run, with the load of the inference workers"""
+    ready = som_model is not None and caption_model_processor is not None
+    return JSONResponse({"status": "ready" if ready else "loading", "inference": inference_executor.stats()})
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
+    if SERVER_WORKERS > 1:
+        PreforkServer(app, "127.0.0.1", 8001, workers=SERVER_WORKERS, setup=lambda: load_shared_models(prefork=True), post_fork=start_worker).run()
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=8001)
\ No newline at end of file
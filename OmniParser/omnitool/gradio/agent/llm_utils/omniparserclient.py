@@ -1,29 +1,65 @@
 import requests
+import time
 import base64
 from pathlib import Path
 from tools.screen_capture import get_screenshot
-from agent.llm_utils.utils import encode_image
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 OUTPUT_DIR = "./tmp/outputs"
 
 class OmniParserClient:
     def __init__(self, 
-                 url: str) -> None:
+                 url: str,
+                 return_som_image: bool = True,
+                 image_codec: str = None,
+                 screenshot_codec: str = None,
+                 lazy_captions: bool = False,
+                 busy_retries: int = 3,
+                 binary_transport: bool = True) -> None:
         self.url = url
+        # agents that only read screen_info don't need the server to draw the SOM image
+        self.return_som_image = return_som_image
+        # codec specs ("png:1", "jpeg:85", "webp-lossless", ...) of the SOM image and of the screenshot sent to the server,
+        # None keeps the server/VM defaults
+        self.image_codec = image_codec
+        self.screenshot_codec = screenshot_codec
+        # icons come back uncaptioned, caption() fetches the captions of the ones that matter
+        self.lazy_captions = lazy_captions
+        # the server answers 429 when its inference queue is full, the parse is retried after its Retry-After
+        self.busy_retries = busy_retries
+        # upload the screenshot as raw bytes to /parse/upload/ and, with msgpack installed, receive the SOM image as bytes
+        # instead of base64 in JSON. Falls back to /parse/ for servers without the upload endpoint
+        self.binary_transport = binary_transport
 
     def __call__(self,):
-        screenshot, screenshot_path = get_screenshot()
+        screenshot, screenshot_path = get_screenshot(codec=self.screenshot_codec)
         screenshot_path = str(screenshot_path)
-        image_base64 = encode_image(screenshot_path)
-        response = requests.post(self.url, json={"base64_image": image_base64})
-        response_json = response.json()
+        screenshot_bytes = Path(screenshot_path).read_bytes()
+        image_base64 = base64.b64encode(screenshot_bytes).decode('utf-8')
+        response_json = None
+        if self.binary_transport:
+            response_json = self._parse_upload(screenshot_bytes)
+        if response_json is None:
+            payload = {"base64_image": image_base64, "return_som_image": self.return_som_image, "image_codec": self.image_codec, "lazy_captions": self.lazy_captions}
+            response = self._post(lambda: requests.post(self.url, json=payload))
+            response.raise_for_status()
+            response_json = response.json()
         print('omniparser latency:', response_json['latency'])
 
-        som_image_data = base64.b64decode(response_json['som_image_base64'])
         screenshot_path_uuid = Path(screenshot_path).stem.replace("screenshot_", "")
-        som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.png"
-        with open(som_screenshot_path, "wb") as f:
-            f.write(som_image_data)
+        som_image_data = response_json.pop('som_image', None)
+        if som_image_data is None and response_json.get('som_image_base64') is not None:
+            som_image_data = base64.b64decode(response_json['som_image_base64'])
+        if som_image_data is not None:
+            # the agents send the SOM image on to the LLM as base64
+            response_json.setdefault('som_image_base64', base64.b64encode(som_image_data).decode('utf-8'))
+            som_image_ext = response_json.get('som_image_type', 'image/png').split('/')[-1]
+            som_screenshot_path = f"{OUTPUT_DIR}/screenshot_som_{screenshot_path_uuid}.{som_image_ext}"
+            with open(som_screenshot_path, "wb") as f:
+                f.write(som_image_data)
         
         response_json['width'] = screenshot.size[0]
         response_json['height'] = screenshot.size[1]
@@ -31,6 +67,38 @@ class OmniParserClient:
         response_json['screenshot_uuid'] = screenshot_path_uuid
         response_json = self.reformat_messages(response_json)
         return response_json
+
+    def _post(self, send):
+        """response of send(), retried while the server answers 429"""
+        response = send()
+        for _ in range(self.busy_retries):
+            if response.status_code != 429:
+                break
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+            response = send()
+        return response
+
+    def _parse_upload(self, screenshot_bytes: bytes):
+        """parse response of the binary upload endpoint, None when the server doesn't have it"""
+        params = {"return_som_image": str(self.return_som_image).lower(), "lazy_captions": str(self.lazy_captions).lower()}
+        if self.image_codec:
+            params["image_codec"] = self.image_codec
+        headers = {"Content-Type": "application/octet-stream", "Accept": "application/msgpack" if msgpack is not None else "application/json"}
+        url = self.url.rstrip("/") + "/upload/"
+        response = self._post(lambda: requests.post(url, params=params, data=screenshot_bytes, headers=headers))
+        if response.status_code in (404, 405):
+            self.binary_transport = False
+            return None
+        response.raise_for_status()
+        if response.headers.get("Content-Type", "").startswith("application/msgpack"):
+            return msgpack.unpackb(response.content, raw=False)
+        return response.json()
+
+    def caption(self, parse_id: str, box_ids: list) -> dict:
+        """{box id: caption} of icons of a lazy_captions parse, from the server's /caption/ endpoint"""
+        response = requests.post(self.url.replace("/parse/", "/caption/"), json={"parse_id": parse_id, "box_ids": box_ids})
+        response.raise_for_status()
+        return {int(box_id): text for box_id, text in response.json()["captions"].items()}
     
     def reformat_messages(self, response_json: dict):
         screen_info = ""
@@ -39,6 +107,7 @@ class OmniParserClient:
             if element['type'] == 'text':
                 screen_info += f'ID: {idx}, Text: {element["content"]}\n'
             elif element['type'] == 'icon':
-                screen_info += f'ID: {idx}, Icon: {element["content"]}\n'
+                # icons of a lazy_captions parse have no caption yet
+                screen_info += f'ID: {idx}, Icon: {element["content"] if element["content"] is not None else "(not captioned)"}\n'
         response_json['screen_info'] = screen_info
         return response_json
\ No newline at end of file
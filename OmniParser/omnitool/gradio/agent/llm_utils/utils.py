@@ -10,4 +10,10 @@ def is_image_path(text):
 def encode_image(image_path):
     """Encode image file to base64."""
     with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
\ No newline at end of file
+        return base64.b64encode(image_file.read()).decode("utf-8")
+
+def format_parse_timings(timings, stages=("decode", "ocr", "detection", "caption", "annotate", "encode")):
+    """ "ocr 0.41s | detection 0.22s | ..." from the per stage timings of an OmniParser response, "" if there are none"""
+    if not timings:
+        return ""
+    return " | ".join(f"{stage} {timings[stage]:.2f}s" for stage in stages if stage in timings)
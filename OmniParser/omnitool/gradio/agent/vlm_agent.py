@@ -12,7 +12,7 @@ from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock, B
 
 from agent.llm_utils.oaiclient import run_oai_interleaved
 from agent.llm_utils.groqclient import run_groq_interleaved
-from agent.llm_utils.utils import is_image_path
+from agent.llm_utils.utils import is_image_path, format_parse_timings
 import time
 import re
 
@@ -137,6 +137,8 @@ class VLMAgent:
             raise ValueError(f"Model {self.model} not supported")
         latency_vlm = time.time() - start
         self.output_callback(f"LLM: {latency_vlm:.2f}s, OmniParser: {latency_omniparser:.2f}s", sender="bot")
+        if parsed_screen.get('timings'):
+            self.output_callback(f"OmniParser stages: {format_parse_timings(parsed_screen['timings'])}", sender="bot")
 
         print(f"{vlm_response}")
         
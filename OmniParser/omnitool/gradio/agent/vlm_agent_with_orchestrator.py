@@ -14,7 +14,7 @@ from anthropic.types.beta import BetaMessage, BetaTextBlock, BetaToolUseBlock, B
 
 from agent.llm_utils.oaiclient import run_oai_interleaved
 from agent.llm_utils.groqclient import run_groq_interleaved
-from agent.llm_utils.utils import is_image_path
+from agent.llm_utils.utils import is_image_path, format_parse_timings
 import time
 import re
 import os
@@ -200,6 +200,8 @@ class VLMOrchestratedAgent:
         
         # Update step counter with both latencies
         self.output_callback(f'<i>Step {self.step_count} | OmniParser: {latency_omniparser:.2f}s | LLM: {latency_vlm:.2f}s</i>', )
+        if parsed_screen.get('timings'):
+            self.output_callback(f"<i>OmniParser stages: {format_parse_timings(parsed_screen['timings'])}</i>", )
 
         print(f"{vlm_response}")
         
@@ -55,7 +55,8 @@ def sampling_loop_sync(
     Synchronous agentic sampling loop for the assistant/tool interaction of computer use.
     """
     print('in sampling_loop_sync, model:', model)
-    omniparser_client = OmniParserClient(url=f"http://{omniparser_url}/parse/")
+    # the Anthropic actor only reads the parsed elements, it doesn't need the SOM image
+    omniparser_client = OmniParserClient(url=f"http://{omniparser_url}/parse/", return_som_image=(model != "claude-3-5-sonnet-20241022"))
     if model == "claude-3-5-sonnet-20241022":
         # Register Actor and Executor
         actor = AnthropicActor(
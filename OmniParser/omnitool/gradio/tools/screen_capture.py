@@ -7,23 +7,30 @@ from io import BytesIO
 
 OUTPUT_DIR = "./tmp/outputs"
 
-def get_screenshot(resize: bool = False, target_width: int = 1920, target_height: int = 1080):
-    """Capture screenshot by requesting from HTTP endpoint - returns native resolution unless resized"""
+def get_screenshot(resize: bool = False, target_width: int = 1920, target_height: int = 1080, codec: str = None):
+    """Capture screenshot by requesting from HTTP endpoint - returns native resolution unless resized
+
+    codec: image codec the VM encodes the screenshot with (png, png:<compress level>, jpeg:<quality>, webp:<quality>,
+    webp-lossless), PNG at default compression when None. The saved file keeps that format.
+    """
     output_dir = Path(OUTPUT_DIR)
     output_dir.mkdir(parents=True, exist_ok=True)
-    path = output_dir / f"screenshot_{uuid4().hex}.png"
     
     try:
-        response = requests.get('http://localhost:5000/screenshot')
+        response = requests.get('http://localhost:5000/screenshot', params={'codec': codec} if codec else None)
         if response.status_code != 200:
             raise ToolError(f"Failed to capture screenshot: HTTP {response.status_code}")
         
         # (1280, 800)
         screenshot = Image.open(BytesIO(response.content))
+        path = output_dir / f"screenshot_{uuid4().hex}.{screenshot.format.lower()}"
         
         if resize and screenshot.size != (target_width, target_height):
             screenshot = screenshot.resize((target_width, target_height))
-        screenshot.save(path)
+            screenshot.save(path)
+        else:
+            # already encoded by the VM, no need to encode it again
+            path.write_bytes(response.content)
         return screenshot, path
     except Exception as e:
         raise ToolError(f"Failed to capture screenshot: {str(e)}")
\ No newline at end of file
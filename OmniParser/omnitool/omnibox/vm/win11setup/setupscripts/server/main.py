@@ -60,6 +60,20 @@ def execute_command():
                 'message': str(e)
             }), 500
 
+def parse_codec(codec):
+    """(PIL format, mimetype, save kwargs) of a codec spec, same specs as OmniParser's util/image_codec.py"""
+    name, _, level = codec.lower().partition(':')
+    level = int(level) if level else None
+    if name == 'png':
+        return 'PNG', 'image/png', {} if level is None else {'compress_level': level}
+    if name in ('jpeg', 'jpg'):
+        return 'JPEG', 'image/jpeg', {'quality': 85 if level is None else level}
+    if name == 'webp':
+        return 'WEBP', 'image/webp', {'quality': 85 if level is None else level}
+    if name == 'webp-lossless':
+        return 'WEBP', 'image/webp', {'lossless': True, 'quality': 80 if level is None else level}
+    raise ValueError(f"Unknown image codec {codec!r}")
+
 @app.route('/screenshot', methods=['GET'])
 def capture_screen_with_cursor():    
     cursor_path = os.path.join(os.path.dirname(__file__), "cursor.png")
@@ -71,11 +85,17 @@ def capture_screen_with_cursor():
     screenshot.paste(cursor, (cursor_x, cursor_y), cursor)
     
 
-    # Convert PIL Image to bytes and send
+    # Convert PIL Image to bytes and send, ?codec=png|png:<compress level>|jpeg:<quality>|webp:<quality>|webp-lossless
+    try:
+        image_format, mimetype, save_args = parse_codec(request.args.get('codec', 'png'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if image_format == 'JPEG':
+        screenshot = screenshot.convert('RGB')
     img_io = BytesIO()
-    screenshot.save(img_io, 'PNG')
+    screenshot.save(img_io, image_format, **save_args)
     img_io.seek(0)
-    return send_file(img_io, mimetype='image/png')
+    return send_file(img_io, mimetype=mimetype)
 
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=args.port)
\ No newline at end of file
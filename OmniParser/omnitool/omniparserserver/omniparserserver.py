@@ -1,17 +1,25 @@
 '''
 python -m omniparserserver --som_model_path ../../weights/icon_detect/model.pt --caption_model_name florence2 --caption_model_path ../../weights/icon_caption_florence --device cuda --BOX_TRESHOLD 0.05
+python -m omniparserserver --workers 4  # models loaded once, shared by 4 forked worker processes
 '''
 
 import sys
 import os
 import time
-from fastapi import FastAPI
+import json
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
+from typing import List, Literal, Optional
 import argparse
 import uvicorn
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(root_dir)
 from util.omniparser import Omniparser
+from util.image_codec import parse_codec, codec_mime_type
+from util.parsed_elements import ParsedElements
+from util.transport import MSGPACK_MIME_TYPE, msgpack_available, pack, read_upload, wants_msgpack
+from util.prefork import PreforkServer
+from util.inference_executor import InferenceExecutor, QueueFullError, DeadlineExceededError
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description='Omniparser API')
@@ -20,6 +28,31 @@ def parse_arguments():
     parser.add_argument('--caption_model_path', type=str, default='../../weights/icon_caption_florence', help='Path to the caption model')
     parser.add_argument('--device', type=str, default='cpu', help='Device to run the model')
     parser.add_argument('--BOX_TRESHOLD', type=float, default=0.05, help='Threshold for box detection')
+    parser.add_argument('--ocr_engine', type=str, default='easyocr', choices=['easyocr', 'paddleocr'], help='OCR engine, only this one is loaded')
+    parser.add_argument('--ocr_processes', type=int, default=0, help='OCR worker processes, > 1 reads the frame in that many horizontal bands in parallel')
+    parser.add_argument('--ocr_line_cache_size', type=int, default=0, help='paddleocr only: text lines cached, > 0 runs the recognizer only on lines not read on earlier frames')
+    parser.add_argument('--caption_cache_size', type=int, default=10000, help='Number of icon captions kept in memory')
+    parser.add_argument('--caption_cache_path', type=str, default=None, help='Optional sqlite file persisting icon captions across restarts, shared by the --workers processes')
+    parser.add_argument('--caption_cache_disk_size', type=int, default=100000, help='Icon captions kept in the --caption_cache_path file')
+    parser.add_argument('--caption_batch_wait_ms', type=float, default=5.0, help='How long icon crops wait for concurrent requests to join their caption batch')
+    parser.add_argument('--caption_min_size', type=int, default=6, help='Icons narrower or shorter than this many pixels are dropped instead of captioned')
+    parser.add_argument('--no_caption_dedupe', dest='caption_dedupe', action='store_false', help='Caption every copy of identical icons of a frame')
+    parser.add_argument('--max_captions', type=int, default=None, help='Unique icons captioned per frame, largest and most repeated first, no cap when not set')
+    parser.add_argument('--parse_store_ttl', type=float, default=120.0, help='Seconds the frame of a structured-only parse stays available to /render/')
+    parser.add_argument('--som_image_codec', type=str, default='png', help='Default codec of the SOM image: png, png:<compress level>, jpeg:<quality>, webp:<quality> or webp-lossless')
+    parser.add_argument('--detector_backend', type=str, default='pytorch', choices=['pytorch', 'onnx', 'onnx-int8'], help='Icon detector runtime, the ONNX model is exported next to som_model_path on first use')
+    parser.add_argument('--caption_int8', action='store_true', help='Dynamic int8 quantization of the caption model (cpu only)')
+    parser.add_argument('--intra_op_threads', type=int, default=0, help='Threads per operator for ONNX Runtime and PyTorch on cpu, 0 for the runtime default')
+    parser.add_argument('--inter_op_threads', type=int, default=1, help='Operators run in parallel on cpu')
+    parser.add_argument('--detection_mode', type=str, default=None, choices=['full', 'tiled', 'downscaled', 'adaptive'], help='Icon detection on large frames, the default single pass when not set')
+    parser.add_argument('--latency_budget_ms', type=float, default=None, help='Detection latency budget of the adaptive mode')
+    parser.add_argument('--tile_size', type=int, default=1280, help='Tile size of the tiled detection mode')
+    parser.add_argument('--tile_overlap', type=int, default=128, help='Overlap of neighbouring tiles, larger than the biggest icon')
+    parser.add_argument('--inference_workers', type=int, default=2, help='Requests parsed concurrently, on worker threads off the event loop')
+    parser.add_argument('--inference_queue_size', type=int, default=16, help='Requests waiting for an inference worker, further ones are rejected with a 429')
+    parser.add_argument('--request_timeout', type=float, default=None, help='Seconds a request may wait and run before it is answered with a 503, no deadline when not set')
+    parser.add_argument('--max_batch_size', type=int, default=16, help='Screenshots accepted by one /parse_batch/ request')
+    parser.add_argument('--workers', type=int, default=1, help='Server processes, > 1 forks them from a master that loaded the models once (parse ids and sessions are per worker)')
     parser.add_argument('--host', type=str, default='0.0.0.0', help='Host for the API')
     parser.add_argument('--port', type=int, default=8000, help='Port for the API')
     args = parser.parse_args()
@@ -29,23 +62,145 @@ args = parse_arguments()
 config = vars(args)
 
 app = FastAPI()
-omniparser = Omniparser(config)
+# built in __main__, once per server (prefork: in the master, shared by the workers)
+omniparser: Optional[Omniparser] = None
+inference_executor = InferenceExecutor(workers=args.inference_workers, max_queue=args.inference_queue_size, timeout=args.request_timeout)
 
-class ParseRequest(BaseModel):
+class ParseOptions(BaseModel):
+    # False skips drawing the SOM image, the response then carries a parse_id for /render/
+    return_som_image: bool = True
+    # codec spec of the SOM image, --som_image_codec when not set
+    image_codec: Optional[str] = None
+    # icons are returned uncaptioned (content null) with a parse_id, /caption/ captions the ones the agent needs
+    lazy_captions: bool = False
+    # "columnar" returns the elements struct-of-arrays in parsed_elements (see util.parsed_elements) instead of parsed_content_list
+    elements_format: Literal["dicts", "columnar"] = "dicts"
+    # answered with a 503 when not parsed within this many ms (queueing included), --request_timeout when not set
+    deadline_ms: Optional[float] = None
+
+class ParseRequest(ParseOptions):
     base64_image: str
 
+class ParseBatchRequest(ParseOptions):
+    base64_images: List[str]
+
+class RenderRequest(BaseModel):
+    parse_id: str
+    image_codec: Optional[str] = None
+
+class CaptionRequest(BaseModel):
+    parse_id: str
+    # indices in parsed_content_list
+    box_ids: List[int]
+
+def check_codec(image_codec: Optional[str]) -> str:
+    image_codec = image_codec or omniparser.som_image_codec
+    try:
+        parse_codec(image_codec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return image_codec
+
+async def run_inference(fn, *args, deadline_ms: Optional[float] = None):
+    """fn(*args) on an inference worker, a full queue is answered with a 429 and a missed deadline with a 503"""
+    try:
+        return await inference_executor.run(fn, *args, timeout=deadline_ms / 1000 if deadline_ms else None)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+    except DeadlineExceededError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def run_parse(endpoint: str, image_data, options: ParseOptions, binary: bool = False):
+    """response of a parse, with binary the SOM image and the columnar elements are bytes (msgpack responses)"""
+    image_codec = check_codec(options.image_codec)
+    print('start parsing...')
+    start = time.time()
+    # parse on an inference worker so concurrent requests overlap and share caption batches
+    dino_labled_img, elements, parse_id, timings = await run_inference(omniparser.parse, image_data, options.return_som_image, image_codec, options.lazy_captions, not binary, deadline_ms=options.deadline_ms)
+    latency = time.time() - start
+    # one JSON line per parse: request latency (queueing included) and the seconds of each parse stage
+    print('parse_record', json.dumps({'endpoint': endpoint, 'latency': round(latency, 4), 'elements': len(elements), 'timings': timings, 'caption_cache': omniparser.caption_cache.stats(), 'caption_policy': omniparser.caption_policy.stats(), 'ocr_line_cache': omniparser.ocr_line_cache.stats() if omniparser.ocr_line_cache is not None else None, 'inference': inference_executor.stats()}))
+    return {**parse_result(dino_labled_img, elements, parse_id, options, image_codec, binary), 'latency': latency, 'timings': timings}
+
+def parse_result(dino_labled_img, elements: ParsedElements, parse_id, options: ParseOptions, image_codec: str, binary: bool = False):
+    response = {"som_image" if binary else "som_image_base64": dino_labled_img}
+    if options.elements_format == "columnar":
+        response['parsed_elements'] = elements.to_wire(raw_bytes=binary)
+    else:
+        response['parsed_content_list'] = elements.to_dicts()
+    if parse_id is not None:
+        response['parse_id'] = parse_id
+    if dino_labled_img is not None:
+        response['som_image_type'] = codec_mime_type(image_codec)
+    return response
+
 @app.post("/parse/")
 async def parse(parse_request: ParseRequest):
-    print('start parsing...')
+    return await run_parse('/parse/', parse_request.base64_image, parse_request)
+
+@app.post("/parse/upload/")
+async def parse_upload(request: Request, options: ParseOptions = Depends()):
+    """/parse/ with the screenshot as the raw request body (or the 'image' field of a multipart form) and the options as
+    query parameters. With 'Accept: application/msgpack' the response is msgpack, the SOM image as bytes in 'som_image'"""
+    try:
+        image_data = await read_upload(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    binary = wants_msgpack(request.headers.get('accept'))
+    if binary and not msgpack_available():
+        raise HTTPException(status_code=406, detail="msgpack responses need the msgpack package on the server, accept application/json")
+    response = await run_parse('/parse/upload/', image_data, options, binary)
+    if binary:
+        return Response(pack(response), media_type=MSGPACK_MIME_TYPE)
+    return response
+
+@app.post("/parse_batch/")
+async def parse_batch(batch_request: ParseBatchRequest):
+    """/parse/ of several screenshots in one call: one batched detector pass and shared caption batches, 'results' has
+    one /parse/ response (without latency and timings) per screenshot, in order"""
+    if not batch_request.base64_images:
+        raise HTTPException(status_code=400, detail="base64_images is empty")
+    if len(batch_request.base64_images) > args.max_batch_size:
+        raise HTTPException(status_code=413, detail=f"At most {args.max_batch_size} screenshots per batch, got {len(batch_request.base64_images)}")
+    image_codec = check_codec(batch_request.image_codec)
     start = time.time()
-    dino_labled_img, parsed_content_list = omniparser.parse(parse_request.base64_image)
+    results, timings = await run_inference(omniparser.parse_batch, batch_request.base64_images, batch_request.return_som_image, image_codec, batch_request.lazy_captions, deadline_ms=batch_request.deadline_ms)
     latency = time.time() - start
-    print('time:', latency)
-    return {"som_image_base64": dino_labled_img, "parsed_content_list": parsed_content_list, 'latency': latency}
+    print('parse_record', json.dumps({'endpoint': '/parse_batch/', 'latency': round(latency, 4), 'images': len(results), 'elements': sum(len(elements) for _, elements, _ in results), 'timings': timings, 'caption_cache': omniparser.caption_cache.stats(), 'caption_policy': omniparser.caption_policy.stats(), 'inference': inference_executor.stats()}))
+    return {'results': [parse_result(*result, batch_request, image_codec) for result in results], 'latency': latency, 'timings': timings}
+
+@app.post("/render/")
+async def render(render_request: RenderRequest):
+    image_codec = check_codec(render_request.image_codec)
+    som_image_base64 = await run_inference(omniparser.render, render_request.parse_id, image_codec)
+    if som_image_base64 is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired parse_id, parse the screenshot again.")
+    return {"som_image_base64": som_image_base64, "som_image_type": codec_mime_type(image_codec)}
+
+@app.post("/caption/")
+async def caption(caption_request: CaptionRequest):
+    try:
+        captions = await run_inference(omniparser.caption, caption_request.parse_id, caption_request.box_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if captions is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired parse_id, parse the screenshot again.")
+    return {"parse_id": caption_request.parse_id, "captions": {str(box_id): text for box_id, text in captions.items()}}
 
 @app.get("/probe/")
 async def root():
-    return {"message": "Omniparser API ready"}
+    return {"message": "Omniparser API ready", "inference": inference_executor.stats()}
+
+def load_models():
+    global omniparser
+    omniparser = Omniparser(config, start=args.workers <= 1)
 
 if __name__ == "__main__":
-    uvicorn.run("omniparserserver:app", host=args.host, port=args.port, reload=True)
\ No newline at end of file
+    if args.workers > 1:
+        if not config['intra_op_threads']:
+            # the cores are split between the workers
+            config['intra_op_threads'] = max(1, (os.cpu_count() or 1) // args.workers)
+        PreforkServer(app, args.host, args.port, workers=args.workers, setup=load_models, post_fork=lambda index: omniparser.start()).run()
+    else:
+        load_models()
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
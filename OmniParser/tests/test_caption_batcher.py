@@ -0,0 +1,70 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import pytest
+
+caption_batcher = pytest.importorskip("util.caption_batcher")
+
+
+@pytest.fixture
+def fake_generate(monkeypatch):
+    calls = []
+
+    def generate(crops, caption_model_processor, prompt, batch_size=128):
+        calls.append(len(crops))
+        time.sleep(0.01)
+        return [f'{prompt} {int(crop[0, 0, 0])}' for crop in crops]
+
+    monkeypatch.setattr(caption_batcher, 'generate_icon_captions', generate)
+    return calls
+
+
+def crops_of(*values):
+    return np.stack([np.full((64, 64, 3), value, dtype=np.uint8) for value in values])
+
+
+def test_concurrent_requests_share_batches(fake_generate):
+    batcher = caption_batcher.CaptionBatcher(None, batch_size=128, max_wait_ms=50)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, batcher.caption(crops_of(i, i + 1), 'icon'))) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+    assert results == {i: [f'icon {i}', f'icon {i + 1}'] for i in range(4)}
+    assert sum(fake_generate) == 8 and len(fake_generate) < 4
+
+
+def test_close_with_requests_in_flight(fake_generate, monkeypatch):
+    entered, release = threading.Event(), threading.Event()
+
+    class SlowPutQueue(queue.Queue):
+        """holds a request between the closed check of caption() and its put, where close() used to slip in"""
+
+        def put(self, item, *args, **kwargs):
+            if item is not None:
+                entered.set()
+                release.wait(1)
+            super().put(item, *args, **kwargs)
+
+    monkeypatch.setattr(caption_batcher.queue, 'Queue', SlowPutQueue)
+    batcher = caption_batcher.CaptionBatcher(None, batch_size=4, max_wait_ms=1)
+    results = []
+    caller = threading.Thread(target=lambda: results.append(batcher.caption(crops_of(7), 'icon')), daemon=True)
+    caller.start()
+    entered.wait(1)
+    closer = threading.Thread(target=batcher.close, daemon=True)
+    closer.start()
+    time.sleep(0.05)
+    release.set()
+    caller.join(2)
+    closer.join(2)
+    # the request queued while closing is captioned, not left behind the shutdown sentinel
+    assert not caller.is_alive() and not closer.is_alive()
+    assert results == [['icon 7']]
+    with pytest.raises(RuntimeError):
+        batcher.caption(crops_of(0), 'icon')
+    batcher.close()
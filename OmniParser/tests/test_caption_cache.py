@@ -0,0 +1,45 @@
+import sqlite3
+
+from util.caption_cache import CaptionCache
+
+
+def disk_rows(path):
+    with sqlite3.connect(path) as db:
+        return dict(db.execute("SELECT key, caption FROM captions ORDER BY rowid").fetchall())
+
+
+def test_memory_only_by_default():
+    cache = CaptionCache(max_entries=2)
+    cache.put_many({'a': 'A', 'b': 'B', 'c': 'C'})
+    assert cache.get_many(['a', 'b', 'c']) == [None, 'B', 'C']
+
+
+def test_disk_writes_are_batched(tmp_path):
+    path = str(tmp_path / 'captions.sqlite')
+    cache = CaptionCache(path=path, flush_every=3, flush_interval=3600)
+    cache.put_many({'a': 'A', 'b': 'B'})
+    assert disk_rows(path) == {} and cache.get_many(['a']) == ['A']
+    cache.put_many({'c': 'C'})
+    assert disk_rows(path) == {'a': 'A', 'b': 'B', 'c': 'C'}
+    cache.put_many({'d': 'D'})
+    cache.flush()
+    assert CaptionCache(path=path).get_many(['d']) == ['D']
+
+
+def test_disk_keeps_the_latest_rows(tmp_path):
+    path = str(tmp_path / 'captions.sqlite')
+    cache = CaptionCache(path=path, max_disk_entries=3, flush_every=1)
+    for key in 'abcde':
+        cache.put_many({key: key.upper()})
+    cache.put_many({'c': 'C2'})
+    assert disk_rows(path) == {'d': 'D', 'e': 'E', 'c': 'C2'}
+
+
+def test_disk_file_is_shared_in_wal_mode(tmp_path):
+    path = str(tmp_path / 'captions.sqlite')
+    first, second = CaptionCache(path=path, flush_every=1), CaptionCache(path=path, flush_every=1)
+    first.put_many({'a': 'A'})
+    second.put_many({'b': 'B'})
+    assert second.get_many(['a']) == ['A'] and first.get_many(['b']) == ['B']
+    with sqlite3.connect(path) as db:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
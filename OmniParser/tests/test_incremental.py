@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from util.parsed_elements import ParsedElements
+
+incremental = pytest.importorskip("util.incremental")
+
+
+@pytest.fixture
+def parsed_frames(monkeypatch):
+    """parse_screen without models, records the image each full parse gets"""
+    frames = []
+
+    def parse_screen(image_source, model, caption_model_processor, render_som=True, timer=None, **kwargs):
+        frames.append(image_source)
+        elements = ParsedElements.from_columns([[0.25, 0.25, 0.5, 0.5]], ['icon'], [True], [None], ['box_yolo_content_yolo'])
+        return ('som' if render_som else None), {'0': [0.25, 0.25, 0.25, 0.25]}, elements, {}
+
+    monkeypatch.setattr(incremental, 'parse_screen', parse_screen)
+    monkeypatch.setattr(incremental, 'render_som_image', lambda frame, boxes, **kwargs: ('rendered', {'0': [0.25, 0.25, 0.25, 0.25]}))
+    return frames
+
+
+def screen():
+    return Image.fromarray(np.full((64, 96, 3), 120, dtype=np.uint8))
+
+
+def test_full_parse_gets_the_decoded_frame(parsed_frames):
+    parser = incremental.IncrementalParser(None, None)
+    parser.parse(screen().convert('RGBA'))
+    assert len(parsed_frames) == 1 and isinstance(parsed_frames[0], np.ndarray) and parsed_frames[0].shape == (64, 96, 3)
+
+
+def test_unchanged_frame_without_som_image(parsed_frames):
+    parser = incremental.IncrementalParser(None, None)
+    assert parser.parse(screen())[0] == 'som'
+    som_image, label_coordinates, elements = parser.parse(screen(), render_som=False)
+    assert parser.last_stats['mode'] == 'unchanged'
+    assert som_image is None and list(label_coordinates) == ['0'] and len(elements) == 1
+    # the SOM image drawn earlier is still returned when asked for
+    assert parser.parse(screen())[0] == 'som'
+
+
+def test_unchanged_frame_renders_a_missing_som_image(parsed_frames):
+    parser = incremental.IncrementalParser(None, None)
+    assert parser.parse(screen(), render_som=False)[0] is None
+    assert parser.parse(screen(), render_som=False)[0] is None
+    assert parser.parse(screen())[0] == 'rendered'
+    assert len(parsed_frames) == 1
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+box_annotator = pytest.importorskip("util.box_annotator")
+
+
+class Boxes:
+    """the part of supervision's Detections get_optimal_label_pos reads"""
+
+    def __init__(self, xyxy):
+        self.xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.xyxy)
+
+
+def random_layout(rng, n, w, h):
+    xy = rng.uniform(-20, [w, h], (n, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(0, [w / 6, h / 6], (n, 2))], axis=1)
+    # crowded clusters (labels mostly overlapping), exact duplicates and degenerate boxes
+    cluster = rng.uniform(0, [w, h]) + rng.normal(0, 15, (n // 3, 2))
+    boxes[:n // 3] = np.concatenate([cluster, cluster + rng.uniform(5, 40, (n // 3, 2))], axis=1)
+    if n > 4:
+        boxes[-1] = boxes[0]
+        boxes[-2, 2:] = boxes[-2, :2]
+    text_sizes = rng.integers(0, [60, 25], (n, 2))
+    return boxes.astype(int), text_sizes
+
+
+# the per-box IoU divides 0 by 0 on degenerate boxes (nan, no overlap)
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('seed', range(200))
+def test_batched_matches_get_optimal_label_pos(seed):
+    rng = np.random.default_rng(seed)
+    w, h = int(rng.integers(100, 1920)), int(rng.integers(100, 1080))
+    boxes, text_sizes = random_layout(rng, int(rng.integers(0, 80)), w, h)
+    text_padding = int(rng.integers(0, 6))
+    # small chunks split the overlap matrix, as on dense screens
+    chunk_size = int(rng.choice([64, 4_000_000]))
+    batched = box_annotator.get_optimal_label_positions(text_padding, text_sizes, boxes, (w, h), chunk_size=chunk_size)
+    detections = Boxes(boxes)
+    expected = [box_annotator.get_optimal_label_pos(text_padding, tw, th, x1, y1, x2, y2, detections, (w, h))
+                for (x1, y1, x2, y2), (tw, th) in zip(boxes.tolist(), text_sizes.tolist())]
+    assert batched.tolist() == [list(position) for position in expected]
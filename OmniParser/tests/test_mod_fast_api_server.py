@@ -0,0 +1,95 @@
+import base64
+import io
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from util.parse_store import SessionStore
+from util.parsed_elements import ParsedElements
+
+server = pytest.importorskip("mod_fast_api_server")
+utils = pytest.importorskip("util.utils")
+
+
+class FakeIncrementalParser:
+    """IncrementalParser without models: a full parse on the first frame, unchanged afterwards"""
+
+    def __init__(self, *args, **kwargs):
+        self.frames = 0
+        self.last_stats = {}
+        self.last_timings = {}
+
+    def parse(self, image, draw_bbox_config=None, render_som=True, image_codec=None, lazy_captions=False):
+        self.frames += 1
+        self.last_stats = {'mode': 'full' if self.frames == 1 else 'unchanged'}
+        self.last_timings = {'decode': 0.001, 'total': 0.01}
+        som_image = base64.b64encode(b'som').decode() if render_som else None
+        return som_image, {}, ParsedElements.from_columns([[0.1, 0.1, 0.2, 0.2]], ['icon'], [True], [None], ['box_yolo_content_yolo'])
+
+
+def encode_png(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 200, 200)).save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+@pytest.fixture
+def fake_parser(monkeypatch):
+    monkeypatch.setattr(server, 'IncrementalParser', FakeIncrementalParser)
+    monkeypatch.setattr(server, 'incremental_parsers', SessionStore(ttl=60, max_sessions=2))
+
+
+def test_incremental_parse_reuses_the_session(fake_parser):
+    image = encode_png()
+    som_image, elements, parse_id, timings = server.process_image_incremental(image, 'session-a')
+    assert som_image == base64.b64encode(b'som').decode()
+    assert len(elements) == 1 and parse_id is None
+    assert timings['incremental_mode'] == 'full'
+    # the base64 decoding of the request is added to the parser's own decode stage
+    assert timings['decode'] >= 0.001 and timings['total'] >= 0.01
+
+    _, _, _, timings = server.process_image_incremental(image, 'session-a')
+    assert timings['incremental_mode'] == 'unchanged'
+    _, _, _, timings = server.process_image_incremental(image, 'session-b')
+    assert timings['incremental_mode'] == 'full'
+
+
+def test_incremental_parse_of_an_upload(fake_parser):
+    som_image, _, parse_id, _ = server.process_image_incremental(base64.b64decode(encode_png()), 'upload', render_som=True, lazy_captions=True, base64_image=False)
+    assert som_image == b'som'
+    assert server.parse_store.get(parse_id) is not None
+
+
+def test_incremental_sessions_are_bounded(fake_parser):
+    image = encode_png()
+    for session_id in ['a', 'b', 'c']:
+        server.process_image_incremental(image, session_id)
+    assert len(server.incremental_parsers) == 2 and 'a' not in server.incremental_parsers
+    _, _, _, timings = server.process_image_incremental(image, 'a')
+    assert timings['incremental_mode'] == 'full'
+
+
+def test_concurrent_captions_of_a_parse(monkeypatch):
+    calls = []
+
+    def slow_captions(boxes, starting_idx, frame, caption_model_processor, **kwargs):
+        calls.append(len(boxes))
+        time.sleep(0.05)
+        return [f'icon {i}' for i in range(len(boxes))]
+
+    monkeypatch.setattr(utils, 'get_parsed_content_icon', slow_captions)
+    elements = ParsedElements.from_columns([[0.1, 0.1, 0.2, 0.2], [0.3, 0.3, 0.4, 0.4]], ['icon', 'icon'], [True, True], [None, None], ['box_yolo_content_yolo'] * 2)
+    parse_id = server.store_parse(np.zeros((48, 64, 3), dtype=np.uint8), elements, None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(server.caption_stored_parse(parse_id, [0, 1]))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # the first request captions both icons, the others wait for it and read its captions
+    assert calls == [2]
+    assert results == [{0: 'icon 0', 1: 'icon 1'}] * 4
+    assert server.caption_stored_parse('unknown', [0]) is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from util.ocr_engines import check_line_cache, register_ocr_engine
+from util.ocr_line_cache import TextLineCache
+
+
+class ReadOnlyEngine:
+    def read(self, image_np, easyocr_args=None):
+        return [], []
+
+
+class CachedEngine(ReadOnlyEngine):
+    """reads the top and bottom halves of the frame as two text lines, recognizing only the uncached ones"""
+
+    def read_cached(self, image_np, easyocr_args, line_cache):
+        h, w = image_np.shape[:2]
+        boxes = [[[0, 0], [w, 0], [w, h // 2], [0, h // 2]], [[0, h // 2], [w, h // 2], [w, h], [0, h]]]
+        crops = [image_np[:h // 2], image_np[h // 2:]]
+        keys = [line_cache.make_key(crop) for crop in crops]
+        results = line_cache.get_many(keys)
+        miss_idx = [i for i, result in enumerate(results) if result is None]
+        for i in miss_idx:
+            results[i] = (f'line {int(crops[i].mean())}', 0.99)
+        line_cache.put_many({keys[i]: results[i] for i in miss_idx})
+        line_cache.record_frame(len(boxes), len(miss_idx))
+        return boxes, [text for text, _ in results]
+
+
+def test_line_cache_needs_cached_recognition_in_process():
+    register_ocr_engine('test-read-only', ReadOnlyEngine)
+    register_ocr_engine('test-cached', CachedEngine)
+    check_line_cache('test-cached')
+    check_line_cache('test-cached', ocr_processes=1)
+    with pytest.raises(ValueError, match='test-read-only'):
+        check_line_cache('test-read-only')
+    with pytest.raises(ValueError, match='ocr_processes=2'):
+        check_line_cache('test-cached', ocr_processes=2)
+
+
+def test_check_ocr_box_reuses_cached_lines():
+    utils = pytest.importorskip("util.utils")
+    register_ocr_engine('test-cached', CachedEngine)
+    line_cache = TextLineCache()
+    frame = np.zeros((40, 80, 3), dtype=np.uint8)
+    (text, _), _ = utils.check_ocr_box(frame, display_img=False, output_bb_format='xyxy', ocr_engine='test-cached', line_cache=line_cache)
+    stats = line_cache.stats()
+    assert text == ['line 0', 'line 0'] and (stats['hits'], stats['misses']) == (0, 2)
+    # the bottom line changed, the top one is read from the cache
+    frame[20:] = 200
+    (text, bbox), _ = utils.check_ocr_box(frame, display_img=False, output_bb_format='xyxy', ocr_engine='test-cached', line_cache=line_cache)
+    assert text == ['line 0', 'line 200'] and [list(box) for box in bbox] == [[0, 0, 80, 20], [0, 20, 80, 40]]
+    stats = line_cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 3) and stats['last_frame'] == {'lines': 2, 'recognized': 1, 'reused': 1}
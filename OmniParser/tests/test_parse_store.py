@@ -0,0 +1,49 @@
+import threading
+import time
+
+from util.parse_store import ParseStore, SessionStore
+
+
+def test_parse_store_expires_entries():
+    store = ParseStore(ttl=0.05, max_entries=2)
+    first = store.put({'n': 1})
+    assert store.get(first) == {'n': 1}
+    store.put({'n': 2})
+    store.put({'n': 3})
+    assert store.get(first) is None and len(store) == 2
+    time.sleep(0.06)
+    assert len(store) == 2 and store.get('unknown') is None and len(store) == 0
+
+
+def test_parse_store_locks_each_entry():
+    store = ParseStore(ttl=60)
+    parse_id = store.put({'n': 1})
+    with store.locked('unknown') as entry:
+        assert entry is None
+    with store.locked(parse_id) as entry:
+        waiting = threading.Thread(target=lambda: store.locked(parse_id).__enter__())
+        waiting.start()
+        waiting.join(0.05)
+        assert entry == {'n': 1} and waiting.is_alive()
+        # other entries and plain reads are not blocked
+        with store.locked(store.put({'n': 2})) as other:
+            assert other == {'n': 2} and store.get(parse_id) == {'n': 1}
+    waiting.join(1)
+    assert not waiting.is_alive()
+
+
+def test_session_store_drops_least_recently_used():
+    store = SessionStore(ttl=60, max_sessions=2)
+    a = store.get_or_create('a', object)
+    store.get_or_create('b', object)
+    assert store.get_or_create('a', object) is a
+    store.get_or_create('c', object)
+    assert 'a' in store and 'b' not in store and len(store) == 2
+
+
+def test_session_store_expires_idle_sessions():
+    store = SessionStore(ttl=0.05, max_sessions=8)
+    a = store.get_or_create('a', object)
+    time.sleep(0.06)
+    assert 'a' not in store
+    assert store.get_or_create('a', object) is not a
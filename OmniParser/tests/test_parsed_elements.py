@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from util.parsed_elements import ParsedElements
+
+
+def sample_elements():
+    # bboxes exact in float32, the dtype of the bbox column
+    return [
+        {'type': 'text', 'bbox': [0.0, 0.0, 0.125, 0.0625], 'interactivity': False, 'content': 'File', 'source': 'box_ocr_content_ocr'},
+        {'type': 'icon', 'bbox': [0.25, 0.25, 0.375, 0.3125], 'interactivity': True, 'content': 'File ', 'source': 'box_yolo_content_ocr'},
+        {'type': 'icon', 'bbox': [0.5, 0.5, 0.5625, 0.75], 'interactivity': True, 'content': None, 'source': 'box_yolo_content_yolo'},
+    ]
+
+
+def assert_same(a, b):
+    assert a.to_dicts() == b.to_dicts()
+
+
+@pytest.mark.parametrize('wire', [dict(), dict(binary=False), dict(raw_bytes=True)])
+def test_wire_round_trip(wire):
+    elements = ParsedElements.from_dicts(sample_elements())
+    assert_same(ParsedElements.from_wire(elements.to_wire(**wire)), elements)
+    assert_same(ParsedElements.from_bytes(elements.to_bytes()), elements)
+
+
+def test_from_columns_matches_from_dicts():
+    dicts = sample_elements()
+    columns = ParsedElements.from_columns(np.array([elem['bbox'] for elem in dicts]), [elem['type'] for elem in dicts], [elem['interactivity'] for elem in dicts],
+                                          [elem['content'] for elem in dicts], [elem['source'] for elem in dicts])
+    assert_same(columns, ParsedElements.from_dicts(dicts))
+    assert columns.content.tolist() == [0, 1, -1]
+
+
+def test_concatenate_and_take_keep_rows():
+    dicts = sample_elements()
+    first, second = ParsedElements.from_dicts(dicts[:2]), ParsedElements.from_dicts(dicts[2:] + dicts[:1])
+    merged = ParsedElements.concatenate([first, second])
+    assert merged.to_dicts() == dicts + dicts[:1]
+    # strings and sources shared by both parts are stored once
+    assert merged.strings == ['File', 'File '] and len(merged.sources) == 3
+    assert merged.take([3, 2, 0]).to_dicts() == [dicts[0], dicts[2], dicts[0]]
+    assert len(ParsedElements.concatenate([])) == 0
+
+
+def test_set_content_on_wire_arrays():
+    elements = ParsedElements.from_wire(ParsedElements.from_dicts(sample_elements()).to_wire())
+    # columns decoded from the wire are read-only buffers
+    elements.set_content(2, 'folder icon', 'box_yolo_content_yolo')
+    elements.set_content(0, 'File', 'box_ocr_content_ocr')
+    assert elements.content_of(2) == 'folder icon' and elements[2]['source'] == 'box_yolo_content_yolo'
+    assert elements.to_dicts()[:2] == sample_elements()[:2]
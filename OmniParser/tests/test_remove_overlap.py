@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+utils = pytest.importorskip("util.utils")
+
+
+def random_elements(rng, n_icons, n_texts):
+    def boxes(n, max_w, max_h):
+        xy = rng.uniform(0, 1, (n, 2))
+        return np.clip(np.concatenate([xy, xy + rng.uniform(0.002, [max_w, max_h], (n, 2))], axis=1), 0, 1).tolist()
+
+    icons = [{'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None} for box in boxes(n_icons, 0.1, 0.1)]
+    # some icons nested in others and text lines inside icons, the cases the merge rules are about
+    for icon in icons[:n_icons // 4]:
+        x1, y1, x2, y2 = icon['bbox']
+        icons.append({'type': 'icon', 'bbox': [x1, y1, (x1 + x2) / 2, (y1 + y2) / 2], 'interactivity': True, 'content': None})
+    texts = [{'type': 'text', 'bbox': box, 'interactivity': False, 'content': f'text {i}'} for i, box in enumerate(boxes(n_texts, 0.15, 0.03))]
+    for i, icon in enumerate(icons[:n_texts // 4]):
+        x1, y1, x2, y2 = icon['bbox']
+        texts.append({'type': 'text', 'bbox': [x1, y1, x2, (y1 + y2) / 2], 'interactivity': False, 'content': f'inner {i}'})
+    return icons, texts
+
+
+@pytest.mark.parametrize('seed', range(300))
+def test_vectorized_matches_remove_overlap_new(seed):
+    rng = np.random.default_rng(seed)
+    icons, texts = random_elements(rng, int(rng.integers(0, 60)), int(rng.integers(0, 40)))
+    iou_threshold = float(rng.choice([0.1, 0.7, 0.9]))
+    expected = utils.remove_overlap_new([dict(icon) for icon in icons], iou_threshold, [dict(text) for text in texts] or None)
+    assert utils.remove_overlap_vectorized(icons, iou_threshold, texts or None) == expected
+
+
+def test_vectorized_matches_on_a_dense_screen():
+    # above the dense broadcast limit, candidate pairs come from the GridIndex
+    icons, texts = random_elements(np.random.default_rng(0), 600, 400)
+    expected = utils.remove_overlap_new([dict(icon) for icon in icons], 0.7, [dict(text) for text in texts])
+    assert utils.remove_overlap_vectorized(icons, 0.7, texts) == expected
@@ -0,0 +1,35 @@
+import numpy as np
+
+from util.spatial_index import GridIndex
+
+
+def random_boxes(rng, n, max_size=0.3):
+    xy = rng.uniform(0, 1, (n, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(0, max_size, (n, 2))], axis=1)
+    if n:
+        # inverted boxes are never returned
+        boxes[0] = [0.5, 0.5, 0.4, 0.4]
+    return boxes
+
+
+def touching(rect, box):
+    return rect[2] >= rect[0] and rect[3] >= rect[1] and box[2] >= box[0] and box[3] >= box[1] and \
+        box[0] <= rect[2] and box[2] >= rect[0] and box[1] <= rect[3] and box[3] >= rect[1]
+
+
+def test_query_pairs_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        boxes, rects = random_boxes(rng, rng.integers(0, 60)), random_boxes(rng, rng.integers(0, 40))
+        index = GridIndex(boxes)
+        query_idx, box_idx = index.query_pairs(rects)
+        expected = [(i, j) for i, rect in enumerate(rects) for j, box in enumerate(boxes) if touching(rect, box)]
+        assert list(zip(query_idx.tolist(), box_idx.tolist())) == expected
+        for i, rect in enumerate(rects):
+            assert index.query(rect).tolist() == [j for k, j in expected if k == i]
+
+
+def test_touching_boxes_are_returned():
+    index = GridIndex([[0, 0, 10, 10], [10, 0, 20, 10], [30, 30, 40, 40]], cell_size=(5, 5))
+    assert index.query([10, 5, 10, 5]).tolist() == [0, 1]
+    assert index.query([100, 100, 110, 110]).tolist() == []
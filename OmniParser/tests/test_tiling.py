@@ -0,0 +1,54 @@
+import torch
+
+from util.tiling import DetectionModePlanner, stitch_tile_boxes, stitch_tile_text, tile_grid
+
+W, H = 2560, 1440
+
+
+def tile_detections(boxes, tiles):
+    """what a perfect detector returns per tile: the part of each box inside the tile, in tile pixels"""
+    results = []
+    for x1, y1, x2, y2 in tiles:
+        pieces = [[max(b[0], x1) - x1, max(b[1], y1) - y1, min(b[2], x2) - x1, min(b[3], y2) - y1]
+                  for b in boxes if min(b[2], x2) > max(b[0], x1) and min(b[3], y2) > max(b[1], y1)]
+        results.append((torch.tensor(pieces, dtype=torch.float32).reshape(-1, 4), torch.full((len(pieces),), 0.9)))
+    return results
+
+
+def test_stitch_keeps_boxes_wider_than_the_overlap():
+    tiles = tile_grid(W, H, 1280, 128)
+    boxes = [[1000, 200, 1500, 500], [500, 1000, 1700, 1350], [1270, 600, 1300, 640], [100, 100, 140, 140], [10, 50, 60, 80], [70, 50, 120, 80]]
+    stitched, conf, source = stitch_tile_boxes(tile_detections(boxes, tiles), tiles, W, H)
+    assert sorted(stitched.int().tolist()) == sorted(boxes)
+    assert len(conf) == len(source) == len(boxes)
+
+
+def test_stitch_joins_text_lines_cut_by_seams():
+    tiles = tile_grid(W, H, 1280, 128)
+    line = 'The quick brown fox jumps over'
+    # the left tile reads the line up to its edge at x=1280, the others from theirs
+    results = [([], []) for _ in tiles]
+    results[0] = (['The quick brown fox '], [[1000, 200, 1280, 230]])
+    results[1] = (['brown fox jumps over'], [[0, 200, 348, 230]])
+    results[2] = (['fox jumps over'], [[0, 200, 220, 230]])
+    text, boxes = stitch_tile_text(results, tiles, W, H)
+    assert text == [line] and boxes == [[1000, 200, 1500, 230]]
+
+
+def test_planner_weighs_full_resolution_on_large_frames():
+    planner = DetectionModePlanner(tile_size=1280, overlap=128, explore_every=0)
+    assert planner.choose(1280, 720) == 'full'
+    # same cost per megapixel: one full pass reads fewer pixels than the overlapping tiles
+    assert planner.choose(W, H) == 'full'
+    planner.ms_per_megapixel['full'] = 400.0
+    assert planner.choose(W, H) == 'tiled'
+    assert planner.choose(W, H, latency_budget_ms=planner.predict_ms('full', W, H)) == 'tiled'
+    assert planner.choose(W, H, latency_budget_ms=planner.predict_ms('tiled', W, H) - 1) == 'downscaled'
+
+
+def test_planner_explores_the_other_native_mode():
+    planner = DetectionModePlanner(tile_size=1280, overlap=128, explore_every=3)
+    modes = [planner.choose(W, H) for _ in range(6)]
+    assert modes == ['full', 'full', 'tiled', 'full', 'full', 'tiled']
+    planner.observe('tiled', planner.megapixels('tiled', W, H), 0.1)
+    assert planner.ms_per_megapixel['tiled'] < planner.ms_per_megapixel['full']
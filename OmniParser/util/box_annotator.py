@@ -85,6 +85,21 @@ class BoxAnnotator:
             ```
         """
         font = cv2.FONT_HERSHEY_SIMPLEX
+        texts, label_positions = None, None
+        if not skip_label:
+            texts = [
+                f"{detections.class_id[i] if detections.class_id is not None else None}"
+                if (labels is None or len(detections) != len(labels))
+                else labels[i]
+                for i in range(len(detections))
+            ]
+            if self.avoid_overlap:
+                # label positions of all the detections are solved at once
+                text_sizes = [
+                    cv2.getTextSize(text=text, fontFace=font, fontScale=self.text_scale, thickness=self.text_thickness)[0]
+                    for text in texts
+                ]
+                label_positions = get_optimal_label_positions(self.text_padding, text_sizes, detections.xyxy.astype(int), image_size)
         for i in range(len(detections)):
             x1, y1, x2, y2 = detections.xyxy[i].astype(int)
             class_id = (
@@ -106,20 +121,16 @@ class BoxAnnotator:
             if skip_label:
                 continue
 
-            text = (
-                f"{class_id}"
-                if (labels is None or len(detections) != len(labels))
-                else labels[i]
-            )
-
-            text_width, text_height = cv2.getTextSize(
-                text=text,
-                fontFace=font,
-                fontScale=self.text_scale,
-                thickness=self.text_thickness,
-            )[0]
+            text = texts[i]
 
             if not self.avoid_overlap:
+                text_width, text_height = cv2.getTextSize(
+                    text=text,
+                    fontFace=font,
+                    fontScale=self.text_scale,
+                    thickness=self.text_thickness,
+                )[0]
+
                 text_x = x1 + self.text_padding
                 text_y = y1 - self.text_padding
 
@@ -135,7 +146,7 @@ class BoxAnnotator:
                 # text_background_x2 = x1
                 # text_background_y2 = y1 + 2 * self.text_padding + text_height
             else:
-                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = get_optimal_label_pos(self.text_padding, text_width, text_height, x1, y1, x2, y2, detections, image_size)
+                text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2 = label_positions[i].tolist()
 
             cv2.rectangle(
                 img=scene,
@@ -260,3 +271,51 @@ def get_optimal_label_pos(text_padding, text_width, text_height, x1, y1, x2, y2,
         return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
 
     return text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
+
+
+def get_optimal_label_positions(text_padding, text_sizes, boxes, image_size, chunk_size=4_000_000):
+    """ batched get_optimal_label_pos: same positions for every box, computed with array operations
+        text_sizes: (N, 2) text width and height of each label
+        boxes: (N, 4) int xyxy detection boxes, the labels are checked against all of them
+        chunk_size: bound of the (candidates x boxes) overlap matrix evaluated at once
+        returns (N, 6) int array of text_x, text_y, text_background_x1, text_background_y1, text_background_x2, text_background_y2
+    """
+    boxes = np.asarray(boxes, dtype=np.int64).reshape(-1, 4)
+    n = len(boxes)
+    if n == 0:
+        return np.empty((0, 6), dtype=np.int64)
+    text_w, text_h = np.asarray(text_sizes, dtype=np.int64).reshape(-1, 2).T
+    x1, y1, x2, y2 = boxes.T
+    p = text_padding
+    # (N, 4 positions, 6) in the order tried by get_optimal_label_pos: top left, outer left, outer right, top right
+    candidates = np.stack([
+        np.stack([x1 + p, y1 - p, x1, y1 - 2 * p - text_h, x1 + 2 * p + text_w, y1], axis=1),
+        np.stack([x1 - p - text_w, y1 + p + text_h, x1 - 2 * p - text_w, y1, x1, y1 + 2 * p + text_h], axis=1),
+        np.stack([x2 + p, y1 + p + text_h, x2, y1, x2 + 2 * p + text_w, y1 + 2 * p + text_h], axis=1),
+        np.stack([x2 - p - text_w, y1 - p, x2 - 2 * p - text_w, y1 - 2 * p - text_h, x2, y1], axis=1),
+    ], axis=1)
+    rects = candidates[:, :, 2:].reshape(-1, 4).astype(np.float64)
+    dets = boxes.astype(np.float64)
+
+    overlap = np.zeros(len(rects), dtype=bool)
+    det_area = (dets[:, 2] - dets[:, 0]) * (dets[:, 3] - dets[:, 1])
+    step = max(1, chunk_size // n)
+    for start in range(0, len(rects), step):
+        r = rects[start:start + step, None, :]
+        inter = np.maximum(0, np.minimum(r[..., 2], dets[:, 2]) - np.maximum(r[..., 0], dets[:, 0])) \
+            * np.maximum(0, np.minimum(r[..., 3], dets[:, 3]) - np.maximum(r[..., 1], dets[:, 1]))
+        rect_area = (r[..., 2] - r[..., 0]) * (r[..., 3] - r[..., 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # same score as IoU(..., return_max=True)
+            score = inter / (rect_area + det_area - inter)
+            both_positive = (rect_area > 0) & (det_area > 0)
+            score = np.maximum(score, np.where(both_positive, inter / np.where(both_positive, rect_area, 1), 0))
+            score = np.maximum(score, np.where(both_positive, inter / np.where(both_positive, det_area, 1), 0))
+        overlap[start:start + step] = (score > 0.3).any(axis=1)
+    if image_size is not None:
+        overlap |= (rects[:, 0] < 0) | (rects[:, 2] > image_size[0]) | (rects[:, 1] < 0) | (rects[:, 3] > image_size[1])
+
+    overlap = overlap.reshape(n, 4)
+    # first position without overlap, the last one (top right) when all overlap
+    choice = np.where(overlap.all(axis=1), 3, np.argmin(overlap, axis=1))
+    return candidates[np.arange(n), choice]
@@ -0,0 +1,102 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List
+
+import numpy as np
+
+from util.utils import generate_icon_captions
+
+
+class CaptionBatcher:
+    """
+    Server side dynamic batching of icon captioning across concurrent requests.
+
+    Requests hand their icon crops to `caption()`, a single worker thread collects the crops of all requests
+    arriving within `max_wait_ms` (or until `batch_size` crops are pending), runs them through the caption model
+    in shared generate calls and routes each caption back to the request it came from.
+
+    Attributes:
+        batch_size (int): crops per generate call
+        max_wait_ms (float): how long the first pending request waits for others to join its batch
+        batches (int): generate batches run so far
+        requests (int): caption requests served so far
+    """
+
+    def __init__(self, caption_model_processor, batch_size: int = 128, max_wait_ms: float = 5.0):
+        self.caption_model_processor = caption_model_processor
+        self.batch_size = batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batches = 0
+        self.requests = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        # close() and the puts of caption() are serialized, no request is queued after the shutdown sentinel
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='caption-batcher', daemon=True)
+        self._thread.start()
+
+    def caption(self, crops: np.ndarray, prompt: str) -> List[str]:
+        """captions of N x 64 x 64 x 3 uint8 crops, blocks until they are generated"""
+        if len(crops) == 0:
+            return []
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("CaptionBatcher is closed")
+            self._queue.put((crops, prompt, future))
+        return future.result()
+
+    def close(self):
+        """requests already queued are captioned, later ones raise RuntimeError"""
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        pending = [first]
+        count = len(first[0])
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while count < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            pending.append(item)
+            count += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            pending = self._collect(item)
+            # requests with the same prompt share generate calls
+            by_prompt = {}
+            for crops, prompt, future in pending:
+                by_prompt.setdefault(prompt, []).append((crops, future))
+            for prompt, group in by_prompt.items():
+                futures = [future for _, future in group]
+                try:
+                    crops = np.concatenate([crops for crops, _ in group])
+                    captions = generate_icon_captions(crops, self.caption_model_processor, prompt, batch_size=self.batch_size)
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+                    continue
+                self.batches += -(-len(crops) // self.batch_size)
+                self.requests += len(group)
+                start = 0
+                for crops, future in group:
+                    future.set_result(captions[start:start + len(crops)])
+                    start += len(crops)
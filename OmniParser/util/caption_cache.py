@@ -0,0 +1,133 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+
+class CaptionCache:
+    """
+    LRU cache of icon captions keyed by the content hash of the resized (64x64) icon crop.
+
+    Taskbar, toolbar and ribbon icons are pixel-identical across steps, so their captions only need to
+    be generated once. Entries are also written to an optional sqlite file so a restarted server starts warm.
+    Writes to the file are batched (every flush_every captions or flush_interval seconds, and at exit), the file is
+    in WAL mode so the server processes of a prefork server can share it.
+
+    Attributes:
+        max_entries (int): number of captions kept in memory before the least recently used ones are evicted
+        path (Optional[str]): sqlite file backing the cache, None for a memory only cache
+        max_disk_entries (int): rows kept in the sqlite file, the oldest written ones are deleted beyond it
+        hits (int): lookups answered from memory or disk
+        misses (int): lookups that had to go to the caption model
+    """
+
+    def __init__(self, max_entries: int = 10000, path: Optional[str] = None, max_disk_entries: int = 100000,
+                 flush_every: int = 256, flush_interval: float = 5.0, busy_timeout: float = 30.0):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # concurrent writers (other server processes) wait up to busy_timeout for the write lock
+            self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+            self._db.execute("CREATE TABLE IF NOT EXISTS captions (key TEXT PRIMARY KEY, caption TEXT NOT NULL)")
+            self._db.commit()
+            atexit.register(self.flush)
+
+    @staticmethod
+    def make_key(crop: np.ndarray, model_name: str, prompt: str) -> str:
+        digest = hashlib.sha1()
+        digest.update(f"{model_name}\0{prompt}\0{crop.shape}\0{crop.dtype}\0".encode())
+        digest.update(np.ascontiguousarray(crop).tobytes())
+        return digest.hexdigest()
+
+    def _remember(self, key: str, caption: str):
+        self._entries[key] = caption
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        """captions for `keys` in order, None for the misses"""
+        captions = []
+        with self._lock:
+            for key in keys:
+                caption = self._entries.get(key)
+                if caption is not None:
+                    self._entries.move_to_end(key)
+                elif key in self._pending:
+                    caption = self._pending[key]
+                    self._remember(key, caption)
+                elif self._db is not None:
+                    row = self._db.execute("SELECT caption FROM captions WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        caption = row[0]
+                        self._remember(key, caption)
+                if caption is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                captions.append(caption)
+        return captions
+
+    def put_many(self, items: Dict[str, str]):
+        with self._lock:
+            for key, caption in items.items():
+                self._remember(key, caption)
+            if self._db is not None and items:
+                self._pending.update(items)
+                if len(self._pending) >= self.flush_every or time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush()
+
+    def flush(self):
+        """writes the pending captions to the sqlite file"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._db is not None and self._pending:
+            with self._db:
+                # a replaced row gets a new rowid, rowid order is write order
+                self._db.executemany("INSERT OR REPLACE INTO captions (key, caption) VALUES (?, ?)", list(self._pending.items()))
+                (rows,) = self._db.execute("SELECT COUNT(*) FROM captions").fetchone()
+                if rows > self.max_disk_entries:
+                    self._db.execute("DELETE FROM captions WHERE rowid IN (SELECT rowid FROM captions ORDER BY rowid LIMIT ?)", (rows - self.max_disk_entries,))
+            self._pending.clear()
+        self._last_flush = time.monotonic()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            self._pending.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM captions")
+                self._db.commit()
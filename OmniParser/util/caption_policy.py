@@ -0,0 +1,98 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class CaptionPolicy:
+    """
+    Decides which icons of a frame go to the caption model.
+
+    - icons narrower or shorter than `min_size` pixels (slivers, separators, detector noise) are dropped from the
+      parse, they can't be clicked reliably and their captions are meaningless
+    - pixel-identical crops (the same icon repeated in a list, a toolbar or a grid) are captioned once, the caption
+      is copied to every copy
+    - with `max_captions`, only that many unique crops are captioned per frame, by priority: on-screen area times the
+      number of copies. The others get an empty content and the 'box_yolo_uncaptioned' source.
+
+    Icons labelled with OCR text by remove_overlap ('box_yolo_content_ocr') never reach the caption model.
+
+    Attributes:
+        min_size (int): minimum icon width and height in pixels, 0 keeps every icon
+        dedupe (bool): caption identical crops once
+        max_captions (Optional[int]): unique crops captioned per frame, None for no cap
+        dropped (int): icons dropped for their size, since creation
+        deduped (int): captions saved by deduplication
+        capped (int): unique crops left uncaptioned by max_captions
+    """
+
+    def __init__(self, min_size: int = 6, dedupe: bool = True, max_captions: Optional[int] = None):
+        self.min_size = min_size
+        self.dedupe = dedupe
+        self.max_captions = max_captions
+        self.dropped = 0
+        self.deduped = 0
+        self.capped = 0
+        self._lock = threading.Lock()
+
+    def drop_small(self, elements: List[Dict], w: int, h: int) -> List[Dict]:
+        """elements without the uncaptioned icons smaller than min_size, bboxes are xyxy ratios"""
+        if not self.min_size:
+            return elements
+        bbox = np.array([elem['bbox'] for elem in elements], dtype=np.float64).reshape(-1, 4)
+        uncaptioned = np.array([elem['type'] == 'icon' and elem['content'] is None for elem in elements], dtype=bool)
+        small = self.small_icons(bbox, uncaptioned, w, h)
+        return [elem for elem, drop in zip(elements, small) if not drop]
+
+    def small_icons(self, bbox: np.ndarray, uncaptioned: np.ndarray, w: int, h: int) -> np.ndarray:
+        """mask of the uncaptioned icons smaller than min_size (bbox N x 4 xyxy ratios), counted in dropped"""
+        bbox = np.asarray(bbox, dtype=np.float64).reshape(-1, 4)
+        if not self.min_size:
+            return np.zeros(len(bbox), dtype=bool)
+        small = uncaptioned & (((bbox[:, 2] - bbox[:, 0]) * w < self.min_size) | ((bbox[:, 3] - bbox[:, 1]) * h < self.min_size))
+        with self._lock:
+            self.dropped += int(small.sum())
+        return small
+
+    def select(self, crops: np.ndarray, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Picks the crops to caption.
+
+        Args:
+            crops: N x H x W x 3 uint8 icon crops
+            boxes: N x 4 xyxy boxes of the crops, any unit, for the priority
+        Returns:
+            (selected, inverse): indices of the crops to caption, and for each crop the position of its caption in
+            the selected captions, -1 when it is not captioned
+        """
+        n = len(crops)
+        if self.dedupe:
+            first = {}
+            group = np.empty(n, dtype=np.int64)
+            for i, crop in enumerate(crops):
+                group[i] = first.setdefault(crop.tobytes(), i)
+        else:
+            group = np.arange(n)
+        unique, inverse, counts = np.unique(group, return_inverse=True, return_counts=True)
+        selected = np.arange(len(unique))
+        capped = 0
+        if self.max_captions is not None and len(unique) > self.max_captions:
+            boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+            area = (boxes[unique, 2] - boxes[unique, 0]) * (boxes[unique, 3] - boxes[unique, 1])
+            selected = np.sort(np.argsort(-(area * counts), kind='stable')[:self.max_captions])
+            capped = len(unique) - len(selected)
+        position = np.full(len(unique), -1, dtype=np.int64)
+        position[selected] = np.arange(len(selected))
+        with self._lock:
+            self.deduped += n - len(unique)
+            self.capped += capped
+        return unique[selected], position[inverse]
+
+    @staticmethod
+    def expand(captions: List[str], inverse: np.ndarray) -> List[Optional[str]]:
+        """one caption per crop from the captions of the selected crops, None for the crops left out"""
+        return [captions[j] if j >= 0 else None for j in inverse]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'dropped': self.dropped, 'deduped': self.deduped, 'capped': self.capped}
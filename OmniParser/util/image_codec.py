@@ -0,0 +1,61 @@
+import base64
+import io
+from typing import Dict, Tuple
+
+from PIL import Image
+
+# codec spec: "<format>[:<level>]", level is the zlib compress level (0-9) for png and the quality (1-100) for
+# jpeg and webp. "webp-lossless" takes the encoder effort (0-100) as level.
+#   "png"          PIL default, compress level 6
+#   "png:1"        fast png, bigger payload, same pixels
+#   "jpeg:85"      lossy, smallest and fastest to encode
+#   "webp:80"      lossy
+#   "webp-lossless"
+DEFAULT_CODEC = 'png'
+
+_FORMATS = {
+    'png': ('PNG', 'image/png', 'png'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'webp-lossless': ('WEBP', 'image/webp', 'webp'),
+}
+
+
+def parse_codec(codec: str = None) -> Tuple[str, int]:
+    """("png", None) from "png", ("jpeg", 85) from "jpeg:85", raises ValueError on unknown formats"""
+    codec = (codec or DEFAULT_CODEC).lower()
+    name, _, level = codec.partition(':')
+    if name == 'jpg':
+        name = 'jpeg'
+    if name not in _FORMATS:
+        raise ValueError(f"Unknown image codec {codec!r}, expected one of {sorted(_FORMATS)} with an optional ':<level>'")
+    return name, int(level) if level else None
+
+
+def _save_args(name: str, level: int) -> Dict:
+    if name == 'png':
+        return {} if level is None else {'compress_level': level}
+    if name == 'webp-lossless':
+        return {'lossless': True, 'quality': 80 if level is None else level}
+    return {'quality': 85 if level is None else level}
+
+
+def encode_image(image: Image.Image, codec: str = None) -> bytes:
+    name, level = parse_codec(codec)
+    if name == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffered = io.BytesIO()
+    image.save(buffered, format=_FORMATS[name][0], **_save_args(name, level))
+    return buffered.getvalue()
+
+
+def encode_image_base64(image: Image.Image, codec: str = None) -> str:
+    return base64.b64encode(encode_image(image, codec)).decode('ascii')
+
+
+def codec_mime_type(codec: str = None) -> str:
+    return _FORMATS[parse_codec(codec)[0]][1]
+
+
+def codec_extension(codec: str = None) -> str:
+    return _FORMATS[parse_codec(codec)[0]][2]
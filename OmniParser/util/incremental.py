@@ -0,0 +1,230 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+
+from util.parsed_elements import ParsedElements
+from util.spatial_index import GridIndex
+from util.timing import StageTimer
+from util.utils import check_ocr_box, get_parsed_content_icon, int_box_area, parse_screen, predict_yolo, remove_overlap_vectorized, render_som_image, som_label_coordinates
+
+
+def dirty_tile_mask(previous: np.ndarray, current: np.ndarray, tile_size: int = 32, pixel_threshold: int = 12) -> np.ndarray:
+    """(rows, cols) bool mask of the tiles where any pixel channel changed by more than pixel_threshold"""
+    changed = np.abs(current.astype(np.int16) - previous.astype(np.int16)).max(axis=2) > pixel_threshold
+    h, w = changed.shape
+    rows, cols = -(-h // tile_size), -(-w // tile_size)
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:h, :w] = changed
+    return padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+
+def merge_rects(rects: List[List[int]]) -> List[List[int]]:
+    """merges overlapping or touching xyxy pixel rectangles until they are all disjoint"""
+    rects = [list(rect) for rect in rects]
+    merged = True
+    while merged:
+        merged = False
+        out = []
+        for rect in rects:
+            for other in out:
+                if rect[0] <= other[2] and other[0] <= rect[2] and rect[1] <= other[3] and other[1] <= rect[3]:
+                    other[:] = [min(rect[0], other[0]), min(rect[1], other[1]), max(rect[2], other[2]), max(rect[3], other[3])]
+                    merged = True
+                    break
+            else:
+                out.append(rect)
+        rects = out
+    return rects
+
+
+def dirty_regions(mask: np.ndarray, tile_size: int, margin: int, width: int, height: int) -> List[List[int]]:
+    """bounding rectangles (pixel xyxy, grown by margin) of the connected groups of dirty tiles"""
+    count, _, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    rects = []
+    for x, y, w, h, _ in stats[1:count].tolist():
+        rects.append([
+            max(0, x * tile_size - margin),
+            max(0, y * tile_size - margin),
+            min(width, (x + w) * tile_size + margin),
+            min(height, (y + h) * tile_size + margin),
+        ])
+    return merge_rects(rects)
+
+
+class IncrementalParser:
+    """
+    Parses a stream of screenshots, re-running OCR, icon detection and captioning only where the screen changed.
+
+    The new frame is diffed against the previous one in tiles, dirty tiles are grouped into regions (grown by
+    `margin` and by every previous element they touch), and only those regions are parsed again. Elements of the
+    previous parse outside the regions are kept as is. When more than `max_change_ratio` of the tiles changed,
+    or the frame size changed, a regular full parse is run instead.
+
+    Attributes:
+        ocr_args (Dict): keyword arguments for check_ocr_box, e.g. {'ocr_engine': 'paddleocr', 'easyocr_args': {...}}
+        som_args (Dict): keyword arguments for get_som_labeled_img (BOX_TRESHOLD, iou_threshold, batch_size, caption_cache, ...)
+        last_stats (Dict): change ratio, number of regions and parse mode of the last call
+        last_timings (Dict): per stage seconds of the last call (decode, diff, ocr, detection, overlap, crop, caption, annotate, encode, total)
+    """
+
+    def __init__(self, som_model, caption_model_processor, ocr_args: Optional[Dict] = None, som_args: Optional[Dict] = None,
+                 tile_size: int = 32, margin: int = 16, pixel_threshold: int = 12, max_change_ratio: float = 0.3):
+        self.som_model = som_model
+        self.caption_model_processor = caption_model_processor
+        self.ocr_args = ocr_args or {}
+        self.som_args = som_args or {}
+        self.tile_size = tile_size
+        self.margin = margin
+        self.pixel_threshold = pixel_threshold
+        self.max_change_ratio = max_change_ratio
+        self.last_stats = {}
+        self.last_timings = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._previous_frame = None
+        self._previous_result = None
+        self._previous_codec = None
+        self._image_codec = None
+        self._lazy_captions = False
+
+    def parse(self, image: Image.Image, draw_bbox_config=None, render_som: bool = True, image_codec: Optional[str] = None, lazy_captions: bool = False) -> Tuple[Optional[str], Dict, ParsedElements]:
+        """same return value as get_som_labeled_img: (encoded_image, label_coordinates, elements),
+        encoded_image is None when render_som is False. With lazy_captions the icons parsed in this call are not
+        captioned, their content is None (see caption_parsed_elements)"""
+        # frames of one stream are parsed one after the other, each one is diffed against the previous
+        with self._lock:
+            self._image_codec = image_codec
+            self._lazy_captions = lazy_captions
+            self._timer = StageTimer()
+            start = time.perf_counter()
+            result = self._parse(image, draw_bbox_config, render_som)
+            if 'total' not in self._timer.as_dict():
+                self._timer.add('total', time.perf_counter() - start)
+            self.last_timings = self._timer.as_dict()
+            return result
+
+    def _parse(self, image, draw_bbox_config, render_som):
+        with self._timer.stage('decode'):
+            image = image.convert('RGB')
+            frame = np.array(image)
+        h, w, _ = frame.shape
+
+        if self._previous_frame is None or self._previous_frame.shape != frame.shape:
+            return self._full_parse(frame, draw_bbox_config, render_som, change_ratio=1.0)
+
+        with self._timer.stage('diff'):
+            mask = dirty_tile_mask(self._previous_frame, frame, self.tile_size, self.pixel_threshold)
+        change_ratio = float(mask.mean())
+        if change_ratio == 0:
+            self.last_stats = {'mode': 'unchanged', 'change_ratio': 0.0, 'regions': 0}
+            if render_som and (self._previous_result[0] is None or self._previous_codec != self._image_codec):
+                self._previous_result = self._render(frame, self._previous_result[2], draw_bbox_config, render_som)
+            if not render_som:
+                # the SOM image of an earlier call stays cached for the next call asking for one
+                return None, self._previous_result[1], self._previous_result[2]
+            return self._previous_result
+        if change_ratio > self.max_change_ratio:
+            return self._full_parse(frame, draw_bbox_config, render_som, change_ratio=change_ratio)
+
+        previous_elements = self._previous_result[2]
+        previous_px = previous_elements.bbox.astype(np.float64) * [w, h, w, h]
+        regions = dirty_regions(mask, self.tile_size, self.margin, w, h)
+        # re-parse every previous element the change touches as a whole, so no element gets cut at a region border
+        index = GridIndex(previous_px)
+        touched = set()
+        for _ in range(2):
+            grown = []
+            for rect in regions:
+                hits = index.query(rect)
+                touched.update(hits.tolist())
+                if len(hits):
+                    box = previous_px[hits]
+                    rect = [min(rect[0], int(box[:, 0].min())), min(rect[1], int(box[:, 1].min())), max(rect[2], int(np.ceil(box[:, 2].max()))), max(rect[3], int(np.ceil(box[:, 3].max())))]
+                grown.append([max(0, rect[0]), max(0, rect[1]), min(w, rect[2]), min(h, rect[3])])
+            regions = merge_rects(grown)
+
+        kept = previous_elements.take([i for i in range(len(previous_elements)) if i not in touched])
+        new_elements = self._parse_regions(frame, regions)
+        elements = ParsedElements.concatenate([kept, new_elements])
+        # same ordering as a full parse: ocr text, icons labelled with ocr text, captioned icons
+        order = {'box_ocr_content_ocr': 0, 'box_yolo_content_ocr': 1}
+        rank = np.array([order.get(source, 2) for source in elements.sources], dtype=np.int64)[elements.source]
+        elements = elements.take(np.argsort(rank, kind='stable'))
+
+        self.last_stats = {'mode': 'incremental', 'change_ratio': change_ratio, 'regions': len(regions), 'reparsed_elements': len(new_elements), 'kept_elements': len(kept)}
+        self._previous_frame = frame
+        self._previous_result = self._render(frame, elements, draw_bbox_config, render_som)
+        return self._previous_result
+
+    def _render(self, frame, elements, draw_bbox_config, render_som):
+        boxes = torch.from_numpy(elements.bbox)
+        output_coord_in_ratio = self.som_args.get('output_coord_in_ratio', True)
+        if render_som:
+            encoded_image, label_coordinates = render_som_image(frame, boxes, draw_bbox_config=draw_bbox_config, output_coord_in_ratio=output_coord_in_ratio, image_codec=self._image_codec, timer=self._timer)
+        else:
+            encoded_image, label_coordinates = None, som_label_coordinates(boxes, frame.shape[1], frame.shape[0], output_coord_in_ratio=output_coord_in_ratio)
+        self._previous_codec = self._image_codec
+        return encoded_image, label_coordinates, elements
+
+    def _full_parse(self, frame, draw_bbox_config, render_som, change_ratio):
+        som_args = dict(self.som_args)
+        som_args.setdefault('output_coord_in_ratio', True)
+        som_args['render_som'] = render_som
+        som_args['image_codec'] = self._image_codec
+        if self._lazy_captions:
+            som_args['use_local_semantics'] = False
+        self._previous_codec = self._image_codec
+        # the frame decoded by _parse, parse_screen doesn't decode it again
+        *result, timings = parse_screen(frame, self.som_model, self.caption_model_processor, ocr_kwargs=self.ocr_args, draw_bbox_config=draw_bbox_config, timer=self._timer, **som_args)
+        result = tuple(result)
+        self.last_stats = {'mode': 'full', 'change_ratio': change_ratio, 'regions': 0, 'timings': timings}
+        self._previous_frame = frame
+        self._previous_result = result
+        return result
+
+    def _parse_regions(self, frame: np.ndarray, regions: List[List[int]]) -> ParsedElements:
+        h, w, _ = frame.shape
+        scale = np.array([w, h, w, h], dtype=np.float64)
+        ocr_elem, icon_elem = [], []
+        for x1, y1, x2, y2 in regions:
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crop = Image.fromarray(frame[y1:y2, x1:x2])
+            offset = np.array([x1, y1, x1, y1], dtype=np.float64)
+            with self._timer.stage('ocr'):
+                (text, ocr_bbox), _ = check_ocr_box(crop, display_img=False, output_bb_format='xyxy', **self.ocr_args)
+            for box, txt in zip(ocr_bbox, text):
+                box = ((np.asarray(box, dtype=np.float64) + offset) / scale).tolist()
+                if int_box_area(box, w, h) > 0:
+                    ocr_elem.append({'type': 'text', 'bbox': box, 'interactivity': False, 'content': txt, 'source': 'box_ocr_content_ocr'})
+            with self._timer.stage('detection'):
+                xyxy, _, _ = predict_yolo(model=self.som_model, image=crop, box_threshold=self.som_args.get('BOX_TRESHOLD', 0.01), imgsz=None, scale_img=False, iou_threshold=0.1)
+            for box in xyxy.cpu().numpy().astype(np.float64):
+                box = ((box + offset) / scale).tolist()
+                if int_box_area(box, w, h) > 0:
+                    icon_elem.append({'type': 'icon', 'bbox': box, 'interactivity': True, 'content': None})
+
+        with self._timer.stage('overlap'):
+            elements = remove_overlap_vectorized(boxes=icon_elem, iou_threshold=self.som_args.get('iou_threshold', 0.9), ocr_bbox=ocr_elem)
+            elements = [elem if isinstance(elem, dict) else {'type': 'icon', 'bbox': elem, 'interactivity': True, 'content': None, 'source': 'box_yolo_content_yolo'} for elem in elements]
+            caption_policy = self.som_args.get('caption_policy')
+            if caption_policy is not None:
+                elements = caption_policy.drop_small(elements, w, h)
+        uncaptioned = [elem for elem in elements if elem['content'] is None]
+        if uncaptioned and self.som_args.get('use_local_semantics', True) and not self._lazy_captions:
+            captions = get_parsed_content_icon(torch.tensor([elem['bbox'] for elem in uncaptioned]), 0, frame, self.caption_model_processor,
+                                               prompt=self.som_args.get('prompt'), batch_size=self.som_args.get('batch_size', 128),
+                                               caption_cache=self.som_args.get('caption_cache'), caption_batcher=self.som_args.get('caption_batcher'), timer=self._timer, caption_policy=caption_policy)
+            for elem, caption in zip(uncaptioned, captions):
+                if caption is None:
+                    elem['content'], elem['source'] = '', 'box_yolo_uncaptioned'
+                else:
+                    elem['content'] = caption
+        return ParsedElements.from_dicts(elements)
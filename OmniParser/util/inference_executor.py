@@ -0,0 +1,138 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+
+class QueueFullError(RuntimeError):
+    """the request was rejected, `max_queue` requests are already waiting (HTTP 429)"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """the request was not served within its deadline (HTTP 503)"""
+
+
+class InferenceExecutor:
+    """
+    Bounded pool of inference worker threads between the server event loop and the parse pipeline.
+
+    The event loop only hands requests over and awaits them, so health checks and cheap endpoints stay responsive
+    while frames are parsed. At most `workers` requests run at once, all of them on the same warm models (OCR,
+    detection and captioning spend their time in native code, concurrent requests share caption batches). Beyond
+    that, up to `max_queue` requests wait in FIFO order and the next ones are rejected right away with
+    QueueFullError instead of piling up latency. A request whose deadline passes while it waits is dropped without
+    running, one whose deadline passes while it runs is answered with DeadlineExceededError, its result discarded.
+
+    Worker threads start on the first request, so a server process forked after creating the executor gets its own.
+
+    Attributes:
+        workers (int): requests run concurrently
+        max_queue (int): requests waiting for a worker before new ones are rejected
+        timeout (Optional[float]): default deadline in seconds from submission, None for no deadline
+        completed (int): requests run to completion (or error), since creation
+        rejected (int): requests rejected because the queue was full
+        expired (int): requests that missed their deadline
+    """
+
+    def __init__(self, workers: int = 2, max_queue: int = 16, timeout: Optional[float] = None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.expired = 0
+        self._running = 0
+        # submitted and not finished yet, running ones included
+        self._pending = 0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'inference-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, fn, *args, timeout: Optional[float] = None, **kwargs) -> Future:
+        """queues fn(*args, **kwargs), raises QueueFullError when max_queue requests are already waiting"""
+        self._start()
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise QueueFullError(f"Server busy, {self.max_queue} requests already waiting, retry later.")
+            self._pending += 1
+        future = Future()
+        self._queue.put((future, deadline, fn, args, kwargs))
+        return future
+
+    async def run(self, fn, *args, timeout: Optional[float] = None, **kwargs):
+        """awaits fn(*args, **kwargs) on a worker, raises QueueFullError or DeadlineExceededError"""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(fn, *args, timeout=timeout, **kwargs)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or None)
+        except asyncio.TimeoutError:
+            # cancels it if it is still queued, a running request finishes and its result is dropped
+            future.cancel()
+            with self._lock:
+                self.expired += 1
+            raise DeadlineExceededError(f"Request not served within its {timeout:.3g} s deadline.") from None
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            future, deadline, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                with self._lock:
+                    self._pending -= 1
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                with self._lock:
+                    self._pending -= 1
+                    self.expired += 1
+                future.set_exception(DeadlineExceededError("Deadline passed while the request was queued."))
+                continue
+            with self._lock:
+                self._running += 1
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._pending -= 1
+                    self.completed += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'running': self._running,
+                'queued': self._pending - self._running,
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'expired': self.expired,
+            }
+
+    def shutdown(self):
+        """lets the queued requests run, then stops the workers"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
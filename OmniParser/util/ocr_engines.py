@@ -0,0 +1,149 @@
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class EasyOCREngine:
+    """EasyOCR reader, `easyocr_args` are passed to readtext as is"""
+    name = 'easyocr'
+
+    def __init__(self, lang: Tuple[str, ...] = ('en',)):
+        import easyocr
+        self.reader = easyocr.Reader(list(lang))
+        self.lock = threading.Lock()
+
+    def read(self, image_np: np.ndarray, easyocr_args: Optional[Dict] = None) -> Tuple[List, List[str]]:
+        with self.lock:
+            result = self.reader.readtext(image_np, **(easyocr_args or {}))
+        coord = [item[0] for item in result]
+        text = [item[1] for item in result]
+        return coord, text
+
+
+class PaddleOCREngine:
+    """PaddleOCR on cpu, only `text_threshold` of `easyocr_args` is used, as a recognition score threshold"""
+    name = 'paddleocr'
+
+    def __init__(self, lang: str = 'en'):
+        from paddleocr import PaddleOCR
+        self.ocr = PaddleOCR(
+            lang=lang,  # other lang also available
+            use_angle_cls=False,
+            use_gpu=False,  # using cuda will conflict with pytorch in the same process
+            show_log=False,
+            max_batch_size=1024,
+            use_dilation=True,  # improves accuracy
+            det_db_score_mode='slow',  # improves accuracy
+            rec_batch_num=1024)
+        self.lock = threading.Lock()
+
+    def read(self, image_np: np.ndarray, easyocr_args: Optional[Dict] = None) -> Tuple[List, List[str]]:
+        if easyocr_args is None:
+            text_threshold = 0.5
+        else:
+            text_threshold = easyocr_args['text_threshold']
+        with self.lock:
+            result = self.ocr.ocr(image_np, cls=False)[0] or []
+        coord = [item[0] for item in result if item[1][1] > text_threshold]
+        text = [item[1][0] for item in result if item[1][1] > text_threshold]
+        return coord, text
+
+    def read_cached(self, image_np: np.ndarray, easyocr_args: Optional[Dict], line_cache) -> Tuple[List, List[str]]:
+        """
+        Same output as read() in two phases: the text detector runs on the whole frame, then only the lines missing
+        from `line_cache` (a TextLineCache, keyed by the pixels of the line) go through the recognizer.
+        """
+        text_threshold = 0.5 if easyocr_args is None else easyocr_args['text_threshold']
+        with self.lock:
+            boxes = self.ocr.ocr(image_np, det=True, rec=False, cls=False)[0] or []
+            boxes = _sorted_boxes(boxes)
+            crops = [_crop_text_line(image_np, box) for box in boxes]
+            keys = [line_cache.make_key(crop) for crop in crops]
+            results = line_cache.get_many(keys)
+            miss_idx = [i for i, result in enumerate(results) if result is None]
+            if miss_idx:
+                recognized, _ = self.ocr.text_recognizer([crops[i] for i in miss_idx])
+                for i, (text, score) in zip(miss_idx, recognized):
+                    results[i] = (text, float(score))
+                line_cache.put_many({keys[i]: results[i] for i in miss_idx})
+            line_cache.record_frame(len(boxes), len(miss_idx))
+        coord = [box for box, (_, score) in zip(boxes, results) if score > text_threshold]
+        text = [text for text, score in results if score > text_threshold]
+        return coord, text
+
+
+def _sorted_boxes(boxes: List) -> List:
+    """PaddleOCR's reading order: top to bottom, boxes on the same line (within 10 px) left to right"""
+    boxes = sorted(boxes, key=lambda box: (box[0][1], box[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def _crop_text_line(image_np: np.ndarray, box) -> np.ndarray:
+    """the text line inside a 4 point box, straightened as PaddleOCR crops it for its recognizer"""
+    points = np.asarray(box, dtype=np.float32)
+    w = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+    h = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+    target = np.float32([[0, 0], [w, 0], [w, h], [0, h]])
+    crop = cv2.warpPerspective(image_np, cv2.getPerspectiveTransform(points, target), (w, h), borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if h / max(w, 1) >= 1.5:
+        crop = np.rot90(crop)
+    return crop
+
+
+# name -> factory building the engine, engines are built on first use and kept warm, one per process.
+# The engines are not thread safe, each one serializes its calls with its own lock.
+_factories: Dict[str, Callable] = {
+    'easyocr': EasyOCREngine,
+    'paddleocr': PaddleOCREngine,
+}
+_engines = {}
+_lock = threading.Lock()
+
+
+def register_ocr_engine(name: str, factory: Callable):
+    """
+    Registers an OCR backend. `factory()` must return an object with
+    `read(image_np, easyocr_args=None) -> (coord, text)`, coord being one 4 point polygon per text box.
+    """
+    with _lock:
+        _factories[name] = factory
+        _engines.pop(name, None)
+
+
+def get_ocr_engine(name: str):
+    engine = _engines.get(name)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(name)
+            if engine is None:
+                if name not in _factories:
+                    raise ValueError(f"Unknown OCR engine {name!r}, registered engines: {sorted(_factories)}")
+                engine = _factories[name]()
+                _engines[name] = engine
+    return engine
+
+
+def check_line_cache(name: str, ocr_processes: int = 0):
+    """ValueError unless a TextLineCache (util.ocr_line_cache) can be used with this OCR configuration: an in-process
+    engine with cached recognition (read_cached, paddleocr), not the ocr_processes worker pool. Builds the engine"""
+    if ocr_processes > 1 or not hasattr(get_ocr_engine(name), 'read_cached'):
+        raise ValueError(f"line_cache needs an in-process OCR engine with cached recognition (paddleocr), got {name!r} with ocr_processes={ocr_processes}")
+
+
+def loaded_ocr_engines() -> List[str]:
+    return sorted(_engines)
+
+
+def warmup_ocr_engines(names: Iterable[str]):
+    """builds the engines and runs them once on a blank frame so the first request doesn't pay the lazy init"""
+    blank = np.full((64, 256, 3), 255, dtype=np.uint8)
+    for name in names:
+        get_ocr_engine(name).read(blank)
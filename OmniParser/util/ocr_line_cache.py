@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class TextLineCache:
+    """
+    LRU cache of OCR recognition results keyed by the content hash of the text line crop.
+
+    Between two frames most text lines are pixel-identical, wherever they moved to: the text detector still runs on
+    every frame, but only the lines missing from the cache go through the recognizer.
+
+    Attributes:
+        max_entries (int): number of lines kept before the least recently used ones are evicted
+        hits (int): lines whose text came from the cache
+        misses (int): lines that went through the recognizer
+        last_frame (Dict): lines, recognized and reused of the last frame read with this cache
+    """
+
+    def __init__(self, max_entries: int = 20000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.last_frame = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(crop: np.ndarray) -> str:
+        digest = hashlib.sha1(f"{crop.shape}\0".encode())
+        digest.update(np.ascontiguousarray(crop).tobytes())
+        return digest.hexdigest()
+
+    def get_many(self, keys: List[str]) -> List[Optional[Tuple[str, float]]]:
+        """(text, score) for `keys` in order, None for the misses"""
+        results = []
+        with self._lock:
+            for key in keys:
+                result = self._entries.get(key)
+                if result is not None:
+                    self._entries.move_to_end(key)
+                results.append(result)
+        return results
+
+    def put_many(self, items: Dict[str, Tuple[str, float]]):
+        with self._lock:
+            for key, result in items.items():
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_frame(self, lines: int, recognized: int):
+        with self._lock:
+            self.hits += lines - recognized
+            self.misses += recognized
+            self.last_frame = {'lines': lines, 'recognized': recognized, 'reused': lines - recognized}
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'last_frame': dict(self.last_frame),
+            }
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from util.ocr_engines import get_ocr_engine
+from util.tiling import band_grid, stitch_tile_text
+
+# engine of this worker process, built once by the pool initializer and kept warm
+_worker_engine = None
+# barrier shared by the workers of the pool, the warmup tasks wait on it
+_worker_barrier = None
+
+
+def _init_worker(engine_name: str, threads: int, barrier):
+    global _worker_engine, _worker_barrier
+    _worker_barrier = barrier
+    # each worker gets its share of the cores, torch defaults to all of them in every process
+    import torch
+    torch.set_num_threads(threads)
+    _worker_engine = get_ocr_engine(engine_name)
+
+
+def _read_band(band: np.ndarray, easyocr_args: Optional[Dict]) -> Tuple[List, List[str]]:
+    coord, text = _worker_engine.read(band, easyocr_args)
+    return [np.asarray(points, dtype=np.float64).tolist() for points in coord], list(text)
+
+
+def _warmup_worker(timeout: float):
+    _worker_engine.read(np.full((64, 256, 3), 255, dtype=np.uint8))
+    # this worker takes no other task until every worker holds one, so each worker gets exactly one warmup task
+    _worker_barrier.wait(timeout)
+    return os.getpid()
+
+
+class OCRProcessPool:
+    """
+    Runs an OCR engine over horizontal bands of a frame in parallel worker processes.
+
+    EasyOCR and PaddleOCR hold the GIL for most of their python-side work and use few cores on one frame, separate
+    processes each holding a warm reader scale with the cores. Bands overlap by `overlap` pixels (more than the
+    tallest text line): a line cut by a band seam is read whole in the neighbouring band, lines read in two bands
+    are deduplicated keeping the longer text (see util.tiling.stitch_tile_text).
+
+    Workers are spawned, so `engine_name` must be one of the engines util.ocr_engines registers on import
+    ('easyocr', 'paddleocr'), engines registered at runtime exist only in the parent process.
+
+    Attributes:
+        engine_name (str): OCR engine of the workers
+        processes (int): worker processes, also the number of bands of a frame
+        overlap (int): band overlap in pixels
+        min_band_height (int): frames too short for two bands of this height are read in the calling process
+    """
+
+    def __init__(self, engine_name: str, processes: int = 4, overlap: int = 64, min_band_height: int = 256):
+        self.engine_name = engine_name
+        self.processes = processes
+        self.overlap = overlap
+        self.min_band_height = min_band_height
+        threads = max(1, (os.cpu_count() or processes) // processes)
+        context = multiprocessing.get_context('spawn')
+        self._barrier = context.Barrier(processes)
+        self._executor = ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                                             initializer=_init_worker, initargs=(engine_name, threads, self._barrier))
+
+    def warmup(self, timeout: float = 600.0):
+        """starts every worker and builds its reader, the first frame doesn't pay for it"""
+        try:
+            list(self._executor.map(_warmup_worker, [timeout] * self.processes))
+        finally:
+            # a worker that failed to start breaks the barrier, the next warmup starts from a clean one
+            self._barrier.reset()
+
+    def read(self, image_np: np.ndarray, easyocr_args: Optional[Dict] = None) -> Tuple[List, List[str]]:
+        """same output as the engine's read(): (4 point polygons, texts), in frame pixels and reading order"""
+        h, w = image_np.shape[:2]
+        bands = min(self.processes, h // self.min_band_height)
+        if bands < 2:
+            return get_ocr_engine(self.engine_name).read(image_np, easyocr_args)
+        tiles = band_grid(w, h, bands, self.overlap)
+        futures = [self._executor.submit(_read_band, np.ascontiguousarray(image_np[y1:y2, x1:x2]), easyocr_args) for x1, y1, x2, y2 in tiles]
+        results = []
+        for future in futures:
+            coord, text = future.result()
+            xyxy = [[min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points)] for points in coord]
+            results.append((text, xyxy))
+        text, boxes = stitch_tile_text(results, tiles, w, h)
+        coord = [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes]
+        return coord, text
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_ocr_pool(engine_name: str, processes: int) -> OCRProcessPool:
+    """the persistent pool of this engine and size, created on first use"""
+    key = (engine_name, processes)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = OCRProcessPool(engine_name, processes)
+    return pool
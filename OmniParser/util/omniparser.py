@@ -1,32 +1,149 @@
-from util.utils import get_som_labeled_img, get_caption_model_processor, get_yolo_model, check_ocr_box
+from util.utils import get_caption_model_processor, get_yolo_model, parse_screen, parse_screen_batch, render_som_image, caption_parsed_elements
+from util.caption_cache import CaptionCache
+from util.ocr_engines import check_line_cache, get_ocr_engine, warmup_ocr_engines
+from util.ocr_pool import get_ocr_pool
+from util.ocr_line_cache import TextLineCache
+from util.caption_batcher import CaptionBatcher
+from util.caption_policy import CaptionPolicy
+from util.parse_store import ParseStore
+from util.image_codec import parse_codec
+from util.onnx_backend import configure_cpu_threads
+from util.tiling import DetectionModePlanner
+from util.transport import image_bytes
+from util.timing import StageTimer
+import numpy as np
 import torch
 from PIL import Image
 import io
-import base64
-from typing import Dict
+import time
+from typing import Dict, List, Optional, Union
 class Omniparser(object):
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, start: bool = True):
+        """start=False only loads the weights, for the master of a prefork server (see util.prefork): threads, OCR
+        warm-up passes, sqlite connections and worker pools are started by start() in each forked worker"""
         self.config = config
         device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
-        self.som_model = get_yolo_model(model_path=config['som_model_path'])
-        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device)
+        # 'onnx' / 'onnx-int8' run the icon detector on ONNX Runtime, caption_int8 quantizes the caption model, both for CPU hosts
+        # a prefork master loads with one thread, a PyTorch thread pool started before the fork hangs the workers
+        configure_cpu_threads(config.get('intra_op_threads', 0) if start else 1)
+        self.som_model = get_yolo_model(model_path=config['som_model_path'], backend=config.get('detector_backend', 'pytorch'),
+                                        intra_op_threads=config.get('intra_op_threads', 0), inter_op_threads=config.get('inter_op_threads', 1))
+        self.caption_model_processor = get_caption_model_processor(model_name=config['caption_model_name'], model_name_or_path=config['caption_model_path'], device=device, quantize=config.get('caption_int8', False))
+        self.last_timings = {}
+        self.ocr_engine = config.get('ocr_engine', 'easyocr')
+        get_ocr_engine(self.ocr_engine)
+        # > 1 reads frames in horizontal bands on a pool of OCR worker processes
+        self.ocr_processes = config.get('ocr_processes', 0)
+        # paddleocr: only text lines not read on earlier frames go through the recognizer
+        self.ocr_line_cache = TextLineCache(max_entries=config['ocr_line_cache_size']) if config.get('ocr_line_cache_size') else None
+        if self.ocr_line_cache is not None:
+            # fails at startup instead of on every parse
+            check_line_cache(self.ocr_engine, self.ocr_processes)
+        self.caption_cache = None
+        self.caption_batcher = None
+        # tiny icons are dropped, identical icons captioned once, optionally at most max_captions captions per frame
+        self.caption_policy = CaptionPolicy(min_size=config.get('caption_min_size', 6), dedupe=config.get('caption_dedupe', True), max_captions=config.get('max_captions'))
+        # frames of structured-only parses, rendered on demand by render()
+        self.parse_store = ParseStore(ttl=config.get('parse_store_ttl', 120.0))
+        # codec of the SOM image when parse() doesn't pick one, see util.image_codec
+        self.som_image_codec = config.get('som_image_codec') or 'png'
+        # None keeps the default detection pass, otherwise 'full', 'tiled', 'downscaled' or 'adaptive' (see util.tiling)
+        self.detection_mode = config.get('detection_mode')
+        self.detection_planner = DetectionModePlanner(tile_size=config.get('tile_size', 1280), overlap=config.get('tile_overlap', 128))
+        parse_codec(self.som_image_codec)
+        if start:
+            self.start()
         print('Omniparser initialized!!!')
 
-    def parse(self, image_base64: str):
-        image_bytes = base64.b64decode(image_base64)
-        image = Image.open(io.BytesIO(image_bytes))
-        print('image size:', image.size)
-        
-        box_overlay_ratio = max(image.size) / 3200
-        draw_bbox_config = {
+    def start(self):
+        """per-process runtime: CPU threads, OCR warm-up, OCR worker pool, caption cache and batcher"""
+        configure_cpu_threads(self.config.get('intra_op_threads', 0))
+        warmup_ocr_engines([self.ocr_engine])
+        if self.ocr_processes > 1:
+            get_ocr_pool(self.ocr_engine, self.ocr_processes).warmup()
+        self.caption_cache = CaptionCache(max_entries=self.config.get('caption_cache_size', 10000), path=self.config.get('caption_cache_path'),
+                                          max_disk_entries=self.config.get('caption_cache_disk_size', 100000))
+        # icons of concurrent parse calls are captioned in shared batches
+        self.caption_batcher = CaptionBatcher(self.caption_model_processor, batch_size=128, max_wait_ms=self.config.get('caption_batch_wait_ms', 5.0))
+
+    def parse(self, image_base64: Union[str, bytes], return_som_image: bool = True, image_codec: Optional[str] = None, lazy_captions: bool = False, base64_image: bool = True):
+        """(som image base64, elements, parse_id, timings), elements the ParsedElements of the screenshot. When return_som_image is False the SOM image is not drawn,
+        it is None and parse_id can be handed to render() later. With lazy_captions icons are not captioned (content None),
+        caption() captions the ones asked for later with the parse_id. timings has the seconds spent in each parse stage.
+        The screenshot is base64 or the raw encoded bytes of an upload, base64_image=False returns the SOM image as bytes"""
+        image_codec = image_codec or self.som_image_codec
+        start = time.perf_counter()
+        timer = StageTimer()
+        with timer.stage('decode'):
+            # one RGB frame shared by every stage and kept by the parse store, no copy in between
+            frame = np.asarray(Image.open(io.BytesIO(image_bytes(image_base64))).convert('RGB'))
+        print('image size:', frame.shape[1::-1])
+        draw_bbox_config = self._draw_bbox_config(frame)
+
+        # ocr and icon detection run concurrently, timings has the per stage breakdown
+        dino_labled_img, label_coordinates, elements, timings = parse_screen(frame, self.som_model, self.caption_model_processor, ocr_kwargs=self._ocr_kwargs(), BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, draw_bbox_config=draw_bbox_config, use_local_semantics=not lazy_captions, iou_threshold=0.7, scale_img=False, batch_size=128, caption_cache=self.caption_cache, caption_batcher=self.caption_batcher, caption_policy=self.caption_policy, detection_mode=self.detection_mode, latency_budget_ms=self.config.get('latency_budget_ms'), planner=self.detection_planner, render_som=return_som_image, image_codec=image_codec, timer=timer, base64_image=base64_image)
+
+        parse_id = None
+        if not return_som_image or lazy_captions:
+            with timer.stage('store'):
+                parse_id = self.parse_store.put({'frame': frame, 'elements': elements, 'draw_bbox_config': draw_bbox_config})
+            timings['store'] = timer.as_dict()['store']
+        timings['total'] = round(time.perf_counter() - start, 4)
+        self.last_timings = timings
+        return dino_labled_img, elements, parse_id, timings
+
+    def parse_batch(self, images: List[Union[str, bytes]], return_som_image: bool = True, image_codec: Optional[str] = None, lazy_captions: bool = False, base64_image: bool = True):
+        """parse() of several screenshots in one call: one batched detector predict, the icon crops of all frames in
+        shared caption batches (see util.utils.parse_screen_batch). Returns ([(som image, elements, parse_id)
+        per screenshot], timings of the batch). The detection_mode is not used, frames are detected in one pass."""
+        image_codec = image_codec or self.som_image_codec
+        start = time.perf_counter()
+        decode_start = time.perf_counter()
+        frames = [np.asarray(Image.open(io.BytesIO(image_bytes(image))).convert('RGB')) for image in images]
+        decode_seconds = time.perf_counter() - decode_start
+        draw_bbox_configs = [self._draw_bbox_config(frame) for frame in frames]
+        results, timings = parse_screen_batch(frames, self.som_model, self.caption_model_processor, ocr_kwargs=self._ocr_kwargs(), draw_bbox_configs=draw_bbox_configs,
+                                              BOX_TRESHOLD=self.config['BOX_TRESHOLD'], output_coord_in_ratio=True,
+                                              use_local_semantics=not lazy_captions, iou_threshold=0.7, scale_img=False, batch_size=128, caption_cache=self.caption_cache,
+                                              caption_policy=self.caption_policy, render_som=return_som_image, image_codec=image_codec, base64_image=base64_image)
+        parsed = []
+        for frame, draw_bbox_config, (dino_labled_img, _, elements) in zip(frames, draw_bbox_configs, results):
+            parse_id = None
+            if not return_som_image or lazy_captions:
+                parse_id = self.parse_store.put({'frame': frame, 'elements': elements, 'draw_bbox_config': draw_bbox_config})
+            parsed.append((dino_labled_img, elements, parse_id))
+        timings['decode'] = round(timings.get('decode', 0.0) + decode_seconds, 4)
+        timings['total'] = round(time.perf_counter() - start, 4)
+        return parsed, timings
+
+    def _draw_bbox_config(self, frame: np.ndarray) -> Dict:
+        box_overlay_ratio = max(frame.shape[:2]) / 3200
+        return {
             'text_scale': 0.8 * box_overlay_ratio,
             'text_thickness': max(int(2 * box_overlay_ratio), 1),
             'text_padding': max(int(3 * box_overlay_ratio), 1),
             'thickness': max(int(3 * box_overlay_ratio), 1),
         }
 
-        (text, ocr_bbox), _ = check_ocr_box(image, display_img=False, output_bb_format='xyxy', easyocr_args={'text_threshold': 0.8}, use_paddleocr=False)
-        dino_labled_img, label_coordinates, parsed_content_list = get_som_labeled_img(image, self.som_model, BOX_TRESHOLD = self.config['BOX_TRESHOLD'], output_coord_in_ratio=True, ocr_bbox=ocr_bbox,draw_bbox_config=draw_bbox_config, caption_model_processor=self.caption_model_processor, ocr_text=text,use_local_semantics=True, iou_threshold=0.7, scale_img=False, batch_size=128)
+    def _ocr_kwargs(self) -> Dict:
+        return {'easyocr_args': {'text_threshold': 0.8}, 'ocr_engine': self.ocr_engine, 'ocr_processes': self.ocr_processes, 'line_cache': self.ocr_line_cache}
+
+    def render(self, parse_id: str, image_codec: Optional[str] = None, base64_image: bool = True) -> Optional[Union[str, bytes]]:
+        """SOM image base64 (bytes when not base64_image) of an earlier structured-only parse, None if parse_id is unknown or expired"""
+        entry = self.parse_store.get(parse_id)
+        if entry is None:
+            return None
+        boxes = entry['elements'].bbox
+        dino_labled_img, _ = render_som_image(entry['frame'], boxes, draw_bbox_config=entry['draw_bbox_config'], image_codec=image_codec or self.som_image_codec, base64_image=base64_image)
+        return dino_labled_img
 
-        return dino_labled_img, parsed_content_list
\ No newline at end of file
+    def caption(self, parse_id: str, box_ids: List[int]) -> Optional[Dict[int, str]]:
+        """{box id: caption} of elements of an earlier lazily captioned parse, None if parse_id is unknown or expired,
+        ValueError for box ids the parse doesn't have"""
+        # concurrent requests on the same parse update its elements one at a time
+        with self.parse_store.locked(parse_id) as entry:
+            if entry is None:
+                return None
+            return caption_parsed_elements(entry['frame'], entry['elements'], box_ids, self.caption_model_processor,
+                                           caption_cache=self.caption_cache, caption_batcher=self.caption_batcher)
@@ -0,0 +1,137 @@
+import os
+from types import SimpleNamespace
+from typing import Optional
+
+import cv2
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.ops import nms
+
+
+def export_yolo_onnx(model_path: str, onnx_path: Optional[str] = None, quantize: bool = False) -> str:
+    """
+    Exports the ultralytics icon detector to ONNX with dynamic input shapes (same letterboxing as the PyTorch
+    predictor), optionally dynamically int8 quantized. Returns the path of the ONNX file, next to model_path by default.
+    """
+    from ultralytics import YOLO
+    onnx_path = onnx_path or os.path.splitext(model_path)[0] + ('.int8.onnx' if quantize else '.onnx')
+    fp32_path = onnx_path.replace('.int8.onnx', '.onnx') if quantize else onnx_path
+    if not os.path.exists(fp32_path):
+        exported = YOLO(model_path).export(format='onnx', dynamic=True, simplify=True)
+        if os.path.abspath(exported) != os.path.abspath(fp32_path):
+            os.replace(exported, fp32_path)
+    if quantize and not os.path.exists(onnx_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, onnx_path, weight_type=QuantType.QUInt8)
+    return onnx_path
+
+
+def letterbox(image: np.ndarray, imgsz=640, stride: int = 32):
+    """ultralytics LetterBox(auto=True): resize keeping the aspect ratio, pad to the minimum stride multiple.
+    imgsz is an int or (h, w). Returns the padded image and (gain_x, gain_y, pad_x, pad_y) to map boxes back."""
+    h, w = image.shape[:2]
+    target_h, target_w = (imgsz, imgsz) if isinstance(imgsz, int) else imgsz
+    # ultralytics check_imgsz: sizes are rounded up to stride multiples
+    target_h, target_w = -(-int(target_h) // stride) * stride, -(-int(target_w) // stride) * stride
+    r = min(target_h / h, target_w / w)
+    new_w, new_h = round(w * r), round(h * r)
+    dw, dh = np.mod(target_w - new_w, stride) / 2, np.mod(target_h - new_h, stride) / 2
+    if (w, h) != (new_w, new_h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = round(dh - 0.1), round(dh + 0.1)
+    left, right = round(dw - 0.1), round(dw + 0.1)
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return image, (new_w / w, new_h / h, left, top)
+
+
+class OnnxYoloDetector:
+    """
+    ONNX Runtime replacement of the ultralytics YOLO icon detector on CPU hosts.
+
+    `predict()` takes the arguments predict_yolo passes to ultralytics and returns results with the same
+    `boxes.xyxy` / `boxes.conf` tensors, so the rest of the pipeline doesn't know which backend ran.
+
+    Attributes:
+        intra_op_threads (int): threads of one operator, 0 lets ONNX Runtime use all physical cores
+        inter_op_threads (int): operators run in parallel, 1 (sequential) is fastest for this single branch model
+    """
+
+    def __init__(self, onnx_path: str, imgsz: int = 640, intra_op_threads: int = 0, inter_op_threads: int = 1):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL if inter_op_threads <= 1 else ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.imgsz = imgsz
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def predict(self, source, conf: float = 0.25, iou: float = 0.7, imgsz=None, max_det: int = 300, **kwargs):
+        """one result per image, a list of images is letterboxed and run in batches of frames with the same input shape"""
+        sources = source if isinstance(source, list) else [source]
+        inputs = [self._preprocess(image, imgsz) for image in sources]
+        results = [None] * len(inputs)
+        by_shape = {}
+        for i, (blob, _) in enumerate(inputs):
+            by_shape.setdefault(blob.shape, []).append(i)
+        for indices in by_shape.values():
+            preds = self.session.run(None, {self.input_name: np.concatenate([inputs[i][0] for i in indices])})[0]
+            for i, pred in zip(indices, preds):
+                results[i] = self._postprocess(pred.T, inputs[i][1], conf, iou, max_det)
+        return results
+
+    def _preprocess(self, source, imgsz):
+        if isinstance(source, str):
+            source = Image.open(source)
+        if isinstance(source, Image.Image):
+            image = np.asarray(source.convert('RGB'))
+        else:
+            # numpy frames are BGR, as for ultralytics
+            image = np.ascontiguousarray(np.asarray(source)[..., ::-1])
+        h, w = image.shape[:2]
+        padded, (gain_x, gain_y, pad_x, pad_y) = letterbox(image, imgsz or self.imgsz)
+        blob = np.ascontiguousarray(padded.transpose(2, 0, 1)[None], dtype=np.float32) / 255
+        return blob, (w, h, gain_x, gain_y, pad_x, pad_y)
+
+    @staticmethod
+    def _postprocess(pred: np.ndarray, meta, conf: float, iou: float, max_det: int):
+        """pred: (anchors, 4 + classes) of one image"""
+        w, h, gain_x, gain_y, pad_x, pad_y = meta
+        scores = pred[:, 4:]
+        class_conf = scores.max(axis=1)
+        keep = class_conf > conf
+        pred, class_conf, class_id = pred[keep], class_conf[keep], scores[keep].argmax(axis=1)
+        xyxy = np.concatenate([pred[:, :2] - pred[:, 2:4] / 2, pred[:, :2] + pred[:, 2:4] / 2], axis=1)
+
+        order = np.argsort(-class_conf, kind='stable')[:30000]
+        boxes = torch.from_numpy(xyxy[order])
+        confs = torch.from_numpy(class_conf[order])
+        # class offsets keep the nms per class, as ultralytics does with agnostic_nms=False
+        offsets = torch.from_numpy(class_id[order].astype(np.float32))[:, None] * 7680
+        kept = nms(boxes + offsets, confs, iou)[:max_det]
+        boxes, confs = boxes[kept], confs[kept]
+
+        boxes[:, [0, 2]] = ((boxes[:, [0, 2]] - pad_x) / gain_x).clamp_(0, w)
+        boxes[:, [1, 3]] = ((boxes[:, [1, 3]] - pad_y) / gain_y).clamp_(0, h)
+        return SimpleNamespace(boxes=SimpleNamespace(xyxy=boxes, conf=confs))
+
+
+def quantize_caption_model(caption_model_processor):
+    """
+    Dynamic int8 quantization of the Linear layers of the caption model (CPU only), weights are stored in int8 and
+    activations quantized on the fly. Florence-2's remote-code encoder-decoder with its generate loop has no ONNX
+    export path, this keeps it in PyTorch while getting most of the int8 speedup of its transformer blocks.
+    """
+    model = caption_model_processor['model']
+    model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return {'model': model.eval(), 'processor': caption_model_processor['processor']}
+
+
+def configure_cpu_threads(intra_op_threads: int = 0):
+    """threads of the PyTorch CPU kernels (caption model), 0 keeps the PyTorch default"""
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
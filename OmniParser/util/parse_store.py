@@ -0,0 +1,106 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+
+class ParseStore:
+    """
+    Keeps the frame and parsed elements of recent parses server side for `ttl` seconds, under a random parse id,
+    so follow-up requests (rendering the SOM image, ...) don't have to send the screenshot again. Each entry has its
+    own lock, held by locked() while a request updates the entry in place (lazy captions).
+
+    Attributes:
+        ttl (float): seconds an entry stays available after it was stored
+        max_entries (int): the oldest entries are dropped beyond this count
+    """
+
+    def __init__(self, ttl: float = 120.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._entries:
+            parse_id, (expires, _, _) = next(iter(self._entries.items()))
+            if expires > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.pop(parse_id)
+
+    def put(self, entry: Dict) -> str:
+        parse_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self._lock:
+            self._entries[parse_id] = (now + self.ttl, entry, threading.Lock())
+            self._expire(now)
+        return parse_id
+
+    def get(self, parse_id: str) -> Optional[Dict]:
+        """the stored entry, None if it is unknown or expired"""
+        with self._lock:
+            self._expire(time.monotonic())
+            item = self._entries.get(parse_id)
+        return item[1] if item else None
+
+    @contextmanager
+    def locked(self, parse_id: str) -> Iterator[Optional[Dict]]:
+        """the stored entry (None if unknown or expired) while holding its lock, one request at a time updates it"""
+        with self._lock:
+            self._expire(time.monotonic())
+            item = self._entries.get(parse_id)
+        if item is None:
+            yield None
+            return
+        with item[2]:
+            yield item[1]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class SessionStore:
+    """
+    Keeps per client state (incremental parsers holding the session's last frame and parse) under the session id
+    the client chose. A session is dropped `ttl` seconds after its last use, and beyond `max_sessions` the least
+    recently used ones are dropped first, so clients can't grow server memory without bound.
+
+    Attributes:
+        ttl (float): seconds a session stays available after its last use
+        max_sessions (int): sessions kept at most
+    """
+
+    def __init__(self, ttl: float = 600.0, max_sessions: int = 32):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._sessions:
+            session_id, (expires, _) = next(iter(self._sessions.items()))
+            if expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.pop(session_id)
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Any]) -> Any:
+        """the state of the session, created with factory() for a new or expired session"""
+        now = time.monotonic()
+        with self._lock:
+            item = self._sessions.pop(session_id, None)
+            state = item[1] if item and item[0] > now else factory()
+            self._sessions[session_id] = (now + self.ttl, state)
+            self._expire(now)
+        return state
+
+    def __contains__(self, session_id: str) -> bool:
+        with self._lock:
+            self._expire(time.monotonic())
+            return session_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
@@ -0,0 +1,212 @@
+import base64
+import json
+import struct
+from collections.abc import Mapping
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+WIRE_FORMAT = 'columnar/1'
+_MAGIC = b'OPEL'
+_HEADER = struct.Struct('<4sBI')  # magic, version, element count
+# wire dtypes of the numeric columns, little-endian
+_DTYPES = {'bbox': '<f4', 'type': 'u1', 'interactivity': 'u1', 'content': '<i4', 'source': 'u1'}
+
+
+class ParsedElements:
+    """
+    Struct-of-arrays form of parsed_content_list: one array per field instead of one dict per element.
+
+    Strings repeated across elements (types, sources, identical captions) are stored once in a table and referenced
+    by index, so a dense screen serializes to a fraction of the dict list's JSON. `elements[i]` is a read-only
+    dict-like view on row i, `to_dicts()` builds the legacy list of dicts.
+
+    Attributes:
+        bbox (np.ndarray): N x 4 float32 xyxy boxes, ratios of the frame size
+        type (np.ndarray): N uint8 indices into `types`
+        interactivity (np.ndarray): N bool
+        content (np.ndarray): N int32 indices into `strings`, -1 for elements without content (lazy captions)
+        source (np.ndarray): N uint8 indices into `sources`
+        types (List[str]): 'text', 'icon'
+        sources (List[str]): 'box_ocr_content_ocr', 'box_yolo_content_ocr', ... ('' for elements without a source)
+        strings (List[str]): the distinct contents
+    """
+
+    def __init__(self, bbox, type, interactivity, content, source, types: List[str], sources: List[str], strings: List[str]):
+        self.bbox = np.asarray(bbox, dtype=np.float32).reshape(-1, 4)
+        self.type = np.asarray(type, dtype=np.uint8)
+        self.interactivity = np.asarray(interactivity, dtype=bool)
+        self.content = np.asarray(content, dtype=np.int32)
+        self.source = np.asarray(source, dtype=np.uint8)
+        self.types = list(types)
+        self.sources = list(sources)
+        self.strings = list(strings)
+
+    @classmethod
+    def from_columns(cls, bbox, types: List[str], interactivity, contents: List[Optional[str]], sources: List[str]) -> 'ParsedElements':
+        """from per row columns: N x 4 boxes, and the type, interactivity, content (None for none) and source of each row"""
+        type_table, source_table, string_table = {}, {}, {}
+        type_idx = [type_table.setdefault(t, len(type_table)) for t in types]
+        source_idx = [source_table.setdefault(source, len(source_table)) for source in sources]
+        content_idx = [-1 if content is None else string_table.setdefault(content, len(string_table)) for content in contents]
+        return cls(bbox, type_idx, interactivity, content_idx, source_idx, list(type_table), list(source_table), list(string_table))
+
+    @classmethod
+    def from_dicts(cls, elements: List[Dict], bbox=None) -> 'ParsedElements':
+        """from parsed_content_list, bbox optionally gives the N x 4 boxes as an array (no float list round trip)"""
+        if bbox is None:
+            bbox = [elem['bbox'] for elem in elements]
+        return cls.from_columns(bbox, [elem['type'] for elem in elements], [elem['interactivity'] for elem in elements],
+                                [elem['content'] for elem in elements], [elem.get('source', '') for elem in elements])
+
+    @classmethod
+    def concatenate(cls, parts: List['ParsedElements']) -> 'ParsedElements':
+        """the rows of all parts in order, string tables merged"""
+        types, sources, strings = {}, {}, {}
+        columns = {'bbox': [], 'type': [], 'interactivity': [], 'content': [], 'source': []}
+        for part in parts:
+            type_map = np.array([types.setdefault(t, len(types)) for t in part.types], dtype=np.int64)
+            source_map = np.array([sources.setdefault(t, len(sources)) for t in part.sources], dtype=np.int64)
+            # -1 (no content) maps to -1 through the trailing entry
+            string_map = np.array([strings.setdefault(t, len(strings)) for t in part.strings] + [-1], dtype=np.int64)
+            columns['bbox'].append(part.bbox)
+            columns['type'].append(type_map[part.type])
+            columns['interactivity'].append(part.interactivity)
+            columns['content'].append(string_map[part.content])
+            columns['source'].append(source_map[part.source])
+        if not parts:
+            return cls(np.empty((0, 4)), [], [], [], [], [], [], [])
+        return cls(*(np.concatenate(columns[name]) for name in ['bbox', 'type', 'interactivity', 'content', 'source']), list(types), list(sources), list(strings))
+
+    def take(self, indices) -> 'ParsedElements':
+        """the rows at `indices`, in that order, with the same string tables"""
+        indices = np.asarray(indices, dtype=np.int64)
+        return ParsedElements(self.bbox[indices], self.type[indices], self.interactivity[indices], self.content[indices], self.source[indices],
+                              self.types, self.sources, self.strings)
+
+    def copy(self) -> 'ParsedElements':
+        return self.take(np.arange(len(self)))
+
+    def set_content(self, i: int, content: Optional[str], source: str):
+        """sets the content and source of row i (e.g. the caption of a lazily captioned icon)"""
+        if not self.content.flags.writeable:
+            self.content = self.content.copy()
+        if not self.source.flags.writeable:
+            self.source = self.source.copy()
+        if content is None:
+            self.content[i] = -1
+        else:
+            if content not in self.strings:
+                self.strings.append(content)
+            self.content[i] = self.strings.index(content)
+        if source not in self.sources:
+            self.sources.append(source)
+        self.source[i] = self.sources.index(source)
+
+    def __len__(self) -> int:
+        return len(self.type)
+
+    def __getitem__(self, i: int) -> 'ElementView':
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        return ElementView(self, i % len(self))
+
+    def __iter__(self) -> Iterator['ElementView']:
+        return (ElementView(self, i) for i in range(len(self)))
+
+    def content_of(self, i: int) -> Optional[str]:
+        j = self.content[i]
+        return None if j < 0 else self.strings[j]
+
+    def to_dicts(self) -> List[Dict]:
+        """the legacy parsed_content_list"""
+        bbox = self.bbox.tolist()
+        interactivity = self.interactivity.tolist()
+        return [{'type': self.types[t], 'bbox': b, 'interactivity': it, 'content': None if c < 0 else self.strings[c], 'source': self.sources[s]}
+                for t, b, it, c, s in zip(self.type.tolist(), bbox, interactivity, self.content.tolist(), self.source.tolist())]
+
+    def to_wire(self, binary: bool = True, raw_bytes: bool = False) -> Dict:
+        """
+        JSON-ready columnar form. With binary, the numeric columns are base64 encoded little-endian arrays
+        (bbox float32, type/interactivity/source uint8, content int32), otherwise plain lists. raw_bytes keeps the
+        binary columns as bytes, for msgpack responses (see util.transport).
+        """
+        columns = {'bbox': self.bbox, 'type': self.type, 'interactivity': self.interactivity.astype(np.uint8), 'content': self.content, 'source': self.source}
+        if binary:
+            columns = {name: np.ascontiguousarray(array, dtype=_DTYPES[name]).tobytes() for name, array in columns.items()}
+            if not raw_bytes:
+                columns = {name: base64.b64encode(data).decode('ascii') for name, data in columns.items()}
+        else:
+            columns = {name: array.tolist() for name, array in columns.items()}
+        return {'format': WIRE_FORMAT, 'count': len(self), 'binary': binary, **columns, 'types': self.types, 'sources': self.sources, 'strings': self.strings}
+
+    @classmethod
+    def from_wire(cls, wire: Dict) -> 'ParsedElements':
+        if wire.get('format') != WIRE_FORMAT:
+            raise ValueError(f"Unsupported parsed elements format {wire.get('format')!r}, expected {WIRE_FORMAT!r}")
+        if wire.get('binary'):
+            columns = {name: np.frombuffer(wire[name] if isinstance(wire[name], bytes) else base64.b64decode(wire[name]), dtype=dtype) for name, dtype in _DTYPES.items()}
+        else:
+            columns = {name: np.asarray(wire[name], dtype=dtype) for name, dtype in _DTYPES.items()}
+        return cls(columns['bbox'], columns['type'], columns['interactivity'], columns['content'], columns['source'], wire['types'], wire['sources'], wire['strings'])
+
+    def to_bytes(self) -> bytes:
+        """binary frame: header, the numeric columns back to back, then the string tables as JSON"""
+        tables = json.dumps({'types': self.types, 'sources': self.sources, 'strings': self.strings}, ensure_ascii=False).encode()
+        return b''.join([
+            _HEADER.pack(_MAGIC, 1, len(self)),
+            np.ascontiguousarray(self.bbox, dtype=_DTYPES['bbox']).tobytes(),
+            self.type.tobytes(),
+            self.interactivity.astype(np.uint8).tobytes(),
+            self.source.tobytes(),
+            np.ascontiguousarray(self.content, dtype=_DTYPES['content']).tobytes(),
+            tables,
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ParsedElements':
+        magic, version, n = _HEADER.unpack_from(data)
+        if magic != _MAGIC or version != 1:
+            raise ValueError('Not a parsed elements frame')
+        offset = _HEADER.size
+        columns = []
+        for name in ['bbox', 'type', 'interactivity', 'source', 'content']:
+            array = np.frombuffer(data, dtype=_DTYPES[name], count=n * 4 if name == 'bbox' else n, offset=offset)
+            offset += array.nbytes
+            columns.append(array)
+        bbox, type, interactivity, source, content = columns
+        tables = json.loads(data[offset:].decode())
+        return cls(bbox, type, interactivity, content, source, tables['types'], tables['sources'], tables['strings'])
+
+
+class ElementView(Mapping):
+    """read-only dict-like row of ParsedElements, fields are read from the columns on access"""
+    __slots__ = ('_elements', '_i')
+    _keys = ('type', 'bbox', 'interactivity', 'content', 'source')
+
+    def __init__(self, elements: ParsedElements, i: int):
+        self._elements = elements
+        self._i = i
+
+    def __getitem__(self, key):
+        elements, i = self._elements, self._i
+        if key == 'type':
+            return elements.types[elements.type[i]]
+        if key == 'bbox':
+            return elements.bbox[i].tolist()
+        if key == 'interactivity':
+            return bool(elements.interactivity[i])
+        if key == 'content':
+            return elements.content_of(i)
+        if key == 'source':
+            return elements.sources[elements.source[i]]
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self))
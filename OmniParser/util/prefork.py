@@ -0,0 +1,138 @@
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Dict, Optional
+
+import uvicorn
+
+
+class PreforkServer:
+    """
+    Serves an ASGI app from `workers` processes forked from one master that loaded the models.
+
+    The master runs `setup()` once (model weights, OCR readers), binds the listening socket and forks the workers:
+    they share the loaded weights copy-on-write instead of each loading its own multi-GB copy, and accept
+    connections from the same socket. Each worker runs `post_fork(worker_index)` (per-process state: threads,
+    sqlite connections, OCR worker pools, warm-up passes) and then uvicorn. The master supervises: a worker that
+    exits is forked again, after a delay growing while it keeps crashing right after starting. SIGTERM / SIGINT stop
+    the workers and the master.
+
+    Nothing must start a CPU thread pool in the master before the fork (PyTorch OpenMP, OCR engine reads): forked
+    children inherit the pool state without its threads and hang on their first parallel op. `setup()` should only
+    load weights with one PyTorch thread and leave warm-up passes to `post_fork`.
+
+    State kept in process memory (parse ids of /render/ and /caption/, incremental parse sessions) is per worker,
+    follow-up requests reaching another worker don't find it.
+
+    Attributes:
+        workers (int): worker processes
+        restart_delay (float): seconds before re-forking a crashed worker, doubled while workers crash within
+            `min_uptime` seconds, up to 30 s
+        restarts (int): workers forked again since start
+    """
+
+    def __init__(self, app, host: str, port: int, workers: int = 2, setup: Optional[Callable[[], None]] = None,
+                 post_fork: Optional[Callable[[int], None]] = None, restart_delay: float = 1.0, min_uptime: float = 30.0,
+                 log_level: str = 'info'):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.setup = setup
+        self.post_fork = post_fork
+        self.restart_delay = restart_delay
+        self.min_uptime = min_uptime
+        self.log_level = log_level
+        self.restarts = 0
+        self._children: Dict[int, tuple] = {}  # pid -> (worker index, fork time)
+        self._socket = None
+        self._stopping = False
+
+    def run(self):
+        if self.setup is not None:
+            self.setup()
+        self._socket = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(2048)
+        self._socket.set_inheritable(True)
+        # objects allocated so far are never collected, the collector doesn't write to their pages and they stay shared
+        gc.collect()
+        gc.freeze()
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        print(f"Prefork master {os.getpid()} serving on {self.host}:{self.port} with {self.workers} workers")
+        for index in range(self.workers):
+            self._fork(index)
+        delay = self.restart_delay
+        while not self._stopping:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                pid = 0
+            if pid == 0 or pid not in self._children:
+                time.sleep(0.2)
+                continue
+            index, forked_at = self._children.pop(pid)
+            if self._stopping:
+                break
+            crashed_early = time.monotonic() - forked_at < self.min_uptime
+            delay = min(delay * 2, 30.0) if crashed_early else self.restart_delay
+            print(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}, restarting in {delay:.1f} s")
+            time.sleep(delay)
+            if not self._stopping:
+                self.restarts += 1
+                self._fork(index)
+        self._shutdown()
+
+    def _fork(self, index: int):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = (index, time.monotonic())
+            return
+        # worker process
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            if self.post_fork is not None:
+                self.post_fork(index)
+            print(f"Worker {index} (pid {os.getpid()}) ready")
+            server = uvicorn.Server(uvicorn.Config(self.app, log_level=self.log_level))
+            server.run(sockets=[self._socket])
+        except BaseException as e:
+            print(f"Worker {index} failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+
+    def _signal_children(self, signum):
+        for pid in self._children:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _shutdown(self, timeout: float = 30.0):
+        self._signal_children(signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        while self._children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self._children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+        self._signal_children(signal.SIGKILL)
+        self._socket.close()
+        print("Prefork master stopped")
@@ -0,0 +1,102 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    Uniform grid bucketing of xyxy boxes, answers "which boxes intersect this rectangle".
+
+    Every box is registered in all the cells it spans, a query only looks at the cells covered by the
+    query rectangle, so the cost scales with the local element density instead of the total number of
+    boxes on screen. Works in any coordinate space (normalized ratios or pixels).
+
+    Attributes:
+        boxes (np.ndarray): (N, 4) xyxy boxes the index was built from
+        cell_size (Tuple[float, float]): width and height of a grid cell
+    """
+
+    def __init__(self, boxes, cell_size: Optional[Tuple[float, float]] = None, max_cells_per_axis: int = 64):
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        # (cell key, box index) of every cell each box spans, sorted by cell key
+        self._cell_keys = np.empty(0, dtype=np.int64)
+        self._cell_boxes = np.empty(0, dtype=np.int64)
+        valid = np.isfinite(self.boxes).all(axis=1) & (self.boxes[:, 2] >= self.boxes[:, 0]) & (self.boxes[:, 3] >= self.boxes[:, 1])
+        if not valid.any():
+            self.origin = (0.0, 0.0)
+            self.cell_size = (1.0, 1.0)
+            self.grid_shape = (0, 0)
+            return
+
+        boxes = self.boxes[valid]
+        x_min, y_min = boxes[:, 0].min(), boxes[:, 1].min()
+        x_max, y_max = boxes[:, 2].max(), boxes[:, 3].max()
+        if cell_size is None:
+            # about two typical boxes per cell, bounded so that huge screens don't explode the grid
+            cell_size = (2 * np.median(boxes[:, 2] - boxes[:, 0]), 2 * np.median(boxes[:, 3] - boxes[:, 1]))
+        cell_w = max(float(cell_size[0]), (x_max - x_min) / max_cells_per_axis, 1e-9)
+        cell_h = max(float(cell_size[1]), (y_max - y_min) / max_cells_per_axis, 1e-9)
+        self.origin = (float(x_min), float(y_min))
+        self.cell_size = (cell_w, cell_h)
+        self.grid_shape = (int((x_max - x_min) // cell_w) + 1, int((y_max - y_min) // cell_h) + 1)
+
+        owner, keys = self._spanned_cells(boxes)
+        order = np.argsort(keys, kind='stable')
+        self._cell_keys = keys[order]
+        self._cell_boxes = np.flatnonzero(valid)[owner[order]]
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell_range(self, rects):
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        cols, rows = self.grid_shape
+        col1 = np.clip((rects[:, 0] - self.origin[0]) // self.cell_size[0], 0, cols - 1).astype(np.int64)
+        row1 = np.clip((rects[:, 1] - self.origin[1]) // self.cell_size[1], 0, rows - 1).astype(np.int64)
+        col2 = np.clip((rects[:, 2] - self.origin[0]) // self.cell_size[0], 0, cols - 1).astype(np.int64)
+        row2 = np.clip((rects[:, 3] - self.origin[1]) // self.cell_size[1], 0, rows - 1).astype(np.int64)
+        return col1, row1, col2, row2
+
+    def _spanned_cells(self, rects) -> Tuple[np.ndarray, np.ndarray]:
+        """(rectangle index, cell key) of every grid cell each rectangle spans"""
+        col1, row1, col2, row2 = self._cell_range(rects)
+        rows = row2 - row1 + 1
+        counts = (col2 - col1 + 1) * rows
+        owner = np.repeat(np.arange(len(counts)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        col = col1[owner] + offset // rows[owner]
+        row = row1[owner] + offset % rows[owner]
+        return owner, col * self.grid_shape[1] + row
+
+    def query(self, rect) -> np.ndarray:
+        """
+        Indices (sorted ascending) of the boxes that intersect or touch `rect` (x1, y1, x2, y2).
+        Touching boxes are included, so callers filtering on a positive intersection never miss a box.
+        """
+        return self.query_pairs([rect])[1]
+
+    def query_pairs(self, rects) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        All (query index, box index) pairs of a batch of rectangles and the boxes they intersect or touch, ordered
+        by query index and then by box index. Computed for the whole batch at once: the cells of every query are
+        looked up in the sorted cell keys and the candidate pairs deduplicated with np.unique.
+        """
+        rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        if not len(self._cell_keys) or not len(rects):
+            return empty
+        valid = np.flatnonzero((rects[:, 2] >= rects[:, 0]) & (rects[:, 3] >= rects[:, 1]))
+        if not len(valid):
+            return empty
+        owner, keys = self._spanned_cells(rects[valid])
+        lo = np.searchsorted(self._cell_keys, keys, side='left')
+        counts = np.searchsorted(self._cell_keys, keys, side='right') - lo
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        query_idx = valid[np.repeat(owner, counts)]
+        box_idx = self._cell_boxes[np.repeat(lo, counts) + offset]
+        # a pair is found once per shared cell, unique also sorts by query then box
+        pairs = np.unique(query_idx * len(self.boxes) + box_idx)
+        query_idx, box_idx = pairs // len(self.boxes), pairs % len(self.boxes)
+        q, b = rects[query_idx], self.boxes[box_idx]
+        hit = (b[:, 0] <= q[:, 2]) & (b[:, 2] >= q[:, 0]) & (b[:, 1] <= q[:, 3]) & (b[:, 3] >= q[:, 1])
+        return query_idx[hit], box_idx[hit]
@@ -0,0 +1,234 @@
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+from torchvision.ops import nms
+
+
+def tile_grid(w: int, h: int, tile_size: int = 1280, overlap: int = 128) -> List[List[int]]:
+    """
+    Overlapping xyxy pixel tiles covering a w x h frame. All tiles have the same size (the last tile of a row or
+    column is shifted back inside the frame), so they can be run through the detector as one batch.
+    """
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        step = tile_size - overlap
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+
+    tile_w, tile_h = min(tile_size, w), min(tile_size, h)
+    return [[x, y, x + tile_w, y + tile_h] for y in starts(h) for x in starts(w)]
+
+
+def band_grid(w: int, h: int, bands: int, overlap: int = 64) -> List[List[int]]:
+    """`bands` full width horizontal xyxy bands covering a w x h frame, neighbours overlap by `overlap` pixels"""
+    bands = max(1, min(bands, h // max(overlap, 1)))
+    step = -(-h // bands)
+    return [[0, max(0, y - overlap // 2), w, min(h, y + step + overlap - overlap // 2)] for y in range(0, h, step)]
+
+
+def drop_cut_boxes(boxes: np.ndarray, tile, w: int, h: int, margin: int = 2) -> np.ndarray:
+    """
+    Mask of the tile boxes (frame coordinates) that don't touch an inner edge of their tile. A box touching an edge
+    shared with a neighbouring tile is probably cut, the neighbour sees it whole thanks to the overlap.
+    """
+    x1, y1, x2, y2 = tile
+    keep = np.ones(len(boxes), dtype=bool)
+    if x1 > 0:
+        keep &= boxes[:, 0] > x1 + margin
+    if y1 > 0:
+        keep &= boxes[:, 1] > y1 + margin
+    if x2 < w:
+        keep &= boxes[:, 2] < x2 - margin
+    if y2 < h:
+        keep &= boxes[:, 3] < y2 - margin
+    return keep
+
+
+def cut_box_groups(boxes: np.ndarray, sources: np.ndarray, cut: np.ndarray, covered_ratio: float = 0.7, axis_iou: float = 0.5) -> List[List[int]]:
+    """
+    Groups the cut boxes (frame coordinates) that are pieces of one element seen by several tiles.
+
+    A cut box lying mostly (`covered_ratio` of its area) inside a whole box is a piece of an element another tile
+    sees whole, it is left out. The other cut boxes are elements wider or taller than the overlap, no tile sees them
+    whole: pieces from different tiles that intersect and line up on one axis (1D IoU >= `axis_iou`) are grouped,
+    transitively, to be merged into one box. A piece no other tile saw stays a group of its own.
+
+    Returns:
+        lists of indices into boxes, one per element
+    """
+    cut_idx = np.flatnonzero(cut)
+    if not len(cut_idx):
+        return []
+    pieces = boxes[cut_idx]
+    area = np.maximum(pieces[:, 2] - pieces[:, 0], 0) * np.maximum(pieces[:, 3] - pieces[:, 1], 0)
+    whole = boxes[~cut]
+    if len(whole):
+        iw = np.clip(np.minimum(pieces[:, None, 2], whole[None, :, 2]) - np.maximum(pieces[:, None, 0], whole[None, :, 0]), 0, None)
+        ih = np.clip(np.minimum(pieces[:, None, 3], whole[None, :, 3]) - np.maximum(pieces[:, None, 1], whole[None, :, 1]), 0, None)
+        uncovered = ((iw * ih).max(axis=1) < covered_ratio * np.maximum(area, 1e-9))
+        cut_idx, pieces = cut_idx[uncovered], pieces[uncovered]
+    if not len(cut_idx):
+        return []
+
+    def axis_overlap(lo, hi):
+        inter = np.minimum(hi[:, None], hi[None, :]) - np.maximum(lo[:, None], lo[None, :])
+        union = np.maximum(hi[:, None], hi[None, :]) - np.minimum(lo[:, None], lo[None, :])
+        return inter, inter / np.maximum(union, 1e-9)
+
+    x_inter, x_iou = axis_overlap(pieces[:, 0], pieces[:, 2])
+    y_inter, y_iou = axis_overlap(pieces[:, 1], pieces[:, 3])
+    source = sources[cut_idx]
+    linked = (x_inter > 0) & (y_inter > 0) & (source[:, None] != source[None, :]) & ((x_iou >= axis_iou) | (y_iou >= axis_iou))
+    parent = list(range(len(cut_idx)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(linked, 1))):
+        parent[find(i)] = find(j)
+    groups = {}
+    for i in range(len(cut_idx)):
+        groups.setdefault(find(i), []).append(int(cut_idx[i]))
+    return list(groups.values())
+
+
+def stitch_tile_boxes(tile_results, tiles, w: int, h: int, iou_threshold: float = 0.5) -> Tuple[torch.Tensor, torch.Tensor, np.ndarray]:
+    """
+    Merges per tile detections into frame detections.
+
+    Args:
+        tile_results: one (xyxy, conf) per tile, boxes in tile pixel coordinates
+        tiles: the tiles' xyxy pixel rectangles in the frame
+    Returns:
+        (xyxy, conf, source) in frame pixel coordinates, highest confidence first, source the tile index of each box.
+        Boxes cut by an inner tile edge are dropped when a neighbouring tile sees them whole, the pieces of boxes
+        no tile sees whole are merged across the seams (see cut_box_groups). Duplicates from overlapping tiles are
+        suppressed with NMS.
+    """
+    all_boxes, all_conf, all_source, all_cut = [], [], [], []
+    for i, ((xyxy, conf), tile) in enumerate(zip(tile_results, tiles)):
+        xyxy = torch.as_tensor(xyxy, dtype=torch.float32).reshape(-1, 4).cpu() + torch.tensor([tile[0], tile[1], tile[0], tile[1]], dtype=torch.float32)
+        all_boxes.append(xyxy)
+        all_conf.append(torch.as_tensor(conf, dtype=torch.float32).reshape(-1).cpu())
+        all_source.append(np.full(len(xyxy), i))
+        all_cut.append(~drop_cut_boxes(xyxy.numpy(), tile, w, h))
+    if not all_boxes:
+        return torch.empty((0, 4)), torch.empty(0), np.empty(0, dtype=int)
+    boxes, conf, source, cut = torch.cat(all_boxes), torch.cat(all_conf), np.concatenate(all_source), np.concatenate(all_cut)
+    boxes_np = boxes.numpy()
+    whole = torch.from_numpy(~cut)
+    merged_boxes, merged_conf, merged_source = [boxes[whole]], [conf[whole]], [source[~cut]]
+    for group in cut_box_groups(boxes_np, source, cut):
+        pieces = boxes_np[group]
+        best = group[int(conf[group].argmax())]
+        merged_boxes.append(torch.tensor([[pieces[:, 0].min(), pieces[:, 1].min(), pieces[:, 2].max(), pieces[:, 3].max()]], dtype=torch.float32))
+        merged_conf.append(conf[best:best + 1])
+        merged_source.append(source[best:best + 1])
+    boxes, conf, source = torch.cat(merged_boxes), torch.cat(merged_conf), np.concatenate(merged_source)
+    kept = nms(boxes, conf, iou_threshold)
+    return boxes[kept], conf[kept], source[kept.numpy()]
+
+
+def join_cut_text(texts: List[str]) -> str:
+    """joins the texts of the pieces of one line, in reading order, without repeating what two pieces both read"""
+    joined = texts[0]
+    for text in texts[1:]:
+        overlap = next((n for n in range(min(len(joined), len(text)), 0, -1) if joined.endswith(text[:n])), 0)
+        joined = joined + text[overlap:] if overlap else f"{joined} {text}"
+    return joined
+
+
+def stitch_tile_text(tile_results, tiles, w: int, h: int, iou_threshold: float = 0.5) -> Tuple[List[str], List[List[int]]]:
+    """
+    Merges per tile OCR results, each one (text, xyxy boxes in tile pixels), into frame OCR results in reading order.
+    Lines cut by an inner tile edge are dropped when a neighbouring tile reads them whole, the pieces of lines no
+    tile reads whole are joined across the seams. Of the duplicates read in two tiles the longer text is kept.
+    """
+    texts, boxes, sources, cut = [], [], [], []
+    for i, ((text, bb), tile) in enumerate(zip(tile_results, tiles)):
+        if not len(bb):
+            continue
+        bb = np.asarray(bb, dtype=np.int64).reshape(-1, 4) + [tile[0], tile[1], tile[0], tile[1]]
+        texts.extend(text)
+        boxes.extend(bb.tolist())
+        sources.extend([i] * len(bb))
+        cut.extend((~drop_cut_boxes(bb, tile, w, h)).tolist())
+    if not boxes:
+        return [], []
+    cut = np.asarray(cut, dtype=bool)
+    groups = cut_box_groups(np.asarray(boxes, dtype=np.float64), np.asarray(sources), cut)
+    merged_texts = [t for t, c in zip(texts, cut) if not c]
+    merged_boxes = [b for b, c in zip(boxes, cut) if not c]
+    for group in groups:
+        group = sorted(group, key=lambda i: (boxes[i][0], boxes[i][1]))
+        merged_texts.append(join_cut_text([texts[i] for i in group]))
+        merged_boxes.append([min(boxes[i][0] for i in group), min(boxes[i][1] for i in group), max(boxes[i][2] for i in group), max(boxes[i][3] for i in group)])
+    texts, boxes = merged_texts, merged_boxes
+    tensor = torch.tensor(boxes, dtype=torch.float32)
+    kept = nms(tensor, torch.tensor([float(len(t)) for t in texts]), iou_threshold).tolist()
+    # reading order: top to bottom, then left to right
+    kept.sort(key=lambda i: (boxes[i][1], boxes[i][0]))
+    return [texts[i] for i in kept], [boxes[i] for i in kept]
+
+
+class DetectionModePlanner:
+    """
+    Picks how a frame is run through the icon detector:
+
+    - 'full': one pass at native resolution
+    - 'tiled': overlapping native resolution tiles, batched, results stitched back
+    - 'downscaled': one pass at the detector's default input size (fastest, small icons get lost on large frames)
+
+    Frames that fit in one tile are parsed in full (the only tile is the frame). Larger frames run at native
+    resolution, full or tiled, whichever is predicted cheaper, as long as that prediction fits in
+    `latency_budget_ms`, otherwise the other native mode if it fits, otherwise they are downscaled. Predictions are
+    exponential moving averages of the measured detection cost per megapixel of each mode (tiled megapixels count
+    the overlaps), updated after every full or tiled pass. Every `explore_every` large frames the native mode
+    predicted more expensive runs instead, when it fits the budget, so both estimates follow the host.
+    """
+
+    NATIVE_MODES = ('full', 'tiled')
+
+    def __init__(self, tile_size: int = 1280, overlap: int = 128, ms_per_megapixel: float = 120.0, explore_every: int = 50):
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.ms_per_megapixel = {mode: ms_per_megapixel for mode in self.NATIVE_MODES}
+        self.explore_every = explore_every
+        self._large_frames = 0
+        self._lock = threading.Lock()
+
+    def tiled_megapixels(self, w: int, h: int) -> float:
+        return sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in tile_grid(w, h, self.tile_size, self.overlap)) / 1e6
+
+    def megapixels(self, mode: str, w: int, h: int) -> float:
+        return self.tiled_megapixels(w, h) if mode == 'tiled' else w * h / 1e6
+
+    def predict_ms(self, mode: str, w: int, h: int) -> float:
+        """predicted detection latency of a full or tiled pass over a w x h frame"""
+        return self.megapixels(mode, w, h) * self.ms_per_megapixel[mode]
+
+    def choose(self, w: int, h: int, latency_budget_ms: Optional[float] = None) -> str:
+        if max(w, h) <= self.tile_size:
+            return 'full'
+        with self._lock:
+            self._large_frames += 1
+            explore = self.explore_every > 0 and self._large_frames % self.explore_every == 0
+        cheapest, other = sorted(self.NATIVE_MODES, key=lambda mode: self.predict_ms(mode, w, h))
+        candidates = [other, cheapest] if explore else [cheapest, other]
+        for mode in candidates:
+            if latency_budget_ms is None or self.predict_ms(mode, w, h) <= latency_budget_ms:
+                return mode
+        return 'downscaled'
+
+    def observe(self, mode: str, megapixels: float, seconds: float, alpha: float = 0.2):
+        """records the measured latency of a full or tiled pass over `megapixels`"""
+        if megapixels <= 0 or mode not in self.ms_per_megapixel:
+            return
+        with self._lock:
+            self.ms_per_megapixel[mode] = (1 - alpha) * self.ms_per_megapixel[mode] + alpha * seconds * 1000 / megapixels
@@ -0,0 +1,39 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+
+class StageTimer:
+    """
+    Collects wall-clock durations of the parse stages, thread safe so concurrent stages can report to one timer.
+
+    Example:
+        ```python
+        timer = StageTimer()
+        with timer.stage('ocr'):
+            ...
+        timer.as_dict()  # {'ocr': 0.412}
+        ```
+    """
+
+    def __init__(self):
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        """adds `seconds` to stage `name`, a stage entered several times accumulates"""
+        with self._lock:
+            self._timings[name] = self._timings.get(name, 0.0) + seconds
+
+    def as_dict(self, ndigits: int = 4) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, ndigits) for name, seconds in self._timings.items()}
@@ -0,0 +1,62 @@
+import base64
+from typing import Dict, Optional, Union
+
+try:
+    import msgpack
+except ImportError:  # msgpack responses are optional, JSON is always available
+    msgpack = None
+
+# binary transport of the parse endpoints: the screenshot is uploaded as raw bytes (image/*, application/octet-stream
+# or a multipart/form-data 'image' field) instead of base64 in JSON, and with 'Accept: application/msgpack' the
+# response is msgpack, the SOM image and the columnar elements as bytes instead of base64 strings
+MSGPACK_MIME_TYPE = 'application/msgpack'
+UPLOAD_FIELD = 'image'
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    """whether the Accept header asks for msgpack ('application/msgpack' or 'application/x-msgpack')"""
+    return bool(accept) and ('application/msgpack' in accept or 'application/x-msgpack' in accept)
+
+
+def image_bytes(image_data: Union[str, bytes]) -> bytes:
+    """the encoded image of a base64 string (JSON requests) or of raw bytes (uploads), as bytes"""
+    return base64.b64decode(image_data) if isinstance(image_data, str) else image_data
+
+
+async def read_upload(request) -> bytes:
+    """
+    Image bytes of an upload request: the raw body, or the 'image' field of a multipart/form-data body.
+    Raises ValueError on an empty body, a form without the field or a multipart body the server can't parse.
+    """
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('multipart/form-data'):
+        try:
+            form = await request.form()
+        except AssertionError as e:
+            # starlette parses forms with python-multipart
+            raise ValueError(f"multipart uploads are not available on this server ({e}), send the raw image bytes") from e
+        upload = form.get(UPLOAD_FIELD)
+        if upload is None:
+            raise ValueError(f"multipart upload without an {UPLOAD_FIELD!r} field")
+        data = await upload.read() if hasattr(upload, 'read') else upload.encode()
+    else:
+        data = await request.body()
+    if not data:
+        raise ValueError("Empty image upload")
+    return data
+
+
+def pack(response: Dict) -> bytes:
+    if msgpack is None:
+        raise RuntimeError("msgpack responses need the msgpack package")
+    return msgpack.packb(response, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Dict:
+    if msgpack is None:
+        raise RuntimeError("msgpack responses need the msgpack package")
+    return msgpack.unpackb(data, raw=False)
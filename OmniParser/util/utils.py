@@ -17,34 +17,35 @@ import cv2
 import numpy as np
 # %matplotlib inline
 from matplotlib import pyplot as plt
-import easyocr
-from paddleocr import PaddleOCR
-reader = easyocr.Reader(['en'])
-paddle_ocr = PaddleOCR(
-    lang='en',  # other lang also available
-    use_angle_cls=False,
-    use_gpu=False,  # using cuda will conflict with pytorch in the same process
-    show_log=False,
-    max_batch_size=1024,
-    use_dilation=True,  # improves accuracy
-    det_db_score_mode='slow',  # improves accuracy
-    rec_batch_num=1024)
+# ocr engines are built lazily on first use, see util.ocr_engines
+from util.ocr_engines import check_line_cache, get_ocr_engine
 import time
 import base64
 
 import os
 import ast
 import torch
-from typing import Tuple, List, Union
+from typing import Dict, Tuple, List, Optional, Union
 from torchvision.ops import box_convert
 import re
 from torchvision.transforms import ToPILImage
 import supervision as sv
 import torchvision.transforms as T
+import torch.nn.functional as F
+from functools import lru_cache
+from contextlib import nullcontext
 from util.box_annotator import BoxAnnotator 
+from util.spatial_index import GridIndex
+from util.timing import StageTimer
+from util.image_codec import encode_image, encode_image_base64
+from util.parsed_elements import ParsedElements
+from util.ocr_pool import get_ocr_pool
+from util.tiling import DetectionModePlanner, stitch_tile_boxes, stitch_tile_text, tile_grid
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
 
-def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None):
+def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2-opt-2.7b", device=None, quantize=False):
     if not device:
         device = "cuda" if torch.cuda.is_available() else "cpu"
     if model_name == "blip2":
@@ -65,52 +66,99 @@ def get_caption_model_processor(model_name, model_name_or_path="Salesforce/blip2
             model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float32, trust_remote_code=True)
         else:
             model = AutoModelForCausalLM.from_pretrained(model_name_or_path, torch_dtype=torch.float16, trust_remote_code=True).to(device)
-    return {'model': model.to(device), 'processor': processor}
+    caption_model_processor = {'model': model.to(device), 'processor': processor}
+    if quantize and device == 'cpu':
+        # int8 Linear layers for CPU hosts, see util.onnx_backend
+        from util.onnx_backend import quantize_caption_model
+        caption_model_processor = quantize_caption_model(caption_model_processor)
+    return caption_model_processor
 
 
-def get_yolo_model(model_path):
+def get_yolo_model(model_path, backend='pytorch', intra_op_threads=0, inter_op_threads=1):
+    """
+    backend: 'pytorch' (ultralytics), 'onnx' or 'onnx-int8' (ONNX Runtime on CPU, exported next to model_path on first use)
+    """
+    if backend in ('onnx', 'onnx-int8'):
+        from util.onnx_backend import OnnxYoloDetector, export_yolo_onnx
+        onnx_path = model_path if model_path.endswith('.onnx') else export_yolo_onnx(model_path, quantize=backend == 'onnx-int8')
+        return OnnxYoloDetector(onnx_path, intra_op_threads=intra_op_threads, inter_op_threads=inter_op_threads)
+    if backend != 'pytorch':
+        raise ValueError(f"Unknown detector backend {backend!r}, expected 'pytorch', 'onnx' or 'onnx-int8'")
     from ultralytics import YOLO
     # Load the model.
     model = YOLO(model_path)
     return model
 
 
-@torch.inference_mode()
-def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128):
-    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
-    to_pil = ToPILImage()
-    if starting_idx:
-        non_ocr_boxes = filtered_boxes[starting_idx:]
-    else:
-        non_ocr_boxes = filtered_boxes
-    croped_pil_image = []
-    for i, coord in enumerate(non_ocr_boxes):
-        try:
-            xmin, xmax = int(coord[0]*image_source.shape[1]), int(coord[2]*image_source.shape[1])
-            ymin, ymax = int(coord[1]*image_source.shape[0]), int(coord[3]*image_source.shape[0])
-            cropped_image = image_source[ymin:ymax, xmin:xmax, :]
-            cropped_image = cv2.resize(cropped_image, (64, 64))
-            croped_pil_image.append(to_pil(cropped_image))
-        except:
-            continue
+def crop_icon_batch(boxes, image_source: np.ndarray, size=64) -> np.ndarray:
+    """N x size x size x 3 uint8 crops of ratio xyxy boxes, resized into one preallocated buffer.
+    Degenerate boxes (empty after rounding or outside the frame) are clamped to at least one pixel inside the
+    frame instead of being skipped, so crop i always belongs to box i."""
+    if isinstance(boxes, torch.Tensor):
+        boxes = boxes.cpu().numpy()
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    h, w = image_source.shape[:2]
+    xmin = np.clip((boxes[:, 0] * w).astype(int), 0, w - 1)
+    ymin = np.clip((boxes[:, 1] * h).astype(int), 0, h - 1)
+    xmax = np.clip((boxes[:, 2] * w).astype(int), xmin + 1, w)
+    ymax = np.clip((boxes[:, 3] * h).astype(int), ymin + 1, h)
+    crops = np.empty((len(boxes), size, size, 3), dtype=np.uint8)
+    for i in range(len(boxes)):
+        crops[i] = cv2.resize(image_source[ymin[i]:ymax[i], xmin[i]:xmax[i], :3], (size, size))
+    return crops
+
+
+@lru_cache(maxsize=16)
+def _caption_text_inputs(processor, prompt):
+    """tokenized prompt of one sample, the same for every crop so it is computed once per processor and prompt"""
+    dummy = Image.new('RGB', (64, 64))
+    inputs = processor(images=[dummy], text=[prompt], return_tensors="pt")
+    return {k: v for k, v in inputs.items() if k != 'pixel_values'}
+
+
+def build_caption_inputs(crops: np.ndarray, processor, prompt, device, dtype=torch.float32, do_resize=True):
+    """caption model inputs for a batch of N x H x W x 3 uint8 crops.
+    pixel_values are built from the crop buffer with batched tensor ops (resize, rescale, normalize as configured in
+    the processor's image processor), without the per crop PIL round trip. Image processors doing anything else
+    (e.g. center crop) go through the processor itself."""
+    n = len(crops)
+    image_processor = getattr(processor, 'image_processor', None)
+    size = getattr(image_processor, 'size', None) or {}
+    size = size if isinstance(size, dict) else vars(size)
+    height = size.get('height') or size.get('shortest_edge')
+    width = size.get('width') or size.get('shortest_edge')
+    if image_processor is None or getattr(image_processor, 'do_center_crop', False) or not (height and width):
+        to_pil = ToPILImage()
+        inputs = processor(images=[to_pil(crop) for crop in crops], text=[prompt]*n, return_tensors="pt", do_resize=do_resize)
+        return {k: v.to(device=device, dtype=dtype) if v.is_floating_point() else v.to(device) for k, v in inputs.items()}
 
+    inputs = {k: v.repeat(n, *[1] * (v.dim() - 1)).to(device) for k, v in _caption_text_inputs(processor, prompt).items()}
+    pixel_values = torch.from_numpy(np.ascontiguousarray(crops)).to(device).permute(0, 3, 1, 2).float()
+    if do_resize and getattr(image_processor, 'do_resize', True):
+        # round like the uint8 image the processor would resize to
+        pixel_values = F.interpolate(pixel_values, size=(height, width), mode='bicubic', align_corners=False).round().clamp(0, 255)
+    if getattr(image_processor, 'do_rescale', True):
+        pixel_values = pixel_values * image_processor.rescale_factor
+    if getattr(image_processor, 'do_normalize', True):
+        mean = torch.tensor(image_processor.image_mean, device=device).view(1, -1, 1, 1)
+        std = torch.tensor(image_processor.image_std, device=device).view(1, -1, 1, 1)
+        pixel_values = (pixel_values - mean) / std
+    inputs['pixel_values'] = pixel_values.to(dtype)
+    return inputs
+
+
+@torch.inference_mode()
+def generate_icon_captions(crops: np.ndarray, caption_model_processor, prompt, batch_size=128):
+    """captions of N x 64 x 64 x 3 uint8 icon crops, `batch_size` crops per generate call"""
     model, processor = caption_model_processor['model'], caption_model_processor['processor']
-    if not prompt:
-        if 'florence' in model.config.name_or_path:
-            prompt = "<CAPTION>"
-        else:
-            prompt = "The image shows"
-    
     generated_texts = []
     device = model.device
-    for i in range(0, len(croped_pil_image), batch_size):
-        start = time.time()
-        batch = croped_pil_image[i:i+batch_size]
-        t1 = time.time()
+    for i in range(0, len(crops), batch_size):
+        batch = crops[i:i+batch_size]
         if model.device.type == 'cuda':
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt", do_resize=False).to(device=device, dtype=torch.float16)
+            inputs = build_caption_inputs(batch, processor, prompt, device, dtype=torch.float16, do_resize=False)
         else:
-            inputs = processor(images=batch, text=[prompt]*len(batch), return_tensors="pt").to(device=device)
+            inputs = build_caption_inputs(batch, processor, prompt, device)
         if 'florence' in model.config.name_or_path:
             generated_ids = model.generate(input_ids=inputs["input_ids"],pixel_values=inputs["pixel_values"],max_new_tokens=20,num_beams=1, do_sample=False)
         else:
@@ -118,10 +166,82 @@ def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_
         generated_text = processor.batch_decode(generated_ids, skip_special_tokens=True)
         generated_text = [gen.strip() for gen in generated_text]
         generated_texts.extend(generated_text)
-    
     return generated_texts
 
 
+def get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=None, batch_size=128, caption_cache=None, caption_batcher=None, timer=None, caption_policy=None):
+    """captions of the icon boxes filtered_boxes[starting_idx:] (all boxes when starting_idx is 0)
+
+    caption_cache: optional CaptionCache, only the misses are captioned
+    caption_batcher: optional CaptionBatcher, captions are generated in batches shared with concurrent requests
+    timer: optional StageTimer, records the 'crop' and 'caption' stages
+    caption_policy: optional CaptionPolicy, identical crops are captioned once and with max_captions the
+        lowest priority icons are not captioned, their caption is None
+    """
+    # Number of samples per batch, --> 128 roughly takes 4 GB of GPU memory for florence v2 model
+    if starting_idx:
+        non_ocr_boxes = filtered_boxes[starting_idx:]
+    else:
+        non_ocr_boxes = filtered_boxes
+    with _stage(timer, 'crop'):
+        croped_images = crop_icon_batch(non_ocr_boxes, image_source)
+        if caption_policy is not None:
+            selected, inverse = caption_policy.select(croped_images, np.asarray(non_ocr_boxes))
+            croped_images = croped_images[selected]
+    with _stage(timer, 'caption'):
+        captions = _caption_crops(croped_images, caption_model_processor, prompt, batch_size, caption_cache, caption_batcher)
+    if caption_policy is not None:
+        return caption_policy.expand(captions, inverse)
+    return captions
+
+
+def _caption_crops(croped_images, caption_model_processor, prompt, batch_size, caption_cache, caption_batcher):
+    model = caption_model_processor['model']
+    if not prompt:
+        if 'florence' in model.config.name_or_path:
+            prompt = "<CAPTION>"
+        else:
+            prompt = "The image shows"
+
+    # only the crops missing from the caption cache go to the model
+    if caption_cache is not None:
+        cache_keys = [caption_cache.make_key(crop, model.config.name_or_path, prompt) for crop in croped_images]
+        cached_texts = caption_cache.get_many(cache_keys)
+        miss_idx = [i for i, text in enumerate(cached_texts) if text is None]
+    else:
+        miss_idx = list(range(len(croped_images)))
+    miss_crops = croped_images[miss_idx]
+    if caption_batcher is not None:
+        generated_texts = caption_batcher.caption(miss_crops, prompt)
+    else:
+        generated_texts = generate_icon_captions(miss_crops, caption_model_processor, prompt, batch_size=batch_size)
+
+    if caption_cache is not None:
+        caption_cache.put_many({cache_keys[i]: text for i, text in zip(miss_idx, generated_texts)})
+        for i, text in zip(miss_idx, generated_texts):
+            cached_texts[i] = text
+        return cached_texts
+    return generated_texts
+
+
+
+def caption_parsed_elements(frame: np.ndarray, elements: ParsedElements, box_ids: List[int], caption_model_processor, prompt=None, batch_size=128, caption_cache=None, caption_batcher=None) -> Dict[int, str]:
+    """captions of elements[box_ids] of a lazily captioned parse, {box id: caption}
+
+    Icons without a caption yet are cropped from `frame` and captioned, their content is updated in place so
+    later calls are answered from `elements`. Text elements and icons labelled with OCR text return their content.
+    Raises ValueError for box ids outside of elements.
+    """
+    invalid = [i for i in box_ids if not 0 <= i < len(elements)]
+    if invalid:
+        raise ValueError(f"Unknown box ids {invalid}, the parse has {len(elements)} elements")
+    pending = sorted({i for i in box_ids if elements.content[i] < 0 or elements.sources[elements.source[i]] == 'box_yolo_uncaptioned'})
+    if pending:
+        boxes = torch.from_numpy(elements.bbox[pending])
+        captions = get_parsed_content_icon(boxes, 0, frame, caption_model_processor, prompt=prompt, batch_size=batch_size, caption_cache=caption_cache, caption_batcher=caption_batcher)
+        for i, caption in zip(pending, captions):
+            elements.set_content(i, caption, 'box_yolo_content_yolo')
+    return {i: elements.content_of(i) for i in box_ids}
 
 def get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor):
     to_pil = ToPILImage()
@@ -208,11 +328,15 @@ def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
     filtered_boxes = []
     if ocr_bbox:
         filtered_boxes.extend(ocr_bbox)
+    # only boxes sharing a grid cell can overlap, IoU of disjoint boxes is 0
+    box_index = GridIndex(boxes)
+    ocr_index = GridIndex(ocr_bbox) if ocr_bbox else None
     # print('ocr_bbox!!!', ocr_bbox)
     for i, box1 in enumerate(boxes):
         # if not any(IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2) for j, box2 in enumerate(boxes) if i != j):
         is_valid_box = True
-        for j, box2 in enumerate(boxes):
+        for j in box_index.query(box1):
+            box2 = boxes[j]
             # keep the smaller box
             if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
                 is_valid_box = False
@@ -221,7 +345,7 @@ def remove_overlap(boxes, iou_threshold, ocr_bbox=None):
             # add the following 2 lines to include ocr bbox
             if ocr_bbox:
                 # only add the box if it does not overlap with any ocr bbox
-                if not any(IoU(box1, box3) > iou_threshold and not is_inside(box1, box3) for k, box3 in enumerate(ocr_bbox)):
+                if not any(IoU(box1, ocr_bbox[k]) > iou_threshold and not is_inside(box1, ocr_bbox[k]) for k in ocr_index.query(box1)):
                     filtered_boxes.append(box1)
             else:
                 filtered_boxes.append(box1)
@@ -266,13 +390,16 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
     filtered_boxes = []
     if ocr_bbox:
         filtered_boxes.extend(ocr_bbox)
+    # only boxes sharing a grid cell can overlap, query results keep the original (ascending) order
+    box_index = GridIndex([box['bbox'] for box in boxes])
+    ocr_index = GridIndex([box['bbox'] for box in ocr_bbox]) if ocr_bbox else None
     # print('ocr_bbox!!!', ocr_bbox)
     for i, box1_elem in enumerate(boxes):
         box1 = box1_elem['bbox']
         is_valid_box = True
-        for j, box2_elem in enumerate(boxes):
+        for j in box_index.query(box1):
             # keep the smaller box
-            box2 = box2_elem['bbox']
+            box2 = boxes[j]['bbox']
             if i != j and IoU(box1, box2) > iou_threshold and box_area(box1) > box_area(box2):
                 is_valid_box = False
                 break
@@ -281,7 +408,8 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
                 # keep yolo boxes + prioritize ocr label
                 box_added = False
                 ocr_labels = ''
-                for box3_elem in ocr_bbox:
+                for k in ocr_index.query(box1):
+                    box3_elem = ocr_bbox[k]
                     if not box_added:
                         box3 = box3_elem['bbox']
                         if is_inside(box3, box1): # ocr inside icon
@@ -309,6 +437,116 @@ def remove_overlap_new(boxes, iou_threshold, ocr_bbox=None):
     return filtered_boxes # torch.tensor(filtered_boxes)
 
 
+def _box_area_np(boxes):
+    return (boxes[..., 2] - boxes[..., 0]) * (boxes[..., 3] - boxes[..., 1])
+
+
+def _intersection_area_np(boxes1, boxes2):
+    """elementwise intersection area of two broadcastable (..., 4) xyxy arrays"""
+    x1 = np.maximum(boxes1[..., 0], boxes2[..., 0])
+    y1 = np.maximum(boxes1[..., 1], boxes2[..., 1])
+    x2 = np.minimum(boxes1[..., 2], boxes2[..., 2])
+    y2 = np.minimum(boxes1[..., 3], boxes2[..., 3])
+    return np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+
+
+def _iou_np(intersection, area1, area2):
+    """same metric as IoU in remove_overlap_new (max of IoU and both containment ratios), elementwise"""
+    union = area1 + area2 - intersection + 1e-6
+    positive = (area1 > 0) & (area2 > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio1 = np.where(positive, intersection / area1, 0)
+        ratio2 = np.where(positive, intersection / area2, 0)
+    return np.maximum(np.maximum(intersection / union, ratio1), ratio2)
+
+
+# below this many query x box pairs, touching pairs are found by one dense broadcast instead of a GridIndex
+_DENSE_PAIRS_LIMIT = 200_000
+
+
+def _touching_pairs(query_xyxy, box_xyxy):
+    """(query index, box index) of the boxes intersecting or touching each query box, ordered by query then box"""
+    if len(query_xyxy) * len(box_xyxy) <= _DENSE_PAIRS_LIMIT:
+        touching = ((box_xyxy[None, :, 0] <= query_xyxy[:, None, 2]) & (box_xyxy[None, :, 2] >= query_xyxy[:, None, 0])
+                    & (box_xyxy[None, :, 1] <= query_xyxy[:, None, 3]) & (box_xyxy[None, :, 3] >= query_xyxy[:, None, 1]))
+        return np.nonzero(touching)
+    return GridIndex(box_xyxy).query_pairs(query_xyxy)
+
+
+def resolve_overlap_arrays(icon_xyxy: np.ndarray, iou_threshold, ocr_xyxy: Optional[np.ndarray] = None, ocr_has_text: Optional[np.ndarray] = None):
+    '''
+    Array core of remove_overlap_vectorized, on (N, 4) icon and (M, 4) ocr xyxy boxes.
+    Only the pairs of touching boxes are evaluated (found by a dense broadcast, or a GridIndex on large inputs),
+    IoU and containment ratios for all of them in one numpy pass instead of the python double loop, so it stays
+    fast on dense screens (400+ detections).
+
+    Returns:
+        (icons, removed, label_icons, label_ocr): indices of the icons kept (ascending), mask of the ocr boxes
+        merged into an icon, and the (icon, ocr box) pairs whose ocr text labels the icon, ordered by icon then ocr
+        box. Without ocr boxes removed and the pairs are empty.
+    '''
+    icon_xyxy = np.asarray(icon_xyxy, dtype=np.float64).reshape(-1, 4)
+    icon_area = _box_area_np(icon_xyxy)
+    qi, qj = _touching_pairs(icon_xyxy, icon_xyxy)
+    iou = _iou_np(_intersection_area_np(icon_xyxy[qi], icon_xyxy[qj]), icon_area[qi], icon_area[qj])
+    # keep the smaller box: box i is dropped if it overlaps another box j that is smaller
+    suppressed = (qi != qj) & (iou > iou_threshold) & (icon_area[qi] > icon_area[qj])
+    valid = np.bincount(qi[suppressed], minlength=len(icon_xyxy)) == 0
+
+    no_pairs = np.empty(0, dtype=np.int64)
+    if ocr_xyxy is None or not len(ocr_xyxy):
+        return np.flatnonzero(valid), np.zeros(0, dtype=bool), no_pairs, no_pairs
+
+    ocr_xyxy = np.asarray(ocr_xyxy, dtype=np.float64).reshape(-1, 4)
+    ocr_area = _box_area_np(ocr_xyxy)
+    qi, qk = _touching_pairs(icon_xyxy, ocr_xyxy)
+    intersection = _intersection_area_np(icon_xyxy[qi], ocr_xyxy[qk])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ocr_in_icon = intersection / ocr_area[qk] > 0.80
+        icon_in_ocr = intersection / icon_area[qi] > 0.80
+    # the sequential scan over ocr boxes stops at the first ocr box that contains the icon,
+    # ocr boxes before it that sit inside the icon are still merged (and removed) as in remove_overlap_new
+    blocking = icon_in_ocr & ~ocr_in_icon
+    stop = np.full(len(icon_xyxy), len(ocr_xyxy))
+    np.minimum.at(stop, qi[blocking], qk[blocking])
+    blocked = stop < len(ocr_xyxy)
+    has_text = np.ones(len(ocr_xyxy), dtype=bool) if ocr_has_text is None else np.asarray(ocr_has_text, dtype=bool)
+    merged = ocr_in_icon & has_text[qk] & (qk < stop[qi]) & valid[qi]
+    removed = np.bincount(qk[merged], minlength=len(ocr_xyxy)) > 0
+    return np.flatnonzero(valid & ~blocked), removed, qi[merged], qk[merged]
+
+
+def remove_overlap_vectorized(boxes, iou_threshold, ocr_bbox=None):
+    '''
+    Batched version of remove_overlap_new, same input/output format and same filtered_boxes (see resolve_overlap_arrays).
+    '''
+    assert ocr_bbox is None or isinstance(ocr_bbox, List)
+    if len(boxes) == 0:
+        return list(ocr_bbox) if ocr_bbox else []
+
+    icon_xyxy = np.asarray([box['bbox'] for box in boxes], dtype=np.float64).reshape(-1, 4)
+    if not ocr_bbox:
+        icons, _, _, _ = resolve_overlap_arrays(icon_xyxy, iou_threshold)
+        return [boxes[i]['bbox'] for i in icons]
+
+    ocr_xyxy = np.asarray([box['bbox'] for box in ocr_bbox], dtype=np.float64).reshape(-1, 4)
+    has_text = np.array([isinstance(box['content'], str) for box in ocr_bbox])
+    icons, removed, label_icons, label_ocr = resolve_overlap_arrays(icon_xyxy, iou_threshold, ocr_xyxy, has_text)
+
+    # pairs are ordered by icon then by ocr index, so labels are gathered in the original order
+    labels = {}
+    for i, k in zip(label_icons, label_ocr):
+        labels[i] = labels.get(i, '') + ocr_bbox[k]['content'] + ' '
+    filtered_boxes = [box for box, drop in zip(ocr_bbox, removed) if not drop]
+    for i in icons:
+        ocr_labels = labels.get(i, '')
+        if ocr_labels:
+            filtered_boxes.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': ocr_labels, 'source':'box_yolo_content_ocr'})
+        else:
+            filtered_boxes.append({'type': 'icon', 'bbox': boxes[i]['bbox'], 'interactivity': True, 'content': None, 'source':'box_yolo_content_yolo'})
+    return filtered_boxes
+
+
 def load_image(image_path: str) -> Tuple[np.array, torch.Tensor]:
     transform = T.Compose(
         [
@@ -375,10 +613,24 @@ def predict(model, image, caption, box_threshold, text_threshold):
     return boxes, logits, phrases
 
 
+def _stage(timer, name):
+    """timer.stage(name) when a StageTimer is given, a no-op otherwise"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+# ultralytics predictors keep per call state on the model, concurrent requests take turns
+_yolo_lock = threading.Lock()
+
+
 def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.7):
     """ Use huggingface model to replace the original model
     """
     # model = model['model']
+    with _yolo_lock:
+        return _predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold)
+
+
+def _predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold):
     if scale_img:
         result = model.predict(
         source=image,
@@ -398,29 +650,86 @@ def predict_yolo(model, image, box_threshold, imgsz, scale_img, iou_threshold=0.
 
     return boxes, conf, phrases
 
+
+def predict_yolo_batch(model, images, box_threshold, imgsz=None, iou_threshold=0.1):
+    """predict_yolo on several frames in one batched predict call, one (xyxy, conf, phrases) per frame in order"""
+    kwargs = {'imgsz': imgsz} if imgsz else {}
+    with _yolo_lock:
+        results = model.predict(source=list(images), conf=box_threshold, iou=iou_threshold, **kwargs)
+    return [(r.boxes.xyxy, r.boxes.conf, [str(i) for i in range(len(r.boxes.xyxy))]) for r in results]
+
+
+def predict_yolo_tiles(model, image: Image.Image, box_threshold, tile_size=1280, overlap=128, iou_threshold=0.1):
+    """predict_yolo on overlapping native resolution tiles of a large frame, run as one batch and stitched back
+    into frame pixel coordinates (see util.tiling)"""
+    w, h = image.size
+    tiles = tile_grid(w, h, tile_size, overlap)
+    crops = [image.crop(tuple(tile)) for tile in tiles]
+    with _yolo_lock:
+        results = model.predict(source=crops, conf=box_threshold, imgsz=tile_size, iou=iou_threshold)
+    boxes, conf, _ = stitch_tile_boxes([(r.boxes.xyxy, r.boxes.conf) for r in results], tiles, w, h)
+    phrases = [str(i) for i in range(len(boxes))]
+    return boxes, conf, phrases
+
+
+def check_ocr_box_tiled(image_source: Image.Image, tile_size=1280, overlap=128, **ocr_kwargs):
+    """check_ocr_box (xyxy output) per overlapping tile, OCR engines downscale large frames internally and lose small text"""
+    w, h = image_source.size
+    tiles = tile_grid(w, h, tile_size, overlap)
+    results = [check_ocr_box(image_source.crop(tuple(tile)), display_img=False, output_bb_format='xyxy', **ocr_kwargs)[0] for tile in tiles]
+    return stitch_tile_text(results, tiles, w, h), None
+
+def to_rgb_frame(image_source: Union[str, Image.Image, np.ndarray]) -> np.ndarray:
+    """(h, w, 3) uint8 RGB array of a file path, PIL image or array. An array already in that form is returned as is,
+    not copied, every stage of a parse reads the same frame and none of them writes to it"""
+    if isinstance(image_source, np.ndarray):
+        if image_source.ndim == 2:
+            return np.repeat(image_source[:, :, None], 3, axis=2)
+        # RGBA frames, the alpha channel is dropped
+        return image_source[:, :, :3] if image_source.shape[2] > 3 else image_source
+    if isinstance(image_source, str):
+        image_source = Image.open(image_source)
+    return np.asarray(image_source.convert('RGB'))
+
 def int_box_area(box, w, h):
     x1, y1, x2, y2 = box
     int_box = [int(x1*w), int(y1*h), int(x2*w), int(y2*h)]
     area = (int_box[2] - int_box[0]) * (int_box[3] - int_box[1])
     return area
 
-def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128):
+def int_box_areas(xyxy: np.ndarray, w, h) -> np.ndarray:
+    """int_box_area of (N, 4) xyxy ratio boxes"""
+    int_boxes = (np.asarray(xyxy, dtype=np.float64).reshape(-1, 4) * np.array([w, h, w, h])).astype(np.int64)
+    return (int_boxes[:, 2] - int_boxes[:, 0]) * (int_boxes[:, 3] - int_boxes[:, 1])
+
+def get_som_labeled_img(image_source: Union[str, Image.Image, np.ndarray], model=None, BOX_TRESHOLD=0.01, output_coord_in_ratio=False, ocr_bbox=None, text_scale=0.4, text_padding=5, draw_bbox_config=None, caption_model_processor=None, ocr_text=[], use_local_semantics=True, iou_threshold=0.9,prompt=None, scale_img=False, imgsz=None, batch_size=128, caption_cache=None, yolo_result=None, caption_batcher=None, render_som=True, image_codec=None, timer=None, caption_policy=None, base64_image=True):
     """Process either an image path or Image object
     
     Args:
-        image_source: Either a file path (str) or PIL Image object
+        image_source: A file path (str), PIL Image object or RGB frame (h, w, 3 uint8 array, not copied)
         ...
+        caption_cache: optional CaptionCache, icons already captioned are not sent to the caption model again
+        yolo_result: optional (xyxy, logits, phrases) of predict_yolo on this image, when detection already ran elsewhere
+        caption_batcher: optional CaptionBatcher shared by concurrent requests
+        render_som: when False the annotated image is neither drawn nor encoded, encoded_image is None (see render_som_image)
+        image_codec: codec spec of encoded_image, e.g. "png", "png:1", "jpeg:85", "webp-lossless" (see util.image_codec)
+        timer: optional StageTimer collecting the per stage durations (detection, overlap, crop, caption, annotate, encode)
+        caption_policy: optional CaptionPolicy, drops tiny icons and limits what is sent to the caption model (see util.caption_policy)
+        base64_image: False returns encoded_image as bytes, for binary responses
+    Returns:
+        (encoded_image, label_coordinates, elements), elements the ParsedElements (see util.parsed_elements), text
+        elements first and icons with content None (not captioned) last
     """
-    if isinstance(image_source, str):
-        image_source = Image.open(image_source)
-    image_source = image_source.convert("RGB") # for CLIP
-    w, h = image_source.size
+    image_source = to_rgb_frame(image_source) # for CLIP
+    h, w = image_source.shape[:2]
     if not imgsz:
         imgsz = (h, w)
     # print('image size:', w, h)
-    xyxy, logits, phrases = predict_yolo(model=model, image=image_source, box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+    if yolo_result is None:
+        with _stage(timer, 'detection'):
+            yolo_result = predict_yolo(model=model, image=Image.fromarray(image_source), box_threshold=BOX_TRESHOLD, imgsz=imgsz, scale_img=scale_img, iou_threshold=0.1)
+    xyxy, logits, phrases = yolo_result
     xyxy = xyxy / torch.Tensor([w, h, w, h]).to(xyxy.device)
-    image_source = np.asarray(image_source)
     phrases = [str(i) for i in range(len(phrases))]
 
     # annotate the image with labels
@@ -429,17 +738,38 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
         ocr_bbox=ocr_bbox.tolist()
     else:
         print('no ocr bbox!!!')
-        ocr_bbox = None
+        ocr_bbox = []
 
-    ocr_bbox_elem = [{'type': 'text', 'bbox':box, 'interactivity':False, 'content':txt, 'source': 'box_ocr_content_ocr'} for box, txt in zip(ocr_bbox, ocr_text) if int_box_area(box, w, h) > 0] 
-    xyxy_elem = [{'type': 'icon', 'bbox':box, 'interactivity':True, 'content':None} for box in xyxy.tolist() if int_box_area(box, w, h) > 0]
-    filtered_boxes = remove_overlap_new(boxes=xyxy_elem, iou_threshold=iou_threshold, ocr_bbox=ocr_bbox_elem)
-    
-    # sort the filtered_boxes so that the one with 'content': None is at the end, and get the index of the first 'content': None
-    filtered_boxes_elem = sorted(filtered_boxes, key=lambda x: x['content'] is None)
-    # get the index of the first 'content': None
-    starting_idx = next((i for i, box in enumerate(filtered_boxes_elem) if box['content'] is None), -1)
-    filtered_boxes = torch.tensor([box['bbox'] for box in filtered_boxes_elem])
+    with _stage(timer, 'overlap'):
+        # elements are built as columns (see util.parsed_elements), ocr boxes first then the icons kept
+        ocr_xyxy = np.asarray(ocr_bbox, dtype=np.float32).reshape(-1, 4)[:len(ocr_text)]
+        ocr_keep = np.flatnonzero(int_box_areas(ocr_xyxy, w, h) > 0)
+        ocr_xyxy, ocr_content = ocr_xyxy[ocr_keep], [ocr_text[k] for k in ocr_keep]
+        icon_xyxy = xyxy.cpu().numpy().astype(np.float32).reshape(-1, 4)
+        icon_xyxy = icon_xyxy[int_box_areas(icon_xyxy, w, h) > 0]
+        ocr_has_text = np.array([isinstance(txt, str) for txt in ocr_content], dtype=bool)
+        icons, removed, label_icons, label_ocr = resolve_overlap_arrays(icon_xyxy, iou_threshold, ocr_xyxy, ocr_has_text)
+        # pairs are ordered by icon then by ocr index, so labels are gathered in the original order
+        labels = {}
+        for i, k in zip(label_icons.tolist(), label_ocr.tolist()):
+            labels[i] = labels.get(i, '') + ocr_content[k] + ' '
+        text_rows = np.flatnonzero(~removed) if len(removed) else np.arange(len(ocr_xyxy))
+        bbox = np.concatenate([ocr_xyxy[text_rows], icon_xyxy[icons]])
+        types = ['text'] * len(text_rows) + ['icon'] * len(icons)
+        contents = [ocr_content[k] for k in text_rows] + [labels.get(i) or None for i in icons.tolist()]
+        sources = ['box_ocr_content_ocr'] * len(text_rows) + ['box_yolo_content_ocr' if labels.get(i) else 'box_yolo_content_yolo' for i in icons.tolist()]
+        uncaptioned = np.array([content is None for content in contents], dtype=bool)
+        if caption_policy is not None:
+            keep = np.flatnonzero(~caption_policy.small_icons(bbox, uncaptioned, w, h))
+            bbox, uncaptioned = bbox[keep], uncaptioned[keep]
+            types, contents, sources = [types[i] for i in keep], [contents[i] for i in keep], [sources[i] for i in keep]
+
+    # sort the elements so that the ones with content None are at the end, and get the index of the first one
+    order = np.argsort(uncaptioned, kind='stable')
+    bbox, uncaptioned = bbox[order], uncaptioned[order]
+    types, contents, sources = [types[i] for i in order], [contents[i] for i in order], [sources[i] for i in order]
+    starting_idx = int(np.argmax(uncaptioned)) if uncaptioned.any() else -1
+    filtered_boxes = torch.from_numpy(np.ascontiguousarray(bbox, dtype=np.float32))
     print('len(filtered_boxes):', len(filtered_boxes), starting_idx)
 
     # get parsed icon local semantics
@@ -447,16 +777,19 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
     if use_local_semantics:
         caption_model = caption_model_processor['model']
         if 'phi3_v' in caption_model.config.model_type: 
-            parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
+            with _stage(timer, 'caption'):
+                parsed_content_icon = get_parsed_content_icon_phi3v(filtered_boxes, ocr_bbox, image_source, caption_model_processor)
         else:
-            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size)
+            parsed_content_icon = get_parsed_content_icon(filtered_boxes, starting_idx, image_source, caption_model_processor, prompt=prompt,batch_size=batch_size, caption_cache=caption_cache, caption_batcher=caption_batcher, timer=timer, caption_policy=caption_policy)
         ocr_text = [f"Text Box ID {i}: {txt}" for i, txt in enumerate(ocr_text)]
         icon_start = len(ocr_text)
         parsed_content_icon_ls = []
-        # fill the filtered_boxes_elem None content with parsed_content_icon in order
-        for i, box in enumerate(filtered_boxes_elem):
-            if box['content'] is None:
-                box['content'] = parsed_content_icon.pop(0)
+        # fill the None contents with parsed_content_icon in order
+        for i in np.flatnonzero(uncaptioned).tolist():
+            contents[i] = parsed_content_icon.pop(0)
+            if contents[i] is None:
+                # left out by the caption policy's max_captions
+                contents[i], sources[i] = '', 'box_yolo_uncaptioned'
         for i, txt in enumerate(parsed_content_icon):
             parsed_content_icon_ls.append(f"Icon Box ID {str(i+icon_start)}: {txt}")
         parsed_content_merged = ocr_text + parsed_content_icon_ls
@@ -465,25 +798,204 @@ def get_som_labeled_img(image_source: Union[str, Image.Image], model=None, BOX_T
         parsed_content_merged = ocr_text
     print('time to get parsed content:', time.time()-time1)
 
-    filtered_boxes = box_convert(boxes=filtered_boxes, in_fmt="xyxy", out_fmt="cxcywh")
+    if render_som:
+        encoded_image, label_coordinates = render_som_image(image_source, filtered_boxes, draw_bbox_config=draw_bbox_config, text_scale=text_scale, text_padding=text_padding, output_coord_in_ratio=output_coord_in_ratio, image_codec=image_codec, timer=timer, base64_image=base64_image)
+    else:
+        encoded_image, label_coordinates = None, som_label_coordinates(filtered_boxes, w, h, output_coord_in_ratio=output_coord_in_ratio)
+
+    interactivity = [t == 'icon' for t in types]
+    return encoded_image, label_coordinates, ParsedElements.from_columns(filtered_boxes.numpy(), types, interactivity, contents, sources)
+
+
+def som_label_coordinates(boxes: torch.Tensor, w, h, output_coord_in_ratio=False):
+    """label_coordinates of render_som_image (xywh per label) without drawing anything"""
+    boxes = torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4) * torch.Tensor([w, h, w, h])
+    xywh = box_convert(boxes=box_convert(boxes=boxes, in_fmt="xyxy", out_fmt="cxcywh"), in_fmt="cxcywh", out_fmt="xywh").numpy()
+    label_coordinates = {f"{phrase}": v for phrase, v in enumerate(xywh)}
+    if output_coord_in_ratio:
+        label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
+    return label_coordinates
+
+
+def render_som_image(image_source: np.ndarray, boxes: torch.Tensor, draw_bbox_config=None, text_scale=0.4, text_padding=5, output_coord_in_ratio=False, image_codec=None, timer=None, base64_image=True):
+    """Draws the numbered set-of-mark boxes on the frame and encodes it, base64 unless base64_image is False
+
+    Args:
+        image_source: RGB frame, (h, w, 3)
+        boxes: xyxy boxes in ratio of the frame size, one per parsed element in parsed_content_list order
+        image_codec: codec spec, PNG at default compression when None
+        timer: optional StageTimer, records the 'annotate' and 'encode' stages
+    Returns:
+        (encoded_image, label_coordinates)
+    """
+    h, w, _ = image_source.shape
+    filtered_boxes = box_convert(boxes=torch.as_tensor(boxes, dtype=torch.float32).reshape(-1, 4), in_fmt="xyxy", out_fmt="cxcywh")
 
     phrases = [i for i in range(len(filtered_boxes))]
     
     # draw boxes
-    if draw_bbox_config:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, **draw_bbox_config)
-    else:
-        annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=logits, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
+    with _stage(timer, 'annotate'):
+        if draw_bbox_config:
+            annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, **draw_bbox_config)
+        else:
+            annotated_frame, label_coordinates = annotate(image_source=image_source, boxes=filtered_boxes, logits=None, phrases=phrases, text_scale=text_scale, text_padding=text_padding)
     
-    pil_img = Image.fromarray(annotated_frame)
-    buffered = io.BytesIO()
-    pil_img.save(buffered, format="PNG")
-    encoded_image = base64.b64encode(buffered.getvalue()).decode('ascii')
+    with _stage(timer, 'encode'):
+        pil_img = Image.fromarray(annotated_frame)
+        encoded_image = encode_image_base64(pil_img, image_codec) if base64_image else encode_image(pil_img, image_codec)
     if output_coord_in_ratio:
         label_coordinates = {k: [v[0]/w, v[1]/h, v[2]/w, v[3]/h] for k, v in label_coordinates.items()}
         assert w == annotated_frame.shape[1] and h == annotated_frame.shape[0]
 
-    return encoded_image, label_coordinates, filtered_boxes_elem
+    return encoded_image, label_coordinates
+
+
+_parse_executor = None
+
+
+def _get_parse_executor():
+    global _parse_executor
+    if _parse_executor is None:
+        _parse_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='omniparser-ocr')
+    return _parse_executor
+
+
+# adaptive detection mode of parse_screen, learns the detection cost of this host
+_detection_planner = DetectionModePlanner()
+
+
+def parse_screen(image_source: Union[str, Image.Image, np.ndarray], model, caption_model_processor, ocr_kwargs=None, executor=None,
+                 detection_mode=None, latency_budget_ms=None, planner=None, timer=None, **som_kwargs):
+    """OCR and icon detection run concurrently (both spend their time in native code), then overlap filtering,
+    captioning and rendering run in get_som_labeled_img as usual.
+
+    The frame is decoded once into an RGB array shared by OCR, cropping and rendering (the detector gets a PIL view
+    of it), nothing is written to disk.
+
+    Args:
+        image_source: a file path, PIL image or RGB frame (h, w, 3 uint8 array, not copied)
+        ocr_kwargs: keyword arguments for check_ocr_box (easyocr_args, use_paddleocr, ...)
+        executor: optional executor running the OCR stage, a shared 2 thread pool by default
+        detection_mode: None runs detection as get_som_labeled_img would (scale_img / imgsz), otherwise
+            'full' (native resolution), 'tiled' (overlapping native tiles, OCR tiled too), 'downscaled'
+            (detector default input size) or 'adaptive' (picked per frame by the planner, see util.tiling)
+        latency_budget_ms: detection budget of the adaptive mode
+        planner: DetectionModePlanner of the tiled/adaptive modes (tile size, overlap, cost model), a shared one by default
+        timer: optional StageTimer, e.g. already holding the caller's 'decode' stage
+        som_kwargs: keyword arguments for get_som_labeled_img (BOX_TRESHOLD, draw_bbox_config, iou_threshold, ...)
+    Returns:
+        (encoded_image, label_coordinates, elements, timings), elements the ParsedElements of get_som_labeled_img,
+        timings in seconds per stage: decode, ocr,
+        detection, overlap, crop, caption, annotate, encode, and total. 'ocr_detection' is the wall-clock time of the
+        two concurrent stages, compare with 'ocr' + 'detection'. 'labeling' covers overlap through encode.
+        With a detection_mode, timings['detection_mode'] is the mode that ran.
+    """
+    timer = timer or StageTimer()
+    start = time.perf_counter()
+    with timer.stage('decode'):
+        # decoded once here, PIL images load lazily and must not be loaded from two threads
+        frame = to_rgb_frame(image_source)
+        image_source = Image.fromarray(frame)
+    h, w = frame.shape[:2]
+    planner = planner or _detection_planner
+    box_threshold = som_kwargs.get('BOX_TRESHOLD', 0.01)
+    mode = detection_mode
+    if mode == 'adaptive':
+        mode = planner.choose(w, h, latency_budget_ms)
+
+    def run_ocr():
+        with timer.stage('ocr'):
+            if mode == 'tiled':
+                return check_ocr_box_tiled(image_source, planner.tile_size, planner.overlap, **(ocr_kwargs or {}))
+            return check_ocr_box(frame, display_img=False, output_bb_format='xyxy', **(ocr_kwargs or {}))
+
+    parallel_start = time.perf_counter()
+    ocr_future = (executor or _get_parse_executor()).submit(run_ocr)
+    with timer.stage('detection'):
+        detection_start = time.perf_counter()
+        if mode == 'tiled':
+            yolo_result = predict_yolo_tiles(model, image_source, box_threshold, planner.tile_size, planner.overlap)
+            planner.observe('tiled', planner.tiled_megapixels(w, h), time.perf_counter() - detection_start)
+        elif mode == 'full':
+            yolo_result = predict_yolo(model=model, image=image_source, box_threshold=box_threshold, imgsz=(h, w), scale_img=True, iou_threshold=0.1)
+            planner.observe('full', w * h / 1e6, time.perf_counter() - detection_start)
+        elif mode == 'downscaled':
+            yolo_result = predict_yolo(model=model, image=image_source, box_threshold=box_threshold, imgsz=None, scale_img=False, iou_threshold=0.1)
+        else:
+            yolo_result = predict_yolo(model=model, image=image_source, box_threshold=box_threshold, imgsz=som_kwargs.get('imgsz') or (h, w),
+                                       scale_img=som_kwargs.get('scale_img', False), iou_threshold=0.1)
+    (text, ocr_bbox), _ = ocr_future.result()
+    timer.add('ocr_detection', time.perf_counter() - parallel_start)
+
+    with timer.stage('labeling'):
+        encoded_image, label_coordinates, elements = get_som_labeled_img(frame, model, ocr_bbox=ocr_bbox, ocr_text=text, caption_model_processor=caption_model_processor,
+                                                                         yolo_result=yolo_result, timer=timer, **som_kwargs)
+    timer.add('total', time.perf_counter() - start)
+    timings = timer.as_dict()
+    if mode is not None:
+        timings['detection_mode'] = mode
+    return encoded_image, label_coordinates, elements, timings
+
+
+def parse_screen_batch(image_sources: List[Union[str, Image.Image, np.ndarray]], model, caption_model_processor, ocr_kwargs=None, executor=None,
+                       draw_bbox_configs=None, caption_wait_ms=50.0, **som_kwargs):
+    """parse_screen over several frames at once. The OCR of every frame runs concurrently with one batched detector
+    predict over all of them, then the frames are labelled concurrently and their icon crops meet in shared caption
+    generate calls (a CaptionBatcher of this call, collecting crops for up to caption_wait_ms).
+
+    Detection runs at the detector's input size (or som_kwargs' imgsz with scale_img), the detection modes of
+    parse_screen are not available.
+
+    Args:
+        draw_bbox_configs: optional draw_bbox_config of each frame, som_kwargs' draw_bbox_config otherwise
+        som_kwargs: keyword arguments for get_som_labeled_img, its caption_batcher is not used
+    Returns:
+        (results, timings): one (encoded_image, label_coordinates, elements) per frame in order, and the
+        seconds of the batch: decode, detection (the one predict call), ocr_detection (OCR of all frames and
+        detection, wall-clock), labeling (all frames), total
+    """
+    timer = StageTimer()
+    start = time.perf_counter()
+    with timer.stage('decode'):
+        frames = [to_rgb_frame(image_source) for image_source in image_sources]
+    if not frames:
+        return [], timer.as_dict()
+    som_kwargs.pop('caption_batcher', None)
+    default_draw_bbox_config = som_kwargs.pop('draw_bbox_config', None)
+
+    def run_ocr(frame):
+        (text, ocr_bbox), _ = check_ocr_box(frame, display_img=False, output_bb_format='xyxy', **(ocr_kwargs or {}))
+        return text, ocr_bbox
+
+    parallel_start = time.perf_counter()
+    ocr_futures = [(executor or _get_parse_executor()).submit(run_ocr, frame) for frame in frames]
+    with timer.stage('detection'):
+        imgsz = som_kwargs.get('imgsz') if som_kwargs.get('scale_img') else None
+        yolo_results = predict_yolo_batch(model, [Image.fromarray(frame) for frame in frames], som_kwargs.get('BOX_TRESHOLD', 0.01), imgsz=imgsz)
+    ocr_results = [future.result() for future in ocr_futures]
+    timer.add('ocr_detection', time.perf_counter() - parallel_start)
+
+    caption_batcher = None
+    if caption_model_processor is not None and som_kwargs.get('use_local_semantics', True):
+        # caption_batcher imports this module
+        from util.caption_batcher import CaptionBatcher
+        caption_batcher = CaptionBatcher(caption_model_processor, batch_size=som_kwargs.get('batch_size', 128), max_wait_ms=caption_wait_ms)
+
+    def label(i):
+        text, ocr_bbox = ocr_results[i]
+        draw_bbox_config = draw_bbox_configs[i] if draw_bbox_configs else default_draw_bbox_config
+        return get_som_labeled_img(frames[i], model, ocr_bbox=ocr_bbox, ocr_text=text, caption_model_processor=caption_model_processor,
+                                   yolo_result=yolo_results[i], caption_batcher=caption_batcher, draw_bbox_config=draw_bbox_config, **som_kwargs)
+
+    try:
+        with timer.stage('labeling'):
+            with ThreadPoolExecutor(max_workers=len(frames), thread_name_prefix='omniparser-batch') as pool:
+                results = list(pool.map(label, range(len(frames))))
+    finally:
+        if caption_batcher is not None:
+            caption_batcher.close()
+    timer.add('total', time.perf_counter() - start)
+    return results, timer.as_dict()
 
 
 def get_xywh(input):
@@ -501,28 +1013,25 @@ def get_xywh_yolo(input):
     x, y, w, h = int(x), int(y), int(w), int(h)
     return x, y, w, h
 
-def check_ocr_box(image_source: Union[str, Image.Image], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False):
-    if isinstance(image_source, str):
-        image_source = Image.open(image_source)
-    if image_source.mode == 'RGBA':
-        # Convert RGBA to RGB to avoid alpha channel issues
-        image_source = image_source.convert('RGB')
-    image_np = np.array(image_source)
-    w, h = image_source.size
-    if use_paddleocr:
-        if easyocr_args is None:
-            text_threshold = 0.5
-        else:
-            text_threshold = easyocr_args['text_threshold']
-        result = paddle_ocr.ocr(image_np, cls=False)[0]
-        coord = [item[0] for item in result if item[1][1] > text_threshold]
-        text = [item[1][0] for item in result if item[1][1] > text_threshold]
-    else:  # EasyOCR
-        if easyocr_args is None:
-            easyocr_args = {}
-        result = reader.readtext(image_np, **easyocr_args)
-        coord = [item[0] for item in result]
-        text = [item[1] for item in result]
+def check_ocr_box(image_source: Union[str, Image.Image, np.ndarray], display_img = True, output_bb_format='xywh', goal_filtering=None, easyocr_args=None, use_paddleocr=False, ocr_engine=None, ocr_processes=0, line_cache=None):
+    """ocr_engine: name of a registered OCR engine (util.ocr_engines), defaults to 'paddleocr' or 'easyocr' depending on use_paddleocr
+    ocr_processes: when > 1, the frame is split in that many overlapping horizontal bands read in parallel by a
+        persistent pool of worker processes (see util.ocr_pool)
+    line_cache: optional TextLineCache (util.ocr_line_cache), only the text lines not read on earlier frames go through
+        the recognizer. Needs an engine with read_cached (paddleocr), not combined with ocr_processes
+    image_source: a file path, PIL image or RGB frame (read, not copied)"""
+    # RGBA is converted to RGB to avoid alpha channel issues
+    image_np = to_rgb_frame(image_source)
+    h, w = image_np.shape[:2]
+    if ocr_engine is None:
+        ocr_engine = 'paddleocr' if use_paddleocr else 'easyocr'
+    if line_cache is not None:
+        check_line_cache(ocr_engine, ocr_processes)
+        coord, text = get_ocr_engine(ocr_engine).read_cached(image_np, easyocr_args, line_cache)
+    elif ocr_processes > 1:
+        coord, text = get_ocr_pool(ocr_engine, ocr_processes).read(image_np, easyocr_args)
+    else:
+        coord, text = get_ocr_engine(ocr_engine).read(image_np, easyocr_args)
     if display_img:
         opencv_img = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
         bb = []
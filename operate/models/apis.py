@@ -14,7 +14,6 @@ from ultralytics import YOLO
 from loguru import logger
 import time 
 import requests
-import pandas as pd
 
 
 from operate.config import Config
@@ -775,11 +774,7 @@ async def call_custom_gpt(messages, objective, model):
         )
         if operation.get("operation") == "click":
             logger.success("Click operation received.")
-            img_base64_labeled, parsed_content_list = add_custom_labels(img_base64)
-
-            df = pd.DataFrame(parsed_content_list)
-            df['ID'] = '~' + df.index.astype(str) # To match the previous version of code
-
+            img_base64_labeled, df = add_custom_labels(img_base64)
             label_coordinates = dict(zip(df['ID'], df['bbox'])) # To match the previous version of code
             logger.success("Label Coordinates")
             print(label_coordinates)
@@ -955,11 +950,7 @@ async def call_custom_gemini(messages, objective, model):
         )
         if operation.get("operation") == "click":
             logger.success("Click operation received.")
-            img_base64_labeled, parsed_content_list = add_custom_labels(img_base64)
-
-            df = pd.DataFrame(parsed_content_list)
-            df['ID'] = '~' + df.index.astype(str)
-
+            img_base64_labeled, df = add_custom_labels(img_base64)
             label_coordinates = dict(zip(df['ID'], df['bbox']))
             logger.success("Label Coordinates")
             print(label_coordinates)
@@ -1083,11 +1074,7 @@ async def call_fast_gpt(messages, objective, model):
             user_prompt,
         )
 
-    img_base64_labeled, parsed_content_list = add_custom_labels(img_base64)
-
-    df = pd.DataFrame(parsed_content_list)
-    df['ID'] = '~' + df.index.astype(str) # To match the previous version of code
-
+    img_base64_labeled, df = add_custom_labels(img_base64)
     label_coordinates = dict(zip(df['ID'], df['bbox'])) # To match the previous version of code
     logger.success("Label Coordinates")
     print(label_coordinates)
@@ -1244,11 +1231,7 @@ def call_fast_gemini(messages, objective):
     if config.verbose:
         print("[call_gemini_pro_vision] model", model)
 
-    img_base64_labeled, parsed_content_list = add_custom_labels(img_base64)
-
-    df = pd.DataFrame(parsed_content_list)
-    df['ID'] = '~' + df.index.astype(str) # To match the previous version of code
-
+    img_base64_labeled, df = add_custom_labels(img_base64)
     label_coordinates = dict(zip(df['ID'], df['bbox'])) # To match the previous version of code
     logger.success("Label Coordinates")
     print(label_coordinates)
@@ -5,10 +5,20 @@ import os
 import time
 import asyncio
 import requests
+import numpy as np
 import pandas as pd
 from PIL import Image, ImageDraw
 from loguru import logger
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+LABEL_SERVER_URL = "http://localhost:8001/label/"
+# version of the columnar elements the label server sends, see parsed_elements_dataframe
+ELEMENTS_WIRE_FORMAT = "columnar/1"
+
 
 
 def validate_and_extract_image_data(data):
@@ -191,26 +201,96 @@ def get_click_position_in_percent(coordinates, image_size):
     return x_percent, y_percent
 
 
-def add_custom_labels(base64_data):
+def parsed_elements_dataframe(elements):
+    """
+    DataFrame of the parsed elements (type, bbox, interactivity, content, source) with their label ID ("~0", "~1", ...).
+
+    :param elements: the columnar "elements" of a /label/ response (elements_format "columnar"), or the legacy list of dicts.
+    """
+    if isinstance(elements, list):
+        df = pd.DataFrame(elements)
+    else:
+        # wire form of OmniParser's ParsedElements (OmniParser/util/parsed_elements.py), decoded here so operate
+        # doesn't import the OmniParser package: numeric columns are little-endian arrays (base64 in JSON, bytes in
+        # msgpack) or plain lists, strings are shared through tables
+        if elements.get("format") != ELEMENTS_WIRE_FORMAT:
+            raise ValueError(f"Unsupported parsed elements format {elements.get('format')!r}, expected {ELEMENTS_WIRE_FORMAT!r}")
+
+        def column(name, dtype):
+            if elements["binary"]:
+                data = elements[name]
+                return np.frombuffer(data if isinstance(data, bytes) else base64.b64decode(data), dtype=dtype)
+            return np.asarray(elements[name], dtype=dtype)
+
+        strings = np.array(elements["strings"] + [None], dtype=object)
+        df = pd.DataFrame({
+            "type": np.array(elements["types"], dtype=object)[column("type", "u1")],
+            "bbox": column("bbox", "<f4").reshape(-1, 4).tolist(),
+            "interactivity": column("interactivity", "u1").astype(bool),
+            # -1 (no content) picks the trailing None
+            "content": strings[column("content", "<i4")],
+            "source": np.array(elements["sources"], dtype=object)[column("source", "u1")],
+        })
+    df["ID"] = "~" + df.index.astype(str)
+    return df
+
+
+_binary_transport = True
+
+
+def post_label_upload(image_bytes, options):
+    """
+    Sends the raw screenshot bytes to the label server's /label/upload/ endpoint, the response is msgpack (labeled image
+    as bytes) when msgpack is installed. Returns None when the server has no upload endpoint.
+    """
+    global _binary_transport
+    params = {key: str(value).lower() if isinstance(value, bool) else value for key, value in options.items() if value is not None}
+    headers = {"Content-Type": "application/octet-stream", "Accept": "application/msgpack" if msgpack is not None else "application/json"}
+    response = requests.post(LABEL_SERVER_URL + "upload/", params=params, data=image_bytes, headers=headers)
+    if response.status_code in (404, 405):
+        logger.debug("Label server without /label/upload/, using base64 JSON requests")
+        _binary_transport = False
+        return None
+    response.raise_for_status()
+    if response.headers.get("Content-Type", "").startswith("application/msgpack"):
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+
+def add_custom_labels(base64_data, incremental=False, image_codec=None, columnar=True):
+    """
+    Sends the screenshot to the OmniParser label server.
+
+    :param incremental: let the server re-parse only the screen regions that changed since the previous call.
+    :param image_codec: codec of the labeled image, e.g. "png:1", "jpeg:85" or "webp-lossless"; the server default (PNG) when None.
+    :param columnar: receive the elements in the compact columnar format instead of a list of dicts.
+    :return: the labeled image (base64) and a DataFrame of the parsed elements with their label IDs (it replaces the
+        parsed_content_list returned before), see parsed_elements_dataframe.
+    """
     logger.debug("In the custom add labels function.")
     image_bytes = base64.b64decode(base64_data)
+    options = {"incremental": incremental, "image_codec": image_codec, "elements_format": "columnar" if columnar else "dicts"}
 
     # results = yolo_model(image_labeled)
     begin = time.time()
-    response = requests.post(
-            url='http://localhost:8001/label/',
-            json={"image_base64": base64_data}    
-        )
+    data = post_label_upload(image_bytes, options) if _binary_transport else None
+    if data is None:
+        response = requests.post(url=LABEL_SERVER_URL, json={"image_base64": base64_data, **options})
+        data = response.json()
     end = time.time()
 
     logger.success(f"Response received. Took {end - begin} seconds") 
 
-    data = response.json()
-    image_labeled = data["image"]
-    parsed_content_list = data["coordinates"]
+    # already encoded by the server in the requested codec, written and passed on as is
+    labeled_image = data["image"]
+    if isinstance(labeled_image, bytes):
+        labeled_bytes, base64_image = labeled_image, base64.b64encode(labeled_image).decode("utf-8")
+    else:
+        labeled_bytes, base64_image = base64.b64decode(labeled_image), labeled_image
+    parsed_elements = parsed_elements_dataframe(data["elements"] if "elements" in data else data["coordinates"])
 
-    logger.success("Parsed Content List")
-    print(parsed_content_list)
+    logger.success(f"Parsed {len(parsed_elements)} elements")
+    print(parsed_elements)
 
     labeled_images_dir = "labeled_images"
 
@@ -222,25 +302,15 @@ def add_custom_labels(base64_data):
     timestamp = time.strftime("%Y%m%d-%H%M%S")
     logger.debug(f"Generated timestamp: {timestamp}")
 
-    output_path = os.path.join(labeled_images_dir, f"img_{timestamp}_labeled.png")
+    labeled_ext = data.get("image_type", "image/png").split("/")[-1]
+    output_path = os.path.join(labeled_images_dir, f"img_{timestamp}_labeled.{labeled_ext}")
     output_path_original = os.path.join(
         labeled_images_dir, f"img_{timestamp}_original.png"
     )
 
-
-    # Open the labeled image (ensure it's a valid PIL Image)
-    image_labeled = Image.open(io.BytesIO(base64.b64decode(image_labeled)))
-
-    # Convert image to bytes (JPEG or PNG format)
-    img_buffer = io.BytesIO()
-    image_labeled.save(img_buffer, format="PNG")  # Change format if needed
-    img_bytes = img_buffer.getvalue()
-
-    # Encode image to base64 string
-    base64_image = base64.b64encode(img_bytes).decode('utf-8')
+    with open(output_path, "wb") as f:
+        f.write(labeled_bytes)
     image_original = Image.open(io.BytesIO(image_bytes))
-
-    image_labeled.save(output_path)
     image_original.save(output_path_original)
     logger.success("add_custom_labels() ended.")
 
@@ -255,4 +325,4 @@ def add_custom_labels(base64_data):
     # img_base64_labeled = base64.b64encode(buffered_labeled.getvalue()).decode("utf-8")
     # logger.debug("Converted labeled image to base64")
 
-    return base64_image, parsed_content_list
+    return base64_image, parsed_elements